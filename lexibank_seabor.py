@@ -1,16 +1,24 @@
+import sys
 import random
 import pathlib
 import collections
 
 import attr
-from lingpy import Wordlist, evaluate
-from collabutils.edictor import fetch
 from pylexibank import Dataset as BaseDataset, Language, Lexeme, Cognate
 from clldutils.misc import slug
 from clldutils.markup import Table
 from pycldf import Sources
-import lingrex.cognates
-import lingrex.borrowing
+
+from seabor.cache import Cache, wordlist_digest
+from seabor.profiling import Profiler, stage
+
+# lingpy, lingrex, collabutils and the modules of `seabor` building on them are only imported in
+# the methods using them, since cldfbench imports this module for any command.
+
+
+# Thresholds for partial cognate detection within families and for cross-family cognate detection,
+# see paper, section "3.2 Methods" (and `seabor.thresholds` to optimise them):
+THRESHOLDS = (0.50, 0.35)
 
 
 def ref(src):
@@ -65,30 +73,194 @@ class Dataset(BaseDataset):
     cognate_class = MultiCognate
 
     _wlname = 'seabor.sqlite3'
+    # Columns of the raw wordlist read by `detect` - including the sound classes and other columns
+    # computed by LexStat, which are re-used if present:
+    _detect_columns = [
+        'doculect', 'concept', 'family', 'tokens', 'ipa', 'sonars', 'prostrings', 'classes',
+        'langid', 'numbers', 'weights', 'duplicates']
+
+    def wl(self, columns=None):
+        """
+        :param columns: Only read these columns of the raw wordlist (default: all columns).
+        """
+        from lingpy import Wordlist
+        from seabor.stream import read_wordlist
 
-    def wl(self):
+        if columns:
+            return read_wordlist(self.raw_dir / self._wlname, columns)
         return Wordlist(str(self.raw_dir / self._wlname))
 
+    def partitions(self, columns):
+        """
+        Partition the raw wordlist by concept, keeping only the given columns.
+
+        :return: `seabor.stream.Partitions` instance.
+        """
+        from seabor.stream import Partitions
+
+        return Partitions(self.raw_dir / self._wlname, columns, self.dir / '.cache' / 'partitions')
+
     def cmd_download(self, args):
+        from collabutils.edictor import fetch
+        from seabor.stream import iter_rows
+
         fetch("seabor",
               outdir=self.raw_dir,
               remote_dbase=self._wlname,
               base_url="https://digling.org/edictor/")
         sources = Sources.from_file(self.raw_dir / 'sources.bib')
-        wl = self.wl()
-        datasets = collections.defaultdict(lambda: collections.defaultdict(list))
-        langs = collections.defaultdict(lambda: collections.defaultdict(list))
-        for idx in wl:
-            datasets[wl[idx, 'dataset']][wl[idx, 'concept']] += [wl[idx, 'doculect']]
-            langs[wl[idx, 'dataset']][wl[idx, 'doculect']] += [wl[idx, 'concept']]
+        # We only need the sets of concepts and doculects per dataset, so we stream the rows:
+        datasets = collections.defaultdict(set)
+        langs = collections.defaultdict(set)
+        for row in iter_rows(self.raw_dir / self._wlname, ['dataset', 'concept', 'doculect']):
+            datasets[row['dataset']].add(row['concept'])
+            langs[row['dataset']].add(row['doculect'])
 
         with Table('ID', 'Source', 'Varieties', 'Concepts', tablefmt='simple') as t:
             for dataset in datasets:
                 t.append([
                     dataset, ref(sources[dataset]), len(langs[dataset]), len(datasets[dataset])])
 
+    def detect(
+            self, wl, seed=1234, runs=10000, workers=1, thresholds=THRESHOLDS, log=None,
+            partitions=None):
+        """
+        Detect cognates and borrowings automatically, adding columns `autocogids`, `autocogid`,
+        `automorphemes` and `autoborid` to the raw wordlist `wl`.
+
+        :param seed: Random seed.
+        :param runs: Number of permutations to compute the LexStat scorer.
+        :param workers: Number of worker processes to compute the LexStat scorer and to detect \
+        cross-family cognates.
+        :param thresholds: Pair of thresholds for partial cognate detection and cross-family \
+        cognate detection.
+        :param partitions: `seabor.stream.Partitions` of `wl` (see `Dataset.partitions`). If \
+        given, partial cognates are merged and cross-family cognates detected one concept at a \
+        time, so the data these stages work on - e.g. the alignments of a concept - is bounded \
+        by the largest concept. Cross-family cognates are then detected serially. `wl` itself \
+        is still held in memory, so it should only have the columns needed here (see \
+        `Dataset.wl`).
+        """
+        import lingrex.cognates
+        from seabor.scorer import internal_cognates
+        from seabor.borrowing import external_cognates
+        from seabor.distances import DistanceStore
+
+        random.seed(seed)
+        columns = list(wl.columns)
+        # The results of the expensive stages below are cached, keyed by the content of the raw
+        # wordlist and the parameters of each stage (see `seabor.cache`). Partial cognates are
+        # also cached per family and cross-family cognates per concept, so after small changes to
+        # the raw data only the affected families and concepts are re-analysed:
+        cache = Cache(self.dir / '.cache' / 'stages')
+        key = wordlist_digest(wl)
+        # Distances between words are stored across stages and runs, so that changing e.g. a
+        # threshold only re-runs the clustering (see `seabor.distances`):
+        distances = DistanceStore(self.dir / '.cache' / 'distances')
+
+        # See paper, section "4 Results" and section "3.2 Methods".
+        # Detect partial cognates, computing the LexStat scorer in parallel (see
+        # `seabor.scorer`):
+        params = dict(
+            runs=runs,
+            ref="autocogids",
+            threshold=thresholds[0],
+            cluster_method="infomap")
+        key = cache.key(key, 'internal_cognates', seed=seed, **params)
+        with stage('internal_cognates'):
+            if not cache.load(wl, key):
+                internal_cognates(
+                    wl,
+                    workers=workers,
+                    seed=seed,
+                    checkpoint=self.dir / '.cache' / 'scorer',
+                    cache=cache,
+                    distances=distances,
+                    columns=columns,
+                    log=log,
+                    **params)
+                cache.dump(wl, key, "autocogids")
+        # Convert partial cognates into full cognates:
+        params = dict(ref="autocogid", cognates="autocogids", morphemes="automorphemes")
+        key = cache.key(key, 'common_morpheme_cognates', **params)
+        with stage('common_morpheme_cognates'):
+            if not cache.load(wl, key):
+                if partitions:
+                    self._by_concept(
+                        wl,
+                        partitions,
+                        lingrex.cognates.common_morpheme_cognates,
+                        ["autocogids"],
+                        ["autocogid", "automorphemes"],
+                        # Each partial cognate set of a concept uses up one cognate ID:
+                        size=lambda w: len({cid for idx in w for cid in w[idx, "autocogids"]}),
+                        **params)
+                else:
+                    lingrex.cognates.common_morpheme_cognates(wl, **params)
+                cache.dump(wl, key, "autocogid", "automorphemes")
+        # Detect cross-family shallow cognates:
+        params = dict(cognates="autocogid", ref="autoborid", threshold=thresholds[1])
+        key = cache.key(key, 'external_cognates', **params)
+        with stage('external_cognates'):
+            if not cache.load(wl, key):
+                if partitions:
+                    self._by_concept(
+                        wl,
+                        partitions,
+                        external_cognates,
+                        ["autocogid"],
+                        ["autoborid"],
+                        cache=cache,
+                        distances=distances,
+                        **params)
+                else:
+                    external_cognates(
+                        wl, cache=cache, distances=distances, workers=workers, log=log, **params)
+                cache.dump(wl, key, "autoborid")
+
+    def evict(self):
+        """
+        Clean up the caches used by `detect` (see `seabor.cache.Cache.evict`). Since entries read
+        or written meanwhile may be lost, this must only be called when no other process is
+        running `detect` - e.g. from the main process, once all pools are joined.
+        """
+        from seabor.distances import DistanceStore
+
+        Cache(self.dir / '.cache' / 'stages').evict()
+        DistanceStore(self.dir / '.cache' / 'distances').evict()
+
+    @staticmethod
+    def _by_concept(wl, partitions, func, inputs, outputs, size=None, **kw):
+        """
+        Run a stage of the analysis on the concept partitions of `wl`, one concept at a time (see
+        `seabor.stream.by_concept`).
+
+        :param inputs: Columns of `wl` read by the stage, which are copied to the partitions first.
+        :param outputs: Columns added by the stage, which are copied back to `wl`.
+        """
+        from seabor.stream import by_concept
+
+        partitions.add_columns(wl, inputs)
+        by_concept(partitions, func, size=size, **kw)
+        for col, values in partitions.values(outputs).items():
+            wl.add_entries(col, values, lambda x: x, override=True)
+
     def cmd_makecldf(self, args):
-        random.seed(int(input('Random seed [int]: ') or 1234))
+        # Timings, memory use and the number of alignments per stage are recorded (see
+        # `seabor.profiling`) and written to makecldf-profile.json:
+        profile = getattr(args, 'profile', False)
+        with Profiler(pstats=self.dir / 'profile' if profile else None) as profiler:
+            self._makecldf(args)
+        profiler.dump(self.dir / 'makecldf-profile.json')
+
+    def _makecldf(self, args):
+        from seabor.borrowing import own_clusters
+        from seabor.evaluate import Evaluation, bootstrap, format_ci
+
+        seed = getattr(args, 'seed', None)
+        if seed is None:
+            # Only prompt for a seed when running interactively:
+            seed = int((input('Random seed [int]: ') if sys.stdin.isatty() else '') or 1234)
         args.writer.add_sources()
         t = args.writer.cldf.add_component(
             'BorrowingTable',
@@ -115,126 +287,169 @@ by lateral transfer.
 
         c2cid = {c.gloss: c.id for c in args.concepticon.api.conceptsets.values()}
 
-        wl = self.wl()
+        partitioned = getattr(args, 'by_concept', False)
+        with stage('read'):
+            # With --by-concept, cognates and borrowings are detected on a wordlist with only the
+            # required columns, and the full wordlist is read afterwards:
+            wl = self.wl(self._detect_columns if partitioned else None)
+        with stage('detect'):
+            self.detect(
+                wl,
+                seed=seed,
+                runs=100 if args.dev else 10000,
+                workers=getattr(args, 'workers', 1),
+                thresholds=getattr(args, 'thresholds', None) or THRESHOLDS,
+                log=args.log,
+                partitions=self.partitions(['doculect', 'concept', 'family', 'tokens'])
+                if partitioned else None)
+            self.evict()
+        if partitioned:
+            with stage('read'):
+                detected = wl
+                wl = self.wl()
+                for col in ['autocogids', 'autocogid', 'automorphemes', 'autoborid']:
+                    wl.add_entries(col, {idx: detected[idx, col] for idx in wl}, lambda x: x)
+                del detected
         # we represent non-borrowed words in their own cluster in our
         # user-defined "borid"
-        clusterid = max([int(x) for x in wl.get_etymdict("uborid")])+1
-        wl.add_entries("userborid", "uborid", lambda x: int(x))
-        for idx in wl:
-            if wl[idx, "userborid"] == 0:
-                wl[idx, "userborid"] = clusterid
-                clusterid += 1
+        idxs = list(wl)
+        wl.add_entries(
+            "userborid",
+            dict(zip(idxs, own_clusters([wl[idx, "uborid"] for idx in idxs]))),
+            lambda x: x)
         # we compute baselines for lumper and splitter
         wl.add_entries("splitid", {idx: idx for idx in wl}, lambda x: x)
         wl.add_entries("lumpid", "concept", lambda x: x)
         wl.add_entries("lumpfamid", "concept,family", lambda x, y: x[y[0]]+"-"+x[y[1]])
 
-        # See paper, section "4 Results" and section "3.2 Methods".
-        # Detect partial cognates:
-        lingrex.borrowing.internal_cognates(
-            wl,
-            runs=100 if args.dev else 10000,
-            ref="autocogids",
-            partial=True,
-            method="lexstat",
-            threshold=0.50,
-            cluster_method="infomap")
-        # Convert partial cognates into full cognates:
-        lingrex.cognates.common_morpheme_cognates(
-            wl,
-            ref="autocogid",
-            cognates="autocogids",
-            morphemes="automorphemes")
-        # Detect cross-family shallow cognates:
-        lingrex.borrowing.external_cognates(
-            wl,
-            cognates="autocogid",
-            ref="autoborid",
-            threshold=0.35)
         wl.output("tsv", filename="temp", ignore="all")
         # renumber wordlist to place 0 into their own cluster
-        clusterid = max(wl.get_etymdict("autoborid"))+1
-        for idx in wl:
-            if wl[idx, "autoborid"] == 0:
-                wl[idx, "autoborid"] = clusterid
-                clusterid += 1
-
-                
-        # add a combined score
-
-        # Output the evaluation:
-        p1, r1, f1 = evaluate.acd.bcubes(wl, "ucogid", "autocogid", pprint=False)
-        p2, r2, f2 = evaluate.acd.bcubes(wl, "userborid", "autoborid", pprint=False)
-        p3, r3, f3 = evaluate.acd.bcubes(wl, "ucogid", "lumpfamid",
-                pprint=False)
-        p4, r4, f4 = evaluate.acd.bcubes(wl, "userborid", "lumpid",
-                pprint=False)
-        p5, r5, f5 = evaluate.acd.bcubes(wl, "ucogid", "splitid", pprint=False)
-        p6, r6, f6 = evaluate.acd.bcubes(wl, "userborid", "splitid",
-                pprint=False)
-
-        print('')
-        with Table("method", "precision", "recall", "f-score",
-                tablefmt="simple", floatfmt=".4f") as tab:
-            tab.append(["automated cognate detection", p1, r1, f1])
-            tab.append(["automated borrowing detection", p2, r2, f2])
-            tab.append(["lumper bl for cognate detection", p3, r3, f3])
-            tab.append(["lumper bl for borrowing detection", p4, r4, f4])
-            tab.append(["splitter bl for cognate detection", p5, r5, f5])
-            tab.append(["splitter bl for borrowing detection", p6, r6, f6])
-
-        print('')
+        for idx, borid in zip(idxs, own_clusters([wl[idx, "autoborid"] for idx in idxs])):
+            wl[idx, "autoborid"] = borid
+
+        with stage('evaluation'):
+            # Output the evaluation, scoring the automated methods and the lumper and splitter
+            # baselines against the expert judgements in one go:
+            tests = collections.OrderedDict([
+                ("cognate", ("ucogid", ["autocogid", "lumpfamid", "splitid"])),
+                ("borrowing", ("userborid", ["autoborid", "lumpid", "splitid"])),
+            ])
+            methods = ["automated", "lumper bl for", "splitter bl for"]
+            scores = {k: Evaluation(wl, gold, cols).scores() for k, (gold, cols) in tests.items()}
+            by_concept = {
+                k: Evaluation(wl, gold, cols, by="concept") for k, (gold, cols) in tests.items()}
+            # Confidence intervals are computed by resampling concepts:
+            samples = getattr(args, 'bootstrap', 0)
+            cis = {
+                k: bootstrap(ev, samples, seed=seed, workers=getattr(args, 'workers', 1))
+                for k, ev in by_concept.items()} if samples else {}
+
+            print('')
+            with Table(*["method", "precision", "recall", "f-score"] + (
+                    ["precision CI", "recall CI", "f-score CI"] if cis else []),
+                    tablefmt="simple", floatfmt=".4f") as tab:
+                for i, method in enumerate(methods):
+                    for k in tests:
+                        tab.append(
+                            ["{0} {1} detection".format(method, k)] + list(scores[k][i]) +
+                            [format_ci(ci) for ci in (cis[k][i] if cis else [])])
+
+            print('')
+            with Table("family", "method", "precision", "recall", "f-score",
+                    tablefmt="simple", floatfmt=".4f") as tab:
+                for k, (gold, cols) in tests.items():
+                    ev = Evaluation(wl, gold, cols, by="family")
+                    for family, rows in zip(ev.groups, ev.breakdown().transpose(1, 0, 2)):
+                        for method, prf in zip(methods, rows):
+                            tab.append([family, "{0} {1} detection".format(method, k)] + list(prf))
+
+            print('')
+            # The per-concept breakdown is only logged at debug level:
+            for k, ev in by_concept.items():
+                for concept, col, p, r, f in ev.table():
+                    args.log.debug('{0} detection, {1}, {2}: {3:.4f} {4:.4f} {5:.4f}'.format(
+                        k, col, concept, p, r, f))
 
         # Write the wordlist to a proper CLDF dataset:
-        args.writer.add_languages()
-        concepts = set()
-        header = [k for k, _ in sorted(wl.header.items(), key=lambda i: i[1])]
-        for index in wl:
-            row = dict(zip(header, wl[index]))
-            if row['concept'] not in concepts:
-                args.writer.add_concept(
-                    ID=slug(row['concept']),
-                    Concepticon_Gloss=row['concept'].upper(),
-                    Concepticon_ID=c2cid[row['concept'].upper()],
-                    Name=row['concept_in_source'])
-                concepts.add(row['concept'])
-            lex = args.writer.add_form_with_segments(
-                ID='{}-{}'.format(row['dataset'], row['lexibank_id']),
-                Language_ID=row['doculect'],
-                Parameter_ID=slug(row['concept']),
-                Value=row['value'],
-                Form=row['form'],
-                Segments=row['tokens'],
-                ID_In_Source=row["lexibank_id"],
-                Source=row["dataset"],
-                Prosodic_String=row["structure"]
+        with stage('cldf'):
+            args.writer.add_languages()
+            self._write_wordlist(args.writer, wl, c2cid)
+
+    def _write_wordlist(self, writer, wl, c2cid):
+        """
+        Add forms, concepts, cognates and borrowings from the wordlist to the CLDF writer.
+
+        Data is read column-wise from the wordlist and concepts are added in one pass upfront.
+        Forms are added one at a time with `add_form_with_segments`, since pylexibank analyses the
+        segments of each form for the transcription report. Cognate and borrowing rows are
+        collected while adding the forms and written to their tables in one batch each.
+        """
+        def cogid(v):
+            return v if v and v not in ('0', 0) else None
+
+        idxs = list(wl)
+        cols = {
+            col: [wl[idx, col] for idx in idxs] for col in [
+                'concept', 'concept_in_source', 'dataset', 'lexibank_id', 'doculect', 'value',
+                'form', 'tokens', 'structure', 'source',
+                'ucogid', 'autocogid', 'autocogids', 'uborid', 'autoborid']}
+
+        # Concepts are added in the order of their first occurrence in the wordlist:
+        concepts = collections.OrderedDict()
+        for concept, name in zip(cols['concept'], cols['concept_in_source']):
+            concepts.setdefault(concept, name)
+        for concept, name in concepts.items():
+            writer.add_concept(
+                ID=slug(concept),
+                Concepticon_Gloss=concept.upper(),
+                Concepticon_ID=c2cid[concept.upper()],
+                Name=name)
+
+        cognates, borrowings = [], []
+        for i in range(len(idxs)):
+            lex = writer.add_form_with_segments(
+                ID='{}-{}'.format(cols['dataset'][i], cols['lexibank_id'][i]),
+                Language_ID=cols['doculect'][i],
+                Parameter_ID=slug(cols['concept'][i]),
+                Value=cols['value'][i],
+                Form=cols['form'][i],
+                Segments=cols['tokens'][i],
+                ID_In_Source=cols["lexibank_id"][i],
+                Source=cols["dataset"][i],
+                Prosodic_String=cols["structure"][i]
             )
-            if row['ucogid'] and row['ucogid'] not in ('0', 0):
-                args.writer.add_cognate(
-                    lexeme=lex,
-                    Cognateset_ID='expert-{}'.format(row['ucogid']),
-                    Cognate_Detection_Method='expert')
-            if row['autocogid'] and row['autocogid'] not in ('0', 0):
-                args.writer.add_cognate(
-                    lexeme=lex,
-                    Cognateset_ID='auto-full-{}'.format(row['autocogid']),
-                    Cognate_Detection_Method='lingrex.cognates.common_morpheme_cognates')
-            if row['autocogids'] and row['autocogids'] not in ('0', 0):
-                for cogid in row['autocogids']:
-                    args.writer.add_cognate(
-                        lexeme=lex,
-                        Cognateset_ID='auto-partial-{}'.format(cogid),
-                        Cognate_Detection_Method='lingrex.borrowing.internal_cognates')
-            if row['uborid'] and row['uborid'] not in ('0', 0):
-                args.writer.objects['BorrowingTable'].append(dict(
+            cogsets = []
+            if cogid(cols['ucogid'][i]):
+                cogsets.append(('expert-{}'.format(cols['ucogid'][i]), 'expert'))
+            if cogid(cols['autocogid'][i]):
+                cogsets.append((
+                    'auto-full-{}'.format(cols['autocogid'][i]),
+                    'lingrex.cognates.common_morpheme_cognates'))
+            if cogid(cols['autocogids'][i]):
+                for cid in cols['autocogids'][i]:
+                    cogsets.append((
+                        'auto-partial-{}'.format(cid), 'lingrex.borrowing.internal_cognates'))
+            for cogset, method in cogsets:
+                kw = dict(Form_ID=lex['ID'], Form=lex['Form'])
+                # Rows are validated by the cognate class, as in `writer.add_cognate`:
+                cognates.append(attr.asdict(self.cognate_class(
+                    ID=writer.cognate_id(kw),
+                    Cognateset_ID=cogset,
+                    Cognate_Detection_Method=method,
+                    **kw)))
+            if cogid(cols['uborid'][i]):
+                borrowings.append(dict(
                     ID='expert-' + lex['ID'],
                     Target_Form_ID=lex['ID'],
-                    Xenolog_Cluster_ID='expert-{}'.format(row['uborid']),
-                    Comment=row['source'],
+                    Xenolog_Cluster_ID='expert-{}'.format(cols['uborid'][i]),
+                    Comment=cols['source'][i],
                 ))
-            if row['autoborid'] and row['autoborid'] not in ('0', 0):
-                args.writer.objects['BorrowingTable'].append(dict(
+            if cogid(cols['autoborid'][i]):
+                borrowings.append(dict(
                     ID='auto-' + lex['ID'],
                     Target_Form_ID=lex['ID'],
-                    Xenolog_Cluster_ID='auto-{}'.format(row['autoborid']),
+                    Xenolog_Cluster_ID='auto-{}'.format(cols['autoborid'][i]),
                 ))
+
+        writer.objects['CognateTable'].extend(cognates)
+        writer.objects['BorrowingTable'].extend(borrowings)
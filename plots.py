@@ -1,14 +1,19 @@
 """
 Plot cross-family borrowings on a map.
+
+For HTML maps, identical marker icons are inlined only once: each distinct SVG icon is added as
+data URL to a JavaScript object in the legend of the map, and markers refer to it by a key
+derived from its checksum. Proportions in admixture pie charts are rounded to multiples of
+1 / `PIE_STEPS`, so doculects with (almost) the same proportions share one icon. Thus, the size of
+the page grows only with the number of markers, not with the size of their icons.
 """
-import itertools
+import re
+import json
+import hashlib
 import collections
-import urllib.request
+import pathlib
 
 from clldutils import svg
-from csvw.dsv import reader
-from matplotlib.patches import Wedge, Circle
-from cartopy import crs as ccrs
 import yattag
 
 from cldfviz.map import MarkerFactory
@@ -16,8 +21,13 @@ from cldfviz.map.leaflet import LeafletMarkerSpec
 from cldfviz.map.mpl import MPLMarkerSpec
 from cldfviz.colormap import hextriplet
 
-SWADESH = "https://raw.githubusercontent.com/concepticon/concepticon-data/v2.5.0/concepticondata/" \
-          "conceptlists/Swadesh-1955-100.tsv"
+from seabor.index import Index
+from seabor.admixture import Admixture
+from seabor.conceptlists import concepticon_glosses
+
+SWADESH = "Swadesh-1955-100"
+# Concepticon concept list IDs look like "Author-Year-Count":
+CONCEPTLIST_ID = re.compile(r'^[A-Za-z]+-[0-9]{4}[a-z]?-[0-9]+')
 pcols = collections.OrderedDict([
     ('missing', 'white'),
     ('singleton', '0.5'),
@@ -30,24 +40,78 @@ pcols = collections.OrderedDict([
     ('Hmong-Mien--Sino-Tibetan--Tai-Kadai', 'black'),
 ])
 hex_color = lambda color: hextriplet(color.replace('0.5', 'grey').lower())
+# Wedges of pie charts on HTML maps are multiples of 10 degrees:
+PIE_STEPS = 36
+# Leaflet's marker icons are created with `L.icon`, so we look up icon keys when it is called:
+ICONS_JS = """<script type="text/javascript">
+var ICONS = {0};
+L.icon = (function (icon) {{
+    return function (options) {{
+        var url = ICONS[options.iconUrl] || options.iconUrl;
+        return icon(Object.assign({{}}, options, {{iconUrl: url}}));
+    }};
+}})(L.icon);
+</script>"""
+
+
+def quantize(proportions, steps=PIE_STEPS):
+    """
+    Round proportions to multiples of `1 / steps`, keeping their sum, by assigning the steps left
+    after rounding down to the largest remainders.
+
+    :return: `list` of numbers of steps per proportion.
+    """
+    total = sum(proportions)
+    if not total:
+        return [0 for _ in proportions]
+    scaled = [steps * p / total for p in proportions]
+    res = [int(x) for x in scaled]
+    for i in sorted(
+            range(len(scaled)), key=lambda i: res[i] - scaled[i])[:steps - sum(res)]:
+        res[i] += 1
+    return res
 
 
 class Map(MarkerFactory):
     def __init__(self, cldf, args, *custom):
         MarkerFactory.__init__(self, cldf, args)
+        # Icons of the markers of the current map, mapping keys to data URLs:
+        self._icons = collections.OrderedDict()
         self.languages = collections.OrderedDict([(r.id, r) for r in cldf.objects('LanguageTable')])
 
         # We can plot two kinds of maps:
         if len(custom) == 2:
             # We plot a xenolog cluster
-            pid, cluster_id = custom
-            self.data = self.data_cluster(self.languages, cldf, pid, cluster_id)
-            self.plot = 'cluster'
+            self.set_cluster(Index.cached(cldf), *custom)
         else:
             # We plot "admixture" pie charts
             self.data = self.data_admixture(self.languages, cldf, custom[0] if custom else None)
             self.plot = 'admixture'
 
+    def set_cluster(self, index, pid, cluster_id):
+        """
+        Switch to plotting xenolog cluster `cluster_id` for concept `pid`.
+
+        This allows plotting many clusters with one `Map` instance, see `seabor.clustermaps`.
+        """
+        self.data = self.data_cluster(self.languages, index, pid, cluster_id)
+        self.plot = 'cluster'
+
+    def icon(self, svgxml):
+        """
+        Intern an SVG icon for the markers of an HTML map.
+
+        The icons are inlined with the legend, see `Map.legend`. Without a legend, markers carry
+        their icon as data URL.
+
+        :return: Key or data URL of the icon.
+        """
+        if getattr(self.args, 'no_legend', False):
+            return svg.data_url(svgxml)
+        key = 'icon-{0}'.format(hashlib.md5(svgxml.encode('utf8')).hexdigest())
+        self._icons.setdefault(key, svg.data_url(svgxml))
+        return key
+
     def __call__(self, map, language, *_):
         if self.plot == 'cluster':
             return self.plot_cluster(map, language)
@@ -55,10 +119,9 @@ class Map(MarkerFactory):
             return self.plot_admixture(map, language)
 
     def legend(self, fig, parameters, colormaps):
-        if self.plot == 'admixture':
-            if self.args.format == 'html':
-                doc, tag, text = yattag.Doc().tagtext()
-
+        if self.args.format == 'html':
+            doc, tag, text = yattag.Doc().tagtext()
+            if self.plot == 'admixture':
                 with tag('table', klass="legend"):
                     for name, color in pcols.items():
                         with tag('tr'):
@@ -70,8 +133,12 @@ class Map(MarkerFactory):
                                     width="{}".format(min([20, self.args.markersize * 2])))
                             with tag('th', style="text-align: left;"):
                                 text(name.replace('singleton', 'Unique'))
-                fig.legend = doc.getvalue()
-                return
+            # The legend is rendered after all markers - and before the script creating them:
+            fig.legend = doc.getvalue() + ICONS_JS.format(
+                json.dumps(self._icons).replace('</', '<\\/'))
+            self._icons = collections.OrderedDict()
+            return
+        if self.plot == 'admixture':
             fig.ax.plot(1, 1, 'o', color='white', markeredgecolor='black', label='missing')
             fig.ax.plot(1, 1, 'o', color=pcols['singleton'], label='Unique')
             fig.ax.plot(1, 1, 'o', color=pcols['Hmong-Mien'], label='Hmong-Mien')
@@ -86,104 +153,59 @@ class Map(MarkerFactory):
 
     @staticmethod
     def data_admixture(langs, cldf, setid):
+        """
+        :param setid: `swadesh`, `borrowed` (i.e. not in the Swadesh list), the ID of a \
+        Concepticon concept list or anything else - to select all concepts.
+        """
         concepts = collections.OrderedDict(
             [(r['Concepticon_Gloss'], r['ID']) for r in cldf.iter_rows('ParameterTable')])
-        swadesh = set(
-            c['CONCEPTICON_GLOSS'] for c in
-            reader(
-                urllib.request.urlopen(SWADESH).read().decode('utf8').split('\n'),
-                dicts=True,
-                delimiter='\t')
-            if c['CONCEPTICON_GLOSS'] in concepts)
+        cache = pathlib.Path(str(cldf.directory)).parent / '.cache' / 'conceptlists'
+
+        def glosses(conceptlist):
+            return set(g for g in concepticon_glosses(conceptlist, cache) if g in concepts)
 
         if setid == 'swadesh':
-            selected_concepts = {k: v for k, v in concepts.items() if k in swadesh}
+            selected_concepts = {k: v for k, v in concepts.items() if k in glosses(SWADESH)}
         elif setid == 'borrowed':
+            swadesh = glosses(SWADESH)
             selected_concepts = {k: v for k, v in concepts.items() if k not in swadesh}
+        elif setid and CONCEPTLIST_ID.match(setid):
+            conceptlist = glosses(setid)
+            selected_concepts = {k: v for k, v in concepts.items() if k in conceptlist}
         else:
             selected_concepts = concepts
 
-        allforms = collections.OrderedDict([
-            (f['ID'], f) for f in
-            sorted(cldf['FormTable'], key=lambda f: (f['Language_ID'], f['Parameter_ID']))])
-
-        forms_by_cogid, forms_by_borid = collections.defaultdict(list), collections.defaultdict(list)
-        cogid_by_formid, borid_by_formid = {}, {}
-        for row in cldf['CognateTable']:
-            if row['Cognateset_ID'].startswith('auto-full-'):
-                forms_by_cogid[row['Cognateset_ID']].append(allforms[row['Form_ID']])
-                cogid_by_formid[row['Form_ID']] = row['Cognateset_ID']
-
-        for row in cldf['BorrowingTable']:
-            if row['Xenolog_Cluster_ID'].startswith('auto-'):
-                forms_by_borid[row['Xenolog_Cluster_ID']].append(allforms[row['Target_Form_ID']])
-                borid_by_formid[row['Target_Form_ID']] = row['Xenolog_Cluster_ID']
-
-        for lid, forms in itertools.groupby(allforms.values(), lambda f: f['Language_ID']):
-            language = langs[lid]
-
-            # forms by concept for this doculect:
-            concepts = {
-                pid: list(ff) for pid, ff in itertools.groupby(forms, lambda f: f['Parameter_ID'])}
-
-            props = collections.defaultdict(float)
-            total = 0
-            for concept, cid in selected_concepts.items():
-                prop = []
-                for form in concepts.get(cid, []):
-                    # get the other members of the cognate class and borrowing cluster respectively:
-                    borrowing_cluster = forms_by_borid.get(borid_by_formid.get(form['ID']), [])
-                    cognate_class = forms_by_cogid.get(cogid_by_formid.get(form['ID']), [])
-
-                    if len(borrowing_cluster) > 1:
-                        families = '--'.join(sorted(k for k in set(
-                            langs[f['Language_ID']].data['Family'] for f in borrowing_cluster) if
-                                                    k))  # != this_family]))
-                        prop.append(families)
-                    elif len(cognate_class) > 1:
-                        prop.append(language.data['Family'])
-                    else:
-                        prop.append('singleton')
-
-                for p in prop:
-                    props[p] += 1 / len(prop)
-
-                if prop:
-                    total += 1
-                elif cid not in concepts:
-                    props['missing'] += 1
-                    total += 1
-
-            for k in list(props.keys()):
-                props[k] = props[k] / total
-
-            language.data['props'] = props
-            language.data['total'] = total
+        index = Index.cached(cldf)
+        selected = [index.concept_index[cid] for cid in selected_concepts.values()]
+        for lid, (props, total) in Admixture(index).proportions(selected).items():
+            langs[lid].data['props'] = props
+            langs[lid].data['total'] = total
 
     @staticmethod
-    def data_cluster(languages, cldf, pid, cluster_id):
+    def data_cluster(languages, index, pid, cluster_id):
+        cidx = index.concept_index[pid]
         present = collections.defaultdict(set)
-        tokens = collections.defaultdict(lambda: collections.defaultdict(list))
-
-        allforms = {r['id']: r for r in cldf.iter_rows('FormTable', 'id')}
-        for form in allforms.values():
-            tokens[form['Language_ID']][form['Parameter_ID']].append(form['Segments'])
-            present[form['Language_ID']].add(form['Parameter_ID'])
+        tokens = collections.defaultdict(dict)
+        for lidx, lid in enumerate(index.language_ids):
+            forms = index.forms(lidx, cidx)
+            if len(forms):
+                present[str(lid)].add(pid)
+                # If a variety has counterparts for a concept that are not member of a borrowing
+                # cluster, we display the longest counterpart on the map for comparison.
+                tokens[str(lid)][pid] = sorted(
+                    (index.form_segments[i].split() for i in forms), key=lambda s: len(s))[-1]
 
         borid_forms = None
-        for borid, forms in itertools.groupby(
-            sorted(cldf['BorrowingTable'], key=lambda f: f['Xenolog_Cluster_ID']),
-            lambda f: f['Xenolog_Cluster_ID']
-        ):
-            if borid == 'auto-{}'.format(cluster_id):
-                forms = [allforms[f['Target_Form_ID']] for f in forms]
-                if len(set(languages[f['Language_ID']].data['Family'] for f in forms)) > 1:
-                    borid_forms = forms
-
-        for lid in list(tokens.keys()):
-            # If a variety has counterparts for a concept that are not member of a borrowing cluster,
-            # we display the longest counterpart on the map for comparison.
-            tokens[lid] = {k: sorted(v, key=lambda s: len(s))[-1] for k, v in tokens[lid].items()}
+        xidx = index.xenolog_index.get('auto-{}'.format(cluster_id))
+        if xidx is not None:
+            forms = [
+                dict(
+                    ID=str(index.form_ids[i]),
+                    Language_ID=str(index.language_ids[index.form_language[i]]),
+                    Segments=index.form_segments[i].split())
+                for i in index.xenolog_members(xidx)]
+            if len(set(languages[f['Language_ID']].data['Family'] for f in forms)) > 1:
+                borid_forms = forms
 
         return (pid, cluster_id, borid_forms, present, tokens)
 
@@ -205,7 +227,7 @@ class Map(MarkerFactory):
         if lid in borrowing_cluster:
             if self.args.format == 'html':
                 return LeafletMarkerSpec(
-                    icon=svg.data_url(svg.icon(hextriplet(color).replace('#', 'c'), opacity=1)),
+                    icon=self.icon(svg.icon(hextriplet(color).replace('#', 'c'), opacity=1)),
                     markersize=self.args.markersize + 3,
                     tooltip=text,
                     tooltip_class='tt-big-font',
@@ -225,7 +247,7 @@ class Map(MarkerFactory):
         else:
             if self.args.format == 'html':
                 return LeafletMarkerSpec(
-                    icon=svg.data_url(svg.icon(hextriplet(color).replace('#', 'c'), opacity=0.5)),
+                    icon=self.icon(svg.icon(hextriplet(color).replace('#', 'c'), opacity=0.5)),
                     tooltip=text,
                     tooltip_class='tt-small-font',
                     css='div.tt-small-font {font-size: smaller !important; opacity: 50% !important;}',
@@ -250,14 +272,17 @@ class Map(MarkerFactory):
                     text_kw=dict(fontsize=6, zorder=5, alpha=0.6))
 
     def plot_admixture(self, fig, language):
+        from matplotlib.patches import Wedge, Circle
+        from cartopy import crs as ccrs
+
         languages = self.languages
         lid = language.id
         coords = (language.lon, language.lat)
         language = languages[lid]
 
         if self.args.format == 'html':
-            return LeafletMarkerSpec(icon=svg.data_url(svg.pie(
-                [language.data['props'][p] for p in pcols],
+            return LeafletMarkerSpec(icon=self.icon(svg.pie(
+                quantize([language.data['props'][p] for p in pcols]),
                 [hextriplet(v.lower() if v != '0.5' else 'grey') for v in pcols.values()]
             )))
 
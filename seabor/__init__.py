@@ -0,0 +1,3 @@
+"""
+Library code supporting the seabor dataset's `makecldf` and the `seabor.*` commands.
+"""
@@ -0,0 +1,104 @@
+"""
+Classification of the forms of each doculect by the families involved in their borrowing.
+
+Each form is classified once, as borrowed between the families of the members of its
+(automatically detected) xenolog cluster, as family-internal if it has (automatically detected)
+cognates, and as "singleton" otherwise. The contribution of each concept of a doculect to these
+categories is materialized as `(languages, concepts, categories)` array, so the proportions for
+any selection of concepts - or for many selections at once - are weighted sums over concepts.
+"""
+import collections
+
+import numpy as np
+
+__all__ = ['Admixture', 'proportions']
+
+MISSING, SINGLETON = 'missing', 'singleton'
+
+
+class Admixture:
+    """
+    Proportions of unique, family-internal and borrowed forms per doculect.
+
+    :ivar categories: `list` of category labels: `missing`, `singleton`, the families and the \
+    combinations of families - joined with `--` - involved in borrowings.
+    :ivar form_category: `(forms,)` array of category codes.
+    :ivar weights: `(languages, concepts, categories)` array. Each concept of a doculect \
+    contributes 1, split evenly between its forms - or counted as `missing` if it has no forms.
+    """
+    def __init__(self, index):
+        """
+        :param index: `seabor.index.Index` instance.
+        """
+        self.language_ids = [str(lid) for lid in index.language_ids]
+        form_cogset, cogset_sizes = index.cogsets('auto-full-')
+        form_xenolog, xenolog_sizes = index.xenologs('auto-')
+        codes = collections.OrderedDict((c, i) for i, c in enumerate([MISSING, SINGLETON]))
+
+        # Classify forms by the family of their doculect, if they have cognates ...
+        language_code = np.array(
+            [codes.setdefault(str(f), len(codes)) for f in index.language_family], dtype=int)
+        cognate = (form_cogset >= 0) & (np.append(cogset_sizes, 0)[form_cogset] > 1)
+        self.form_category = np.where(
+            cognate, language_code[index.form_language], codes[SINGLETON])
+        # ... or by the families involved in the borrowing, if they are part of a xenolog cluster.
+        for xenolog in np.unique(form_xenolog[form_xenolog >= 0]):
+            if xenolog_sizes[xenolog] < 2:
+                continue
+            members = index.xenolog_members(xenolog)
+            families = '--'.join(sorted(k for k in set(
+                index.language_family[index.form_language[members]]) if k))
+            self.form_category[members] = codes.setdefault(families, len(codes))
+        self.categories = list(codes)
+
+        nlanguages, nconcepts = len(index.language_ids), len(index.concept_ids)
+        slices = index.form_language * nconcepts + index.form_concept
+        nforms = np.diff(index.slice_indptr)
+        self.weights = np.zeros((nlanguages * nconcepts, len(self.categories)))
+        np.add.at(self.weights, (slices, self.form_category), 1 / nforms[slices])
+        self.weights[nforms == 0, codes[MISSING]] = 1
+        self.weights = self.weights.reshape(nlanguages, nconcepts, len(self.categories))
+
+    def matrix(self, selections):
+        """
+        Compute proportions for several selections of concepts at once.
+
+        :param selections: `(selections, concepts)` array of concept counts - e.g. boolean masks.
+        :return: `(selections, languages, categories)` array of proportions - all `0` for empty \
+        selections.
+        """
+        selections = np.asarray(selections, dtype=float)
+        weights = np.einsum('lck,sc->slk', self.weights, selections)
+        totals = np.broadcast_to(selections.sum(axis=1)[:, None, None], weights.shape)
+        return np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+    def proportions(self, concepts):
+        """
+        Compute the proportions of the categories per doculect, for a selection of concepts.
+
+        :param concepts: Concept indices to consider.
+        :return: `OrderedDict` mapping language IDs to pairs `(props, total)`, with `props` a \
+        `defaultdict` mapping categories to proportions and `total` the number of concepts.
+        """
+        counts = np.bincount(list(concepts), minlength=self.weights.shape[1])
+        res = collections.OrderedDict()
+        for lid, props in zip(self.language_ids, self.matrix([counts])[0]):
+            res[lid] = (
+                collections.defaultdict(
+                    float, {c: float(p) for c, p in zip(self.categories, props) if p}),
+                int(counts.sum()))
+        return res
+
+
+def proportions(index, concepts):
+    """
+    Compute the proportions of unique, family-internal and borrowed forms per doculect.
+
+    Each selected concept of a doculect contributes equally to the proportions, split evenly
+    between its forms, see `Admixture`. Concepts without forms count as "missing".
+
+    :param index: `seabor.index.Index` instance.
+    :param concepts: Concept indices to consider.
+    :return: `OrderedDict` mapping language IDs to pairs `(props, total)`.
+    """
+    return Admixture(index).proportions(concepts)
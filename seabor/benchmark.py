@@ -0,0 +1,405 @@
+"""
+Benchmarks for the stages of `makecldf` and the `seabor.*` commands, run on synthetic data.
+
+To see how run time and memory use scale with the size of the data, benchmarks run on synthetic
+wordlists - and CLDF indexes - which are `factor` copies of the seabor data: either copies of all
+concepts (the default) or of all doculects. Copies are relabelled, and their cognate set and
+xenolog cluster IDs are offset, so that the copies form separate clusters.
+
+Each benchmark runs under a `seabor.profiling.Profiler` in a fresh process, using fixed random
+seeds, and results are recorded per stage. Results are stored as JSON files - named after the git
+commit of the code - so they can be compared across commits.
+"""
+import time
+import json
+import types
+import random
+import pathlib
+import statistics
+import subprocess
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from seabor.index import Index, _csr
+from seabor.profiling import Profiler, stage, _versions
+
+__all__ = ['BENCHMARKS', 'scale_wordlist', 'scale_index', 'run', 'save', 'compare']
+
+# Columns with cognate set or xenolog cluster IDs in the raw wordlist:
+CLUSTER_COLUMNS = ['cogid', 'cogids', 'ucogid', 'ucogids', 'uborid', 'borid', 'crossids']
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    """
+    Register a benchmark - a function accepting a `Data` instance and the benchmark parameters -
+    under `name`.
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def _offset(value, offset):
+    """
+    Offset cluster IDs, keeping `0` - i.e. "not part of any cluster" - and the cell's datatype.
+    """
+    if isinstance(value, int):
+        return value + offset if value else value
+    if isinstance(value, list):
+        return [_offset(v, offset) for v in value]
+    if isinstance(value, str) and value.split() and all(v.isdigit() for v in value.split()):
+        return ' '.join(str(_offset(int(v), offset)) for v in value.split())
+    return value
+
+
+def _max(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, list):
+        return max([_max(v) for v in value], default=0)
+    if isinstance(value, str) and all(v.isdigit() for v in value.split()):
+        return max([int(v) for v in value.split()], default=0)
+    return 0
+
+
+def scale_wordlist(wordlist, factor, axis='concept', concepts=None):
+    """
+    Create a synthetic wordlist from `factor` copies of a wordlist.
+
+    :param axis: `concept` or `doculect` - copies of concepts or doculects are labelled \
+    `<LABEL>-<COPY>`.
+    :param concepts: Only copy the first `concepts` concepts (in the order of `wordlist.rows`).
+    :return: `dict` with the wordlist data, as accepted by `lingpy.Wordlist`.
+    """
+    selected = set(wordlist.rows[:concepts] if concepts else wordlist.rows)
+    idxs = [idx for idx in wordlist if wordlist[idx, 'concept'] in selected]
+    cols = [c for c in CLUSTER_COLUMNS if c in wordlist.columns]
+    step = max([_max(wordlist[idx, c]) for idx in idxs for c in cols], default=0) + 1
+    label = wordlist.columns.index(axis)
+    cluster = [wordlist.columns.index(c) for c in cols]
+
+    data, i = {0: list(wordlist.columns)}, 1
+    for copy in range(factor):
+        for idx in idxs:
+            row = list(wordlist[idx])
+            if copy:
+                row[label] = '{0}-{1}'.format(row[label], copy)
+                for j in cluster:
+                    row[j] = _offset(row[j], copy * step)
+            data[i] = row
+            i += 1
+    return data
+
+
+def scale_index(index, factor, axis='concept'):
+    """
+    Create a synthetic `seabor.index.Index` from `factor` copies of the forms of an index.
+
+    :param axis: `concept` or `doculect` - IDs of copied concepts or languages - as well as of \
+    forms, cognate sets and xenolog clusters - are suffixed with `-<COPY>`.
+    """
+    def suffixed(ids):
+        return np.array(
+            [str(i) if copy == 0 else '{0}-{1}'.format(i, copy)
+             for copy in range(factor) for i in ids], dtype=str)
+
+    nforms, nlanguages, nconcepts = \
+        len(index.form_ids), len(index.language_ids), len(index.concept_ids)
+    copies = np.repeat(np.arange(factor), nforms)
+    form_language = np.tile(index.form_language, factor)
+    form_concept = np.tile(index.form_concept, factor)
+    if axis == 'concept':
+        form_concept += copies * nconcepts
+        nconcepts *= factor
+        languages = (index.language_ids, index.language_family)
+        concepts = (
+            suffixed(index.concept_ids),
+            np.array([
+                str(g) if copy == 0 else '{0} ({1})'.format(g, copy)
+                for copy in range(factor) for g in index.concept_glosses], dtype=str))
+    else:
+        form_language += copies * nlanguages
+        nlanguages *= factor
+        languages = (suffixed(index.language_ids), np.tile(index.language_family, factor))
+        concepts = (index.concept_ids, index.concept_glosses)
+    # Forms are sorted by language and concept, see `seabor.index.Index`:
+    order = np.lexsort((form_concept, form_language))
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    def members(ids, indptr, forms):
+        # Each copy of a form is a member of the corresponding copy of its clusters:
+        groups = np.repeat(np.arange(len(ids)), np.diff(indptr))
+        res = []
+        for copy in range(factor):
+            res.extend(zip(
+                (groups + copy * len(ids)).tolist(),
+                position[forms + copy * nforms].tolist()))
+        return _csr(res, len(ids) * factor)
+
+    cogset_indptr, cogset_forms = members(
+        index.cogset_ids, index.cogset_indptr, index.cogset_forms)
+    xenolog_indptr, xenolog_forms = members(
+        index.xenolog_ids, index.xenolog_indptr, index.xenolog_forms)
+    slice_indptr = np.zeros(nlanguages * nconcepts + 1, dtype=int)
+    np.cumsum(
+        np.bincount(
+            form_language * nconcepts + form_concept, minlength=nlanguages * nconcepts),
+        out=slice_indptr[1:])
+    return Index(
+        '{0}-{1}-{2}'.format(index.digest, axis, factor),
+        form_ids=suffixed(index.form_ids)[order],
+        form_language=form_language[order],
+        form_concept=form_concept[order],
+        form_segments=np.tile(index.form_segments, factor)[order],
+        language_ids=languages[0],
+        language_family=languages[1],
+        concept_ids=concepts[0],
+        concept_glosses=concepts[1],
+        cogset_ids=suffixed(index.cogset_ids),
+        cogset_indptr=cogset_indptr,
+        cogset_forms=cogset_forms,
+        xenolog_ids=suffixed(index.xenolog_ids),
+        xenolog_indptr=xenolog_indptr,
+        xenolog_forms=xenolog_forms,
+        slice_indptr=slice_indptr,
+    )
+
+
+class Data:
+    """
+    Synthetic data for a benchmark, built upon first access.
+    """
+    def __init__(self, factor, axis='concept', concepts=None):
+        self.factor, self.axis, self.concepts = factor, axis, concepts
+        self._data, self._index = None, None
+
+    def wordlist(self):
+        """
+        :return: A fresh `lingpy.Wordlist`, since stages add columns to the wordlist.
+        """
+        from lingpy import Wordlist
+        from lexibank_seabor import Dataset
+
+        if self._data is None:
+            self._data = scale_wordlist(
+                Dataset().wl(), self.factor, axis=self.axis, concepts=self.concepts)
+        return Wordlist({k: list(v) for k, v in self._data.items()})
+
+    @property
+    def index(self):
+        from lexibank_seabor import Dataset
+
+        if self._index is None:
+            self._index = scale_index(
+                Index.cached(Dataset().cldf_reader()), self.factor, axis=self.axis)
+        return self._index
+
+
+def _cluster_method():
+    try:
+        import igraph  # noqa: F401
+        return 'infomap'
+    except ImportError:  # pragma: no cover
+        return 'upgma'
+
+
+@benchmark('makecldf')
+def _makecldf(data, seed=1234, runs=100, workers=1):
+    """
+    The detection and evaluation stages of `makecldf`, with the parameters of `Dataset.detect`.
+    """
+    import lingrex.cognates
+    from seabor.scorer import internal_cognates
+    from seabor.borrowing import external_cognates, own_clusters
+    from seabor.evaluate import Evaluation
+
+    wl = data.wordlist()
+    random.seed(seed)
+    with stage('internal_cognates'):
+        internal_cognates(
+            wl, runs=runs, ref='autocogids', threshold=0.50, cluster_method=_cluster_method(),
+            workers=workers, seed=seed)
+    with stage('common_morpheme_cognates'):
+        lingrex.cognates.common_morpheme_cognates(
+            wl, ref='autocogid', cognates='autocogids', morphemes='automorphemes')
+    with stage('external_cognates'):
+        external_cognates(
+            wl, cognates='autocogid', ref='autoborid', threshold=0.35, workers=workers)
+    with stage('evaluation'):
+        idxs = list(wl)
+        wl.add_entries(
+            'userborid',
+            dict(zip(idxs, own_clusters([wl[idx, 'uborid'] for idx in idxs]))),
+            lambda x: x)
+        for idx, borid in zip(idxs, own_clusters([wl[idx, 'autoborid'] for idx in idxs])):
+            wl[idx, 'autoborid'] = borid
+        for gold, test in [('ucogid', 'autocogid'), ('userborid', 'autoborid')]:
+            Evaluation(wl, gold, [test]).scores()
+            Evaluation(wl, gold, [test], by='concept').breakdown()
+            Evaluation(wl, gold, [test], by='family').breakdown()
+    return len(wl)
+
+
+@benchmark('distribution')
+def _distribution(data, seed=1234, runs=100, workers=1):
+    """
+    The `Scorer` of `seabor.distribution` and a permutation test for half of the concepts.
+    """
+    from seaborcommands.distribution import Scorer, permutation_test
+
+    index = data.index
+    with stage('scorer'):
+        scorer = Scorer.from_index(index)
+    with stage('permutations'):
+        permutation_test(scorer, list(scorer.concepts)[::2], runs, precision=0, seed=seed)
+    return len(index.form_ids)
+
+
+@benchmark('admixture')
+def _admixture(data, seed=1234, runs=100, workers=1):
+    """
+    The proportions of borrowed forms per doculect, as computed by `seabor.admixture`.
+    """
+    from seabor.admixture import proportions
+
+    index = data.index
+    with stage('proportions'):
+        proportions(index, list(range(len(index.concept_ids))))
+    return len(index.form_ids)
+
+
+@benchmark('fullcomparison')
+def _fullcomparison(data, seed=1234, runs=100, workers=1):
+    """
+    The threshold sweep of `seabor.fullcomparison` for SCA and full cognates.
+    """
+    from seaborcommands.fullcomparison import compare
+
+    wl = data.wordlist()
+    with stage('sweep'):
+        compare(
+            {k: wl[k] if k else wl.columns for k in [0] + list(wl)},
+            False, False, _cluster_method(), seed)
+    return len(wl)
+
+
+@benchmark('map')
+def _map(data, seed=1234, runs=100, workers=1):
+    """
+    The data preparation of `plots.Map` for all cross-family xenolog clusters.
+    """
+    from cldfviz.map import MarkerFactory
+    from cldfviz.cli_util import import_subclass
+    from lexibank_seabor import Dataset
+    from seaborcommands.clustermaps import cross_family_clusters
+
+    # The dataset's `plots.py` is not a module of a package:
+    Map = import_subclass(str(Dataset().dir / 'plots.py'), MarkerFactory)
+    index = data.index
+    # `Map.data_cluster` only looks up the family of each language:
+    languages = {
+        str(lid): types.SimpleNamespace(data={'Family': str(family)})
+        for lid, family in zip(index.language_ids, index.language_family)}
+    with stage('clusters'):
+        clusters = cross_family_clusters(index)
+    with stage('data_cluster'):
+        for pid, cid in clusters:
+            Map.data_cluster(languages, index, pid, cid)
+    return len(index.form_ids)
+
+
+def _run(name, factor, repeat, axis, concepts, params):
+    """
+    Run a benchmark `repeat` times, returning the stage records of each run.
+    """
+    data, res, forms = Data(factor, axis=axis, concepts=concepts), [], None
+    for _ in range(repeat):
+        with Profiler() as profiler:
+            forms = BENCHMARKS[name](data, **params)
+        res.append(profiler.report()['stages'])
+    return forms, res
+
+
+def run(name, factor, repeat=3, axis='concept', concepts=None, **params):
+    """
+    Run a benchmark in a fresh process - so that peak memory use is measured for the benchmark
+    alone.
+
+    :param params: Keyword parameters of the benchmark, i.e. `seed`, `runs` and `workers`.
+    :return: `list` of results per stage, with wall time and CPU time as median (and minimum) \
+    over `repeat` runs.
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        forms, runs = executor.submit(
+            _run, name, factor, repeat, axis, concepts, params).result()
+    res = []
+    for i, s in enumerate(runs[0]):
+        records = [r[i] for r in runs]
+        res.append(collections.OrderedDict([
+            ('benchmark', name),
+            ('stage', s['name']),
+            ('parent', s['parent']),
+            ('factor', factor),
+            ('forms', forms),
+            ('wall_time', statistics.median(r['wall_time'] for r in records)),
+            ('wall_time_min', min(r['wall_time'] for r in records)),
+            ('cpu_time', statistics.median(r['cpu_time'] for r in records)),
+            ('peak_rss_mb', max(r['peak_rss_mb'] for r in records)),
+            ('counts', s['counts']),
+        ]))
+    return res
+
+
+def _git(*args):
+    try:
+        return subprocess.run(
+            ['git'] + list(args),
+            cwd=str(pathlib.Path(__file__).parent),
+            capture_output=True,
+            text=True).stdout.strip()
+    except OSError:  # pragma: no cover
+        return ''
+
+
+def save(results, directory, **params):
+    """
+    Store benchmark results as JSON file in `directory`, named after the current git commit.
+
+    :return: Path of the JSON file.
+    """
+    commit = _git('rev-parse', '--short', 'HEAD') or 'unknown'
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / '{0}-{1}.json'.format(commit, time.strftime('%Y%m%dT%H%M%S'))
+    with path.open('w', encoding='utf8') as fp:
+        json.dump(collections.OrderedDict([
+            ('commit', commit),
+            ('dirty', bool(_git('status', '--porcelain', '--untracked-files=no'))),
+            ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('versions', _versions('lingpy', 'lingrex', 'pylexibank', 'numpy')),
+            ('params', params),
+            ('results', results),
+        ]), fp, indent=2)
+    return path
+
+
+def compare(results, previous):
+    """
+    Compare benchmark results with previous results - e.g. for another commit.
+
+    :param previous: `list` of results as stored by `save`.
+    :return: `dict` mapping `(benchmark, stage, factor)` to the ratio of the median wall times.
+    """
+    old = {(r['benchmark'], r['stage'], r['factor']): r['wall_time'] for r in previous}
+    return {
+        (r['benchmark'], r['stage'], r['factor']):
+            r['wall_time'] / old[r['benchmark'], r['stage'], r['factor']]
+        for r in results
+        if old.get((r['benchmark'], r['stage'], r['factor']))}
@@ -0,0 +1,214 @@
+"""
+Detection of cross-family cognates - i.e. candidate borrowings - concept by concept.
+"""
+import itertools
+import collections
+import multiprocessing
+
+import numpy as np
+import networkx as nx
+from lingpy import Pairwise
+
+from seabor.cache import wordlist_digest
+from seabor.distances import position
+from seabor.profiling import count
+
+__all__ = ['external_cognates', 'own_clusters']
+
+
+def _canonical_cogids(wordlist, idxs, cognates):
+    """
+    Renumber cognate IDs in order of first appearance, so that a renumbering of cognate sets in
+    other concepts does not change the cache key.
+    """
+    canonical = {}
+    return [canonical.setdefault(wordlist[idx, cognates], len(canonical) + 1) for idx in idxs]
+
+
+def _task(args):
+    return _external_cognates(*args[:-1], **args[-1])
+
+
+def _distances(tokens, pairs, gop, align_mode, matrix=None):
+    """
+    Compute the SCA distances for pairs of words of a concept.
+
+    :param pairs: `list` of pairs `(i, j)` of positions in `tokens`, with `i < j`.
+    :param matrix: Condensed distance matrix for all words of the concept, with `nan` for \
+    distances not computed yet, or `None`.
+    :return: triple `(distances, number of alignments computed, matrix)` - with `matrix` the \
+    condensed distance matrix, with the computed distances filled in.
+    """
+    if matrix is None:
+        matrix = np.full(len(tokens) * (len(tokens) - 1) // 2, np.nan)
+    else:
+        matrix = np.asarray(matrix, dtype=float)
+    cells = [position(i, j, len(tokens)) for i, j in pairs]
+    todo = [(c, i, j) for c, (i, j) in zip(cells, pairs) if np.isnan(matrix[c])]
+    if todo:
+        # SCA distances are symmetric, so we only align each pair of words in one direction:
+        aligned = Pairwise([(" ".join(tokens[i]), " ".join(tokens[j])) for _, i, j in todo])
+        aligned.align(distance=True, gop=gop, mode=align_mode)
+        for (c, _, _), alignment in zip(todo, aligned._alignments):
+            matrix[c] = alignment[2]
+    return [float(matrix[c]) for c in cells], len(todo), matrix
+
+
+def _external_cognates(
+        idxs, tokens, families, cogids, threshold, gop, align_mode, distances=None, key=None):
+    """
+    Cluster the cognate sets of one concept into xenolog clusters.
+
+    This follows the body of the loop over concepts in `lingrex.borrowing.external_cognates`, but
+    computes the distances between words of different families in one go - looking them up in
+    the `seabor.distances.DistanceStore` `distances` (under `key`), if given.
+
+    The function may run in a worker process, so it only reads from the store. Newly computed
+    distances are returned, to be stored by the calling process.
+
+    :return: triple `(borids, number of alignments computed, matrix)`, with `borids` the `list` \
+    of xenolog cluster IDs - starting with 1, and 0 for words not in a cluster - and `matrix` the \
+    condensed distance matrix to store, or `None` if no distances were computed.
+    """
+    B = {idx: 0 for idx in idxs}
+    borid, aligned, matrix = 1, 0, None
+    if len(set(families)) > 1:
+        G = nx.Graph()
+        # assemble cogids to groups, of positions of words
+        groups = collections.defaultdict(list)
+        for i, c in enumerate(cogids):
+            groups[c] += [i]
+
+        for group, items in groups.items():
+            G.add_node(str(group), idxs=[idxs[i] for i in items], family=families[items[0]])
+
+        # compare groups of different families
+        comparisons = [
+            ((gA, iA), (gB, iB))
+            for (gA, iA), (gB, iB) in itertools.combinations(list(groups.items()), r=2)
+            if G.nodes[str(gA)]["family"] != G.nodes[str(gB)]["family"]]
+        dst, aligned, matrix = _distances(
+            tokens,
+            [(min(a, b), max(a, b))
+             for (_, iA), (_, iB) in comparisons for a, b in itertools.product(iA, iB)],
+            gop,
+            align_mode,
+            matrix=distances.get(key) if distances else None)
+        start = 0
+        for (gA, iA), (gB, iB) in comparisons:
+            d = dst[start:start + len(iA) * len(iB)]
+            start += len(iA) * len(iB)
+            d = sum(d) / len(d)
+            if d <= threshold:
+                G.add_edge(str(gA), str(gB), distance=d)
+
+        for comp in nx.connected_components(G):
+            if len(comp) > 1:
+                for cogid in comp:
+                    for idx in G.nodes[cogid]["idxs"]:
+                        B[idx] = borid
+                borid += 1
+    return [B[idx] for idx in idxs], aligned, matrix if aligned else None
+
+
+def external_cognates(
+    wordlist,
+    cognates="autocogid",
+    ref="autoborid",
+    threshold=0.3,
+    segments="tokens",
+    gop=-1,
+    family="family",
+    doculect="doculect",
+    align_mode="overlap",
+    cache=None,
+    distances=None,
+    workers=1,
+    log=None,
+):
+    """
+    Compute language-external cognates, like `lingrex.borrowing.external_cognates`.
+
+    `lingrex.borrowing.external_cognates` analyses each concept independently, numbering xenolog
+    clusters consecutively across concepts. Here, the numbering is reconstructed from the results
+    per concept - which are identical. Thus, results can be cached per concept, passing a
+    `seabor.cache.Cache` as `cache`, and only concepts for which the data has changed are
+    re-analysed. Concepts can also be analysed in parallel, by `workers` processes.
+
+    Distances between words are looked up in - and added to - the
+    `seabor.distances.DistanceStore` passed as `distances`, so re-analysing a concept - e.g. with
+    another threshold or other cognate sets - only aligns pairs of words not compared before.
+    """
+    params = dict(threshold=threshold, gop=gop, align_mode=align_mode)
+    keys, results, tasks = {}, {}, []
+    for concept in wordlist.rows:
+        idxs = wordlist.get_list(row=concept, flat=True)
+        cogids = _canonical_cogids(wordlist, idxs, cognates)
+        keys[concept] = cache.key(
+            wordlist_digest(wordlist, columns=[doculect, family, segments], idxs=idxs),
+            list(zip(idxs, cogids)),
+            'external_cognates',
+            **params) if cache else None
+        borids = cache.get(keys[concept]) if cache else None
+        if borids is None:
+            # lingpy's list types can't be pickled, so we pass plain lists to workers:
+            tokens = [list(wordlist[idx, segments]) for idx in idxs]
+            tasks.append((concept, (
+                idxs,
+                tokens,
+                [wordlist[idx, family] for idx in idxs],
+                cogids,
+                dict(
+                    params,
+                    distances=distances,
+                    key=distances.key(
+                        'external_cognates', concept, tokens, gop=gop, align_mode=align_mode)
+                    if distances else None))))
+        else:
+            results[concept] = borids
+
+    if log and cache:
+        log.info('re-used cross-family cognates for {0} of {1} concepts'.format(
+            len(results), len(wordlist.rows)))
+
+    def collect(borids):
+        # Results are returned in the order of the tasks, and cached as soon as they arrive, so
+        # an interrupted run can be resumed. Only this process writes to the caches, so workers
+        # never see partially updated distance matrices.
+        for (concept, task), (res, aligned, matrix) in zip(tasks, borids):
+            results[concept] = res
+            count('alignments', aligned)
+            if cache:
+                cache.set(keys[concept], res)
+            if distances and matrix is not None:
+                distances.set(task[-1]['key'], matrix)
+
+    workers = max(1, min(workers, len(tasks)))
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            collect(pool.imap(_task, [task for _, task in tasks], chunksize=4))
+    else:
+        collect(_task(task) for _, task in tasks)
+
+    # Now assemble the global numbering, concept by concept:
+    B, offset = {}, 0
+    for concept in wordlist.rows:
+        borids = results[concept]
+        for idx, borid in zip(wordlist.get_list(row=concept, flat=True), borids):
+            B[idx] = offset + borid if borid else 0
+        offset += max(borids)
+    wordlist.add_entries(ref, B, lambda x: x)
+
+
+def own_clusters(values):
+    """
+    Place items which are not part of any cluster - i.e. with cluster ID 0 - into clusters of their
+    own, numbered consecutively after the largest cluster ID.
+
+    :param values: Cluster IDs.
+    :return: `list` of cluster IDs.
+    """
+    values = np.array([int(v) for v in values], dtype=int)
+    singletons = values == 0
+    values[singletons] = np.arange(1, singletons.sum() + 1) + max(values, default=0)
+    return values.tolist()
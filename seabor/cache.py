@@ -0,0 +1,129 @@
+"""
+Content-addressed on-disk cache for columns computed by the stages of `makecldf`.
+
+Cache keys are computed from the content of the input wordlist and the parameters of a stage, so
+a cached result is only reused if neither the data nor the parameters changed. Since the stages
+of `makecldf` build on each other, the key of a stage is typically derived from the key of the
+previous stage.
+"""
+import os
+import json
+import hashlib
+import pathlib
+
+__all__ = ['Cache', 'wordlist_digest']
+
+
+def _md5(*items):
+    return hashlib.md5(
+        json.dumps(items, sort_keys=True, ensure_ascii=False, default=str).encode('utf8')
+    ).hexdigest()
+
+
+def wordlist_digest(wl, columns=None, idxs=None):
+    """
+    Compute a checksum for the content of a `lingpy.Wordlist`.
+
+    :param columns: Restrict the checksum to these columns.
+    :param idxs: Restrict the checksum to these rows.
+    """
+    md5 = hashlib.md5()
+    md5.update(json.dumps(columns or wl.columns).encode('utf8'))
+    for idx in sorted(wl if idxs is None else idxs):
+        row = wl[idx] if columns is None else [wl[idx, col] for col in columns]
+        md5.update(json.dumps([idx] + row, ensure_ascii=False, default=str).encode('utf8'))
+    return md5.hexdigest()
+
+
+class Cache:
+    """
+    A directory of JSON files, storing columns of a wordlist.
+
+    If the total size of the cache exceeds `maxsize` bytes, the least recently used entries are
+    evicted upon calling `evict`.
+    """
+    suffix = '.json'
+
+    def __init__(self, path, maxsize=128 * 1024 * 1024):
+        self.path = pathlib.Path(path)
+        self.maxsize = maxsize
+
+    @staticmethod
+    def key(*items, **params):
+        """
+        Compute a cache key from the keys of upstream stages and the parameters of a stage.
+        """
+        return _md5(items, params)
+
+    def _fname(self, key):
+        return self.path / '{0}{1}'.format(key, self.suffix)
+
+    def get(self, key):
+        """
+        :return: The data cached for `key` or `None`.
+        """
+        fname = self._fname(key)
+        try:
+            with fname.open(encoding='utf8') as fp:
+                data = json.load(fp)
+            # Mark the entry as recently used:
+            os.utime(str(fname))
+        except FileNotFoundError:  # Not cached - or evicted by another process.
+            return None
+        return data
+
+    def set(self, key, data):
+        """
+        Cache JSON serializable `data` for `key`.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that concurrent processes never read partial data:
+        tmp = self.path / '{0}.{1}.tmp'.format(key, os.getpid())
+        with tmp.open('w', encoding='utf8') as fp:
+            json.dump(data, fp, ensure_ascii=False)
+        tmp.replace(self._fname(key))
+
+    def load(self, wl, key):
+        """
+        Add the columns cached for `key` to the wordlist `wl`.
+
+        :return: `True` if the key was found in the cache, `False` otherwise.
+        """
+        data = self.get(key)
+        if data is None:
+            return False
+        for col, values in data.items():
+            wl.add_entries(
+                col, {int(idx): value for idx, value in values.items()}, lambda x: x,
+                override=True)
+        return True
+
+    def dump(self, wl, key, *columns):
+        """
+        Store `columns` of the wordlist `wl` in the cache.
+        """
+        self.set(key, {col: {idx: wl[idx, col] for idx in wl} for col in columns})
+
+    def evict(self):
+        """
+        Remove the least recently used entries, until the cache is no larger than `maxsize`.
+
+        Entries read or written while evicting may be lost, so this should only be called when no
+        other process uses the cache - e.g. from the main process, once all pools are joined.
+        """
+        entries = []
+        for p in self.path.glob('*' + self.suffix):
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        size = sum(e[1] for e in entries)
+        for _, fsize, p in sorted(entries):
+            if size <= self.maxsize:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            size -= fsize
@@ -0,0 +1,78 @@
+"""
+Offline access to Concepticon concept lists.
+
+Concept lists are looked up in a local cache first. If a list isn't cached yet, it is read from
+the Concepticon catalog passed on the command line or configured for cldfbench - or, as last
+resort, downloaded from GitHub - and added to the cache. Thus, once the cache is populated, no
+network access is required.
+"""
+import re
+import pathlib
+import urllib.error
+import urllib.request
+
+from csvw.dsv import reader
+from cldfcatalog import Config
+
+__all__ = ['concepticon_glosses', 'is_conceptlist_id']
+
+# IDs of Concepticon concept lists, e.g. Swadesh-1955-100, are used as file names:
+ID_PATTERN = re.compile(r'[A-Za-z0-9]+-[0-9]{4}-[A-Za-z0-9-]+')
+
+URL = "https://raw.githubusercontent.com/concepticon/concepticon-data/v2.5.0/concepticondata/" \
+      "conceptlists/{0}.tsv"
+
+
+def is_conceptlist_id(conceptlist):
+    """
+    :return: Whether `conceptlist` is a valid Concepticon concept list ID.
+    """
+    return bool(ID_PATTERN.fullmatch(conceptlist))
+
+
+def _catalog_path(conceptlist, catalog=None):
+    if catalog is None:
+        try:
+            catalog = Config.from_file().get_clone('concepticon')
+        except KeyError:  # No catalog configured.
+            return None
+    p = pathlib.Path(catalog) / 'concepticondata' / 'conceptlists' / '{0}.tsv'.format(conceptlist)
+    return p if p.exists() else None
+
+
+def _read(lines):
+    return [c['CONCEPTICON_GLOSS'] for c in reader(lines, dicts=True, delimiter='\t')
+            if c.get('CONCEPTICON_GLOSS')]
+
+
+def concepticon_glosses(conceptlist, cache, catalog=None):
+    """
+    Retrieve the Concepticon glosses of the concepts in a concept list.
+
+    :param conceptlist: Concept list ID, e.g. `Swadesh-1955-100`.
+    :param cache: Directory to cache concept lists in.
+    :param catalog: Path to a clone of the Concepticon data, e.g. `args.concepticon.dir` - \
+    defaults to the clone configured for cldfbench.
+    :return: `list` of Concepticon glosses.
+    :raises ValueError: if the concept list ID is invalid, or the concept list can neither be \
+    found in the catalog nor downloaded.
+    """
+    if not is_conceptlist_id(conceptlist):
+        raise ValueError('invalid concept list ID: {0}'.format(conceptlist))
+    cached = pathlib.Path(cache) / '{0}.txt'.format(conceptlist)
+    if cached.exists():
+        return cached.read_text(encoding='utf8').splitlines()
+
+    path = _catalog_path(conceptlist, catalog)
+    if path:
+        glosses = _read(path.read_text(encoding='utf8').split('\n'))
+    else:
+        try:
+            with urllib.request.urlopen(URL.format(conceptlist)) as res:
+                glosses = _read(res.read().decode('utf8').split('\n'))
+        except urllib.error.URLError as e:  # Unknown concept list or no network access.
+            raise ValueError('concept list {0} not available: {1}'.format(conceptlist, e))
+
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    cached.write_text('\n'.join(glosses), encoding='utf8')
+    return glosses
@@ -0,0 +1,143 @@
+"""
+Persistent store of pairwise distances between the words of a concept.
+
+Partial cognate detection, cross-family cognate detection and the threshold sweep of
+`seabor.fullcomparison` all align the words of each concept pairwise - which is far more
+expensive than clustering the resulting distances. `DistanceStore` keeps the distances of each
+concept as condensed distance matrix in a `.npy` file. Matrices are keyed by the concept and its
+words (doculects and tokens), the alignment parameters and a checksum of the scoring function, so
+re-running an analysis with another threshold or cluster method only costs the clustering.
+"""
+import os
+import hashlib
+import itertools
+
+import numpy as np
+from lingpy.algorithm import misc
+from lingpy.compare.partial import _get_slices
+
+from seabor.cache import Cache
+from seabor.profiling import count
+
+__all__ = ['DistanceStore', 'scorer_digest']
+
+# Keyword arguments of `lingpy.compare.partial._get_slices`, i.e. determining the morphemes:
+_SLICE_KEYWORDS = ['sep', 'word_sep', 'word_seps', 'seps', 'tones', 'split_on_tones']
+
+
+def scorer_digest(scorer):
+    """
+    Compute a checksum for a scoring function, i.e. a `lingpy` `ScoreDict`.
+    """
+    if scorer is None:
+        return None
+    md5 = hashlib.md5()
+    md5.update(repr(sorted(scorer.chars2int.items(), key=lambda i: i[1])).encode('utf8'))
+    md5.update(np.asarray(scorer.matrix, dtype=float).tobytes())
+    return md5.hexdigest()
+
+
+def _params(kw):
+    """
+    Select the parameters relevant for the distance matrices - lingpy also passes functions for
+    clustering, which would make keys differ between calls.
+    """
+    return {k: v for k, v in kw.items() if not callable(v)}
+
+
+def condensed(matrix):
+    """
+    :return: The upper triangle of a symmetric matrix, in row-major order.
+    """
+    return [matrix[i][j] for i, j in itertools.combinations(range(len(matrix)), 2)]
+
+
+def position(i, j, n):
+    """
+    :return: The position of cell `(i, j)` - with `i < j` - in a condensed `n x n` matrix.
+    """
+    return n * i - i * (i + 1) // 2 + j - i - 1
+
+
+class DistanceStore(Cache):
+    """
+    A directory of condensed distance matrices, stored as `.npy` files.
+
+    Like `seabor.cache.Cache`, the least recently used matrices are evicted upon calling `evict`
+    if the total size of the store exceeds `maxsize` bytes.
+    """
+    suffix = '.npy'
+
+    def __init__(self, path, maxsize=512 * 1024 * 1024):
+        Cache.__init__(self, path, maxsize=maxsize)
+
+    def get(self, key):
+        """
+        :return: Condensed matrix stored for `key` - as numpy array - or `None`.
+        """
+        fname = self._fname(key)
+        try:
+            os.utime(str(fname))
+            return np.load(str(fname))
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, data):
+        """
+        Store a condensed distance matrix for `key`.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self.path / '{0}.{1}.tmp'.format(key, os.getpid())
+        with tmp.open('wb') as fp:
+            np.save(fp, np.asarray(data, dtype=float))
+        tmp.replace(self._fname(key))
+
+    def wrap(self, lex):
+        """
+        Make a `lingpy.LexStat` or `lingpy.compare.partial.Partial` object look up the distance
+        matrices for cognate detection in the store - computing and storing them if necessary.
+        """
+        for name in ['_get_matrices', '_get_partial_matrices']:
+            if hasattr(lex, name):
+                setattr(lex, name, self._matrices(lex, name, getattr(lex, name)))
+
+    def _matrices(self, lex, name, func):
+        """
+        Wrap a `lingpy` method computing distance matrices per concept, see
+        `lingpy.LexStat._get_matrices`.
+        """
+        def wrapper(concept=False, **kw):
+            method = kw.get('method', 'sca')
+            digest = scorer_digest(
+                lex.cscorer if method == 'lexstat' else
+                (lex.rscorer if method == 'sca' else None))
+            for c in [concept] if concept else sorted(lex.rows):
+                idxs = lex.get_list(row=c, flat=True)
+                key = self.key(
+                    name,
+                    c,
+                    [[lex[idx, lex._col_name], lex[idx, lex._segments]] for idx in idxs],
+                    digest,
+                    **_params(kw))
+                stored = self.get(key)
+                if stored is None:
+                    stored = condensed(next(func(concept=c, **kw)))
+                    # One alignment per pair of words (or morphemes) of the concept:
+                    count('alignments', len(stored))
+                    self.set(key, stored)
+                # lingpy's cluster methods access cells as `matrix[i][j]`, which is much faster
+                # for lists than for numpy arrays:
+                matrix = misc.squareform(
+                    stored.tolist() if isinstance(stored, np.ndarray) else stored)
+                if concept:
+                    yield matrix
+                elif name == '_get_partial_matrices':
+                    # The matrix rows correspond to the morphemes of the words:
+                    slices = {k: v for k, v in kw.items() if k in _SLICE_KEYWORDS}
+                    yield c, [
+                        (idx, i, slc) for idx in idxs
+                        for i, slc in enumerate(_get_slices(lex[idx, lex._segments], **slices))
+                    ], matrix
+                else:
+                    yield c, idxs, matrix
+        return wrapper
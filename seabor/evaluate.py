@@ -0,0 +1,240 @@
+"""
+B-cubed evaluation of cognate and xenolog clusters, computed from contingency tables.
+
+`lingpy.evaluate.acd.bcubes` walks the etymological dictionary of a wordlist for each pair of
+partitions. Here, partitions are integer-coded once, and the B-cubed scores of any number of test
+partitions are derived from sparse contingency tables of gold and test clusters.
+
+Like `lingpy.evaluate.acd.bcubes`, a cluster is represented by the first word of each of its
+doculects, and a cluster with words from just one doculect contributes a single item with score
+1. The score of a partition with respect to a cluster `c` of the other partition is then
+`sum_k m_ck ** 2 / n_c`, summed over all clusters, and divided by the number of representatives -
+where `m_ck` is the number of representatives of `c` in cluster `k` and `n_c` the number of
+representatives of `c`.
+
+`consensus` combines several partitions - e.g. computed with different random seeds - into one.
+"""
+import collections
+import multiprocessing
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+__all__ = ['Evaluation', 'bcubes', 'bootstrap', 'format_ci', 'consensus']
+
+# Number of resamples drawn from one random seed. Resamples are drawn in chunks of this size - with
+# seeds derived from the seed passed to `bootstrap` - so that the results don't depend on the
+# number of workers.
+CHUNK = 500
+
+
+def _codes(values):
+    codes = {}
+    return np.array([codes.setdefault(v, len(codes)) for v in values], dtype=int)
+
+
+def _counts(one, other, taxa, groups, ngroups):
+    """
+    Compute the summed B-cubed scores of the clusters in `other` with respect to the clusters in
+    `one` - i.e. recall, if `one` is the gold partition - per group of words.
+
+    :return: `(ngroups, 2)` array with summed scores and numbers of items per group.
+    """
+    # Representatives: the first word of each doculect in a cluster (of a group).
+    _, first = np.unique(np.stack([groups, one, taxa], axis=1), axis=0, return_index=True)
+    rows, cluster = np.unique(
+        np.stack([groups[first], one[first]], axis=1), axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    table = sparse.coo_matrix(
+        (np.ones(len(first)), (cluster, other[first])),
+        shape=(len(rows), other.max() + 1)).tocsr()
+    table.sum_duplicates()
+    scores = np.asarray(table.multiply(table).sum(axis=1)).reshape(-1) / \
+        np.asarray(table.sum(axis=1)).reshape(-1)
+    return np.stack([
+        np.bincount(rows[:, 0], weights=scores, minlength=ngroups),
+        np.bincount(groups[first], minlength=ngroups).astype(float)], axis=-1)
+
+
+class Evaluation:
+    """
+    B-cubed evaluation of test partitions against a gold partition of the words in a wordlist.
+
+    Scores are computed for each group of words - e.g. per concept or family - and can be
+    aggregated over (weighted) groups.
+
+    :ivar tests: `list` of names of the columns with test partitions.
+    :ivar groups: `list` of group labels - `[None]` if words are not grouped.
+    :ivar precision: `(tests, groups, 2)` array with summed precision scores and numbers of items.
+    :ivar recall: `(tests, groups, 2)` array with summed recall scores and numbers of items.
+    """
+    def __init__(self, wordlist, gold, tests, by=None):
+        """
+        :param wordlist: `lingpy.Wordlist` instance.
+        :param gold: Name of the column with gold cluster IDs.
+        :param tests: Names of the columns with test cluster IDs.
+        :param by: Name of the column to group words by, e.g. `concept` or `family`.
+        """
+        idxs = list(wordlist)
+        self.gold, self.tests = gold, list(tests)
+        taxa = _codes(wordlist[idx, wordlist._col_name] for idx in idxs)
+        if by:
+            labels = collections.OrderedDict()
+            groups = np.array(
+                [labels.setdefault(wordlist[idx, by], len(labels)) for idx in idxs], dtype=int)
+            self.groups = list(labels)
+        else:
+            groups, self.groups = np.zeros(len(idxs), dtype=int), [None]
+
+        gold = _codes(wordlist[idx, self.gold] for idx in idxs)
+        self.precision, self.recall = [], []
+        for test in self.tests:
+            test = _codes(wordlist[idx, test] for idx in idxs)
+            self.recall.append(_counts(gold, test, taxa, groups, len(self.groups)))
+            self.precision.append(_counts(test, gold, taxa, groups, len(self.groups)))
+        self.precision, self.recall = np.array(self.precision), np.array(self.recall)
+
+    @staticmethod
+    def _prf(precision, recall):
+        p = precision[..., 0] / precision[..., 1]
+        r = recall[..., 0] / recall[..., 1]
+        return np.stack([p, r, 2 * p * r / (p + r)], axis=-1)
+
+    def breakdown(self):
+        """
+        :return: `(tests, groups, 3)` array of precision, recall and F-score per group.
+        """
+        return self._prf(self.precision, self.recall)
+
+    def scores(self, weights=None):
+        """
+        Aggregate scores over groups.
+
+        If clusters do not cross groups, the aggregated scores are the scores for all words in the
+        groups. Without grouping, these are the scores computed by `lingpy.evaluate.acd.bcubes`.
+
+        :param weights: `(groups,)` array of group weights - or `(samples, groups)` array to \
+        aggregate several weightings at once.
+        :return: `(tests, 3)` array of precision, recall and F-score - or `(samples, tests, 3)`.
+        """
+        if weights is None:
+            weights = np.ones(len(self.groups))
+        weights = np.asarray(weights, dtype=float)
+        # Sum the scores and numbers of items of the weighted groups:
+        return self._prf(
+            np.einsum('tgk,...g->...tk', self.precision, weights),
+            np.einsum('tgk,...g->...tk', self.recall, weights))
+
+    def table(self):
+        """
+        :return: `list` of rows `[group, test, precision, recall, f-score]`.
+        """
+        return [
+            [group, test] + list(prf)
+            for test, scores in zip(self.tests, self.breakdown())
+            for group, prf in zip(self.groups, scores)]
+
+
+def bcubes(wordlist, gold='cogid', tests=('lexstatid',)):
+    """
+    Compute B-cubed scores for several test partitions in one go.
+
+    :return: `list` of triples `(precision, recall, f-score)`, one per test partition.
+    """
+    return [tuple(float(s) for s in prf) for prf in Evaluation(wordlist, gold, tests).scores()]
+
+
+_EVALUATION = None
+
+
+def _init_worker(evaluation):
+    global _EVALUATION
+    _EVALUATION = evaluation
+
+
+def _resample(task):
+    """
+    Score a chunk of resamples, drawing groups with replacement.
+    """
+    seed, size = task
+    ngroups = len(_EVALUATION.groups)
+    weights = np.random.default_rng(seed).multinomial(
+        ngroups, np.full(ngroups, 1 / ngroups), size=size)
+    return _EVALUATION.scores(weights)
+
+
+def bootstrap(evaluation, samples, seed=1234, workers=1, alpha=0.05):
+    """
+    Compute bootstrap confidence intervals for the scores of an evaluation, resampling groups.
+
+    Each resample is a weighting of the groups of the evaluation - the number of times a group was
+    drawn - so scores are aggregated from the per-group counts, without re-scoring partitions.
+
+    :param evaluation: `Evaluation` instance, with words grouped e.g. by concept.
+    :param samples: Number of resamples.
+    :param workers: Number of worker processes to score chunks of resamples.
+    :param alpha: Significance level, i.e. CIs cover `1 - alpha` of the resampled scores.
+    :return: `(tests, 3, 2)` array of lower and upper bounds for precision, recall and F-score.
+    """
+    tasks = [
+        (s, min(CHUNK, samples - i)) for i, s in zip(
+            range(0, samples, CHUNK),
+            np.random.SeedSequence(seed).spawn((samples + CHUNK - 1) // CHUNK))]
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        _init_worker(evaluation)
+        scores = [_resample(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(
+                workers, initializer=_init_worker, initargs=(evaluation,)) as pool:
+            scores = pool.map(_resample, tasks)
+    # Resamples with undefined scores - e.g. when no group with items was drawn - are ignored.
+    return np.moveaxis(np.nanquantile(
+        np.concatenate(scores), [alpha / 2, 1 - alpha / 2], axis=0), 0, -1)
+
+
+def format_ci(ci):
+    """
+    Format a confidence interval for tabular output.
+    """
+    return '{0:.4f}-{1:.4f}'.format(*ci)
+
+
+def consensus(partitions, groups, unassigned=None):
+    """
+    Compute the consensus of several partitions of the same items.
+
+    Two items are linked if they are in the same cluster in a majority of the partitions, and the
+    consensus clusters are the connected components of these links.
+
+    :param partitions: `list` of partitions, each a `list` of cluster IDs of the items.
+    :param groups: `list` of group labels of the items, e.g. concepts. Clusters must not cross \
+    groups.
+    :param unassigned: Cluster ID used for items which are not part of any cluster (e.g. `0` for \
+    xenolog clusters). If given, items which end up in a consensus cluster of their own are \
+    assigned this ID.
+    :return: `list` of consensus cluster IDs, numbered from 1 in order of first appearance.
+    """
+    codes = np.array([_codes(p) for p in partitions])
+    assigned = np.array([[v != unassigned for v in p] for p in partitions]) \
+        if unassigned is not None else np.ones(codes.shape, dtype=bool)
+    groups = _codes(groups)
+
+    labels, offset = np.zeros(codes.shape[1], dtype=int), 0
+    for group in range(groups.max() + 1):
+        items = np.flatnonzero(groups == group)
+        c, a = codes[:, items], assigned[:, items]
+        votes = ((c[:, :, None] == c[:, None, :]) & a[:, :, None] & a[:, None, :]).sum(axis=0)
+        n, components = connected_components(
+            sparse.csr_matrix(2 * votes > len(partitions)), directed=False)
+        labels[items] = components + offset
+        offset += n
+
+    sizes, ids, res = np.bincount(labels), {}, []
+    for label in labels:
+        if unassigned is not None and sizes[label] == 1:
+            res.append(unassigned)
+        else:
+            res.append(ids.setdefault(label, len(ids) + 1))
+    return res
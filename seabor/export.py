@@ -0,0 +1,209 @@
+"""
+Indexed SQLite and columnar Parquet exports of the CLDF tables.
+
+Reading the CLDF tables with `pycldf` converts each field according to its datatype, which takes
+seconds for `FormTable` and `CognateTable`. The exports store the tables as written - list-valued
+columns like `Segments` as joined string, only numbers and booleans are converted - so the tables
+can be read in one go, and rows can be selected by the ID columns they reference, e.g. all
+automatically detected xenolog clusters:
+
+    >>> db = connect(cldf)
+    >>> rows = query(db, 'borrowings', Xenolog_Cluster_ID='auto-')
+
+Both exports record the checksum of the CLDF data they were created from (see
+`seabor.index._digest`), so stale exports can be detected - `seabor.index.Index` is re-built from
+an up-to-date SQLite export rather than from the CSV files.
+
+Writing Parquet files requires `pyarrow` (installable as extra `parquet`).
+"""
+import csv
+import pathlib
+import sqlite3
+import decimal
+import contextlib
+import collections
+
+from seabor.index import _digest, sqlite_digest
+
+__all__ = ['TABLES', 'INDEXED', 'to_sqlite', 'to_parquet', 'export', 'connect', 'query']
+
+# CLDF components and the names of the corresponding tables in the exports:
+TABLES = collections.OrderedDict([
+    ('LanguageTable', 'languages'),
+    ('ParameterTable', 'parameters'),
+    ('FormTable', 'forms'),
+    ('CognateTable', 'cognates'),
+    ('BorrowingTable', 'borrowings'),
+])
+# Columns to index in the SQLite export:
+INDEXED = [
+    'ID', 'Form_ID', 'Target_Form_ID', 'Cognateset_ID', 'Xenolog_Cluster_ID', 'Language_ID',
+    'Parameter_ID']
+SQLITE = 'cldf.sqlite3'
+PARQUET = 'parquet'
+
+_SQL_TYPES = {
+    'boolean': 'INTEGER',
+    'integer': 'INTEGER',
+    'decimal': 'REAL',
+    'float': 'REAL',
+    'double': 'REAL',
+}
+
+
+def _columns(table):
+    """
+    :return: `list` of pairs `(column, SQL type)`.
+    """
+    res = []
+    for col in table.tableSchema.columns:
+        base = col.datatype.base if col.datatype else 'string'
+        res.append((col, 'TEXT' if col.separator else _SQL_TYPES.get(base, 'TEXT')))
+    return res
+
+
+def _rows(cldf, table):
+    """
+    Read the rows of a CLDF table, converting only numbers and booleans.
+    """
+    columns = _columns(table)
+    path = pathlib.Path(str(cldf.directory)) / str(table.url)
+    with path.open(encoding='utf8', newline='') as fp:
+        reader = csv.reader(fp)
+        header = next(reader)
+        assert header == [col.name for col, _ in columns], path
+        convert = [i for i, (_, t) in enumerate(columns) if t != 'TEXT']
+        for row in reader:
+            row = [v or None for v in row]
+            for i in convert:
+                if row[i] is not None:
+                    row[i] = columns[i][0].read(row[i])
+                    if isinstance(row[i], decimal.Decimal):
+                        row[i] = float(row[i])
+            yield row
+
+
+def _tables(cldf):
+    for component, name in TABLES.items():
+        try:
+            yield name, cldf[component]
+        except KeyError:  # pragma: no cover
+            continue
+
+
+def to_sqlite(cldf, path, digest=None):
+    """
+    Write the CLDF tables to a SQLite database, with indexes on the ID columns.
+
+    :param path: Path of the database. An existing database is replaced.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first, so an interrupted export doesn't leave a broken database.
+    tmp = path.parent / (path.name + '.tmp')
+    if tmp.exists():
+        tmp.unlink()
+    with contextlib.closing(sqlite3.connect(str(tmp))) as db:
+        db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        for name, table in _tables(cldf):
+            columns = _columns(table)
+            db.execute('CREATE TABLE {0} ({1})'.format(
+                name, ', '.join('"{0}" {1}'.format(col.name, t) for col, t in columns)))
+            db.executemany(
+                'INSERT INTO {0} VALUES ({1})'.format(name, ', '.join('?' * len(columns))),
+                _rows(cldf, table))
+            for col, _ in columns:
+                if col.name in INDEXED:
+                    db.execute('CREATE INDEX {0}_{1} ON {0} ("{1}")'.format(name, col.name))
+        # The checksum is written last, so an incomplete export is never considered up-to-date.
+        db.execute("INSERT INTO meta VALUES ('digest', ?)", (digest or _digest(cldf),))
+        db.commit()
+    tmp.replace(path)
+    return path
+
+
+def to_parquet(cldf, directory, digest=None):
+    """
+    Write the CLDF tables to Parquet files `<table>.parquet` in `directory`.
+
+    :raises ImportError: If `pyarrow` is not installed.
+    """
+    import pyarrow
+    from pyarrow import parquet
+
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = digest or _digest(cldf)
+    types = {'INTEGER': pyarrow.int64(), 'REAL': pyarrow.float64(), 'TEXT': pyarrow.string()}
+    for name, table in _tables(cldf):
+        columns = _columns(table)
+        schema = pyarrow.schema(
+            [(col.name, types[t]) for col, t in columns], metadata={'digest': digest})
+        rows = list(_rows(cldf, table))
+        data = pyarrow.Table.from_arrays(
+            [pyarrow.array([row[i] for row in rows], type=schema.field(i).type)
+             for i in range(len(columns))],
+            schema=schema)
+        tmp = directory / '{0}.parquet.tmp'.format(name)
+        parquet.write_table(data, str(tmp))
+        tmp.replace(directory / '{0}.parquet'.format(name))
+    return directory
+
+
+def export(cldf, directory, log=None):
+    """
+    Write the SQLite and - if `pyarrow` is installed - the Parquet export of the CLDF data to
+    `directory`.
+    """
+    digest = _digest(cldf)
+    directory = pathlib.Path(directory)
+    res = [to_sqlite(cldf, directory / SQLITE, digest=digest)]
+    try:
+        res.append(to_parquet(cldf, directory / PARQUET, digest=digest))
+    except ImportError:
+        if log:
+            log.warning('pyarrow is not installed, skipping the Parquet export')
+    if log:
+        for path in res:
+            log.info('CLDF data exported to {0}'.format(path))
+    return res
+
+
+def connect(cldf, path=None):
+    """
+    Open the SQLite export of a `pycldf.Dataset` - by default in `.cache/` next to the CLDF
+    directory - re-creating it if the CLDF data has changed.
+
+    :return: `sqlite3.Connection`, returning rows as `sqlite3.Row`.
+    """
+    path = pathlib.Path(path) if path else \
+        pathlib.Path(str(cldf.directory)).parent / '.cache' / SQLITE
+    digest = _digest(cldf)
+    if sqlite_digest(path) != digest:
+        to_sqlite(cldf, path, digest=digest)
+    db = sqlite3.connect(str(path))
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def query(db, table, columns=None, **prefixes):
+    """
+    Select rows of an exported table, by prefix of the values of (indexed) columns.
+
+    Prefixes are matched with `GLOB`, which - unlike `LIKE` - is case-sensitive and uses the
+    indexes of the columns.
+
+    :param columns: Columns to select (default: all columns).
+    :param prefixes: Mapping of column names to prefixes.
+    :return: `list` of rows, in the order of the table.
+    """
+    def escape(s):
+        # Wildcards are matched literally, when enclosed in brackets:
+        return ''.join('[{0}]'.format(c) if c in '*?[' else c for c in s)
+
+    sql = 'SELECT {0} FROM {1}'.format(
+        ', '.join('"{0}"'.format(c) for c in columns) if columns else '*', table)
+    if prefixes:
+        sql += ' WHERE ' + ' AND '.join('"{0}" GLOB ?'.format(c) for c in prefixes)
+    return db.execute(
+        sql + ' ORDER BY rowid', [escape(p) + '*' for p in prefixes.values()]).fetchall()
@@ -0,0 +1,264 @@
+"""
+Indexed, integer-coded view of the CLDF data, shared by the `seabor.*` commands.
+
+Reading `FormTable`, `CognateTable` and `BorrowingTable` from CSV - and re-building the lookups
+between forms, cognate sets and xenolog clusters - is the most expensive part of most commands.
+`Index` does this once, and persists the result as `.npz` file, which is invalidated when the
+CLDF data changes. If the SQLite export of the CLDF data (see `seabor.export`) is up-to-date, the
+index is re-built from the export, which is much faster than parsing the CSV files.
+
+Languages are coded in the order of their IDs, concepts in the order of `ParameterTable`. Forms
+are sorted by language and concept code - keeping the order of `FormTable` otherwise - so the
+forms of a language and concept form a contiguous slice of the form arrays.
+"""
+import sqlite3
+import hashlib
+import pathlib
+import contextlib
+
+import numpy as np
+
+__all__ = ['Index']
+
+
+def _digest(cldf):
+    """
+    Compute a checksum for the CLDF metadata and the content of all tables.
+    """
+    md5 = hashlib.md5()
+    paths = [pathlib.Path(str(cldf.tablegroup._fname))] + [
+        pathlib.Path(str(cldf.directory)) / str(t.url) for t in cldf.tables]
+    for p in paths:
+        md5.update(p.name.encode('utf8'))
+        md5.update(p.read_bytes())
+    return md5.hexdigest()
+
+
+def sqlite_digest(path):
+    """
+    :return: The checksum of the CLDF data stored in a SQLite export, or `None`.
+    """
+    path = pathlib.Path(path)
+    if not path.exists():
+        return None
+    try:
+        with contextlib.closing(sqlite3.connect(str(path))) as db:
+            return db.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()[0]
+    except (sqlite3.Error, TypeError):  # Not an export, or an incomplete one.
+        return None
+
+
+def _csr(members, n):
+    """
+    Compute CSR-style membership arrays.
+
+    :param members: `list` of pairs `(group, item)`, with `group` in `range(n)`.
+    :return: pair `(indptr, items)`, such that the items of group `i` are \
+    `items[indptr[i]:indptr[i + 1]]`, in the order in which they appear in `members`.
+    """
+    groups = np.array([g for g, _ in members], dtype=int)
+    items = np.array([i for _, i in members], dtype=int)
+    order = np.argsort(groups, kind='stable')
+    indptr = np.zeros(n + 1, dtype=int)
+    np.cumsum(np.bincount(groups, minlength=n), out=indptr[1:])
+    return indptr, items[order]
+
+
+class Index:
+    """
+    Integer-coded forms, languages, concepts, cognate sets and xenolog clusters.
+
+    :ivar form_ids: `(forms,)` array of form IDs.
+    :ivar form_language: `(forms,)` array of language indices.
+    :ivar form_concept: `(forms,)` array of concept indices.
+    :ivar form_segments: `(forms,)` array of space-separated segments.
+    :ivar language_ids: `(languages,)` array of language IDs, sorted.
+    :ivar language_family: `(languages,)` array of language families.
+    :ivar concept_ids: `(concepts,)` array of concept IDs, in the order of `ParameterTable`.
+    :ivar concept_glosses: `(concepts,)` array of Concepticon glosses.
+    :ivar cogset_ids: `(cognate sets,)` array of cognate set IDs.
+    :ivar cogset_indptr, cogset_forms: CSR-style membership of forms in cognate sets.
+    :ivar xenolog_ids: `(xenolog clusters,)` array of xenolog cluster IDs.
+    :ivar xenolog_indptr, xenolog_forms: CSR-style membership of forms in xenolog clusters.
+    :ivar slice_indptr: `(languages * concepts + 1,)` array, such that the forms for language \
+    `l` and concept `c` are `slice_indptr[l * concepts + c]:slice_indptr[l * concepts + c + 1]`.
+    """
+    arrays = [
+        'form_ids', 'form_language', 'form_concept', 'form_segments',
+        'language_ids', 'language_family',
+        'concept_ids', 'concept_glosses',
+        'cogset_ids', 'cogset_indptr', 'cogset_forms',
+        'xenolog_ids', 'xenolog_indptr', 'xenolog_forms',
+        'slice_indptr',
+    ]
+
+    def __init__(self, digest, **arrays):
+        self.digest = digest
+        for name in self.arrays:
+            setattr(self, name, arrays[name])
+        self.language_index = {lid: i for i, lid in enumerate(self.language_ids)}
+        self.concept_index = {cid: i for i, cid in enumerate(self.concept_ids)}
+        self.xenolog_index = {xid: i for i, xid in enumerate(self.xenolog_ids)}
+
+    @classmethod
+    def from_cldf(cls, cldf, digest=None):
+        """
+        Build the index from a `pycldf.Dataset`.
+        """
+        return cls._build(
+            digest or _digest(cldf),
+            [(r['ID'], r['Family']) for r in cldf.iter_rows('LanguageTable')],
+            [(r['ID'], r['Concepticon_Gloss']) for r in cldf.iter_rows('ParameterTable')],
+            [(f['ID'], f['Language_ID'], f['Parameter_ID'], ' '.join(f['Segments']))
+             for f in cldf['FormTable']],
+            [(r['Form_ID'], r['Cognateset_ID']) for r in cldf['CognateTable']],
+            [(r['Target_Form_ID'], r['Xenolog_Cluster_ID']) for r in cldf['BorrowingTable']])
+
+    @classmethod
+    def from_sqlite(cls, path):
+        """
+        Build the index from the SQLite export of the CLDF data, see `seabor.export`.
+        """
+        with contextlib.closing(sqlite3.connect(str(path))) as db:
+            def rows(sql):
+                return db.execute(sql).fetchall()
+
+            return cls._build(
+                rows("SELECT value FROM meta WHERE key = 'digest'")[0][0],
+                rows('SELECT ID, Family FROM languages'),
+                rows('SELECT ID, Concepticon_Gloss FROM parameters ORDER BY rowid'),
+                rows('SELECT ID, Language_ID, Parameter_ID, Segments FROM forms ORDER BY rowid'),
+                rows('SELECT Form_ID, Cognateset_ID FROM cognates ORDER BY rowid'),
+                rows('SELECT Target_Form_ID, Xenolog_Cluster_ID FROM borrowings ORDER BY rowid'))
+
+    @classmethod
+    def _build(cls, digest, languages, concepts, forms, cognates, borrowings):
+        """
+        :param languages: `list` of pairs `(ID, Family)`.
+        :param concepts: `list` of pairs `(ID, Concepticon_Gloss)`, in the order of \
+        `ParameterTable`.
+        :param forms: `list` of tuples `(ID, Language_ID, Parameter_ID, Segments)`, in the order \
+        of `FormTable`.
+        :param cognates: `list` of pairs `(Form_ID, Cognateset_ID)`.
+        :param borrowings: `list` of pairs `(Target_Form_ID, Xenolog_Cluster_ID)`.
+        """
+        languages = sorted(languages, key=lambda r: r[0])
+        language_index = {r[0]: i for i, r in enumerate(languages)}
+        concept_index = {r[0]: i for i, r in enumerate(concepts)}
+
+        forms = sorted(forms, key=lambda f: (f[1], concept_index[f[2]]))
+        form_index = {f[0]: i for i, f in enumerate(forms)}
+        form_language = np.array([language_index[f[1]] for f in forms], dtype=int)
+        form_concept = np.array([concept_index[f[2]] for f in forms], dtype=int)
+
+        cogset_ids, cogsets = {}, []
+        for fid, cid in cognates:
+            cogsets.append((cogset_ids.setdefault(cid, len(cogset_ids)), form_index[fid]))
+        xenolog_ids, xenologs = {}, []
+        for fid, xid in borrowings:
+            xenologs.append((xenolog_ids.setdefault(xid, len(xenolog_ids)), form_index[fid]))
+
+        cogset_indptr, cogset_forms = _csr(cogsets, len(cogset_ids))
+        xenolog_indptr, xenolog_forms = _csr(xenologs, len(xenolog_ids))
+        slice_indptr = np.zeros(len(languages) * len(concepts) + 1, dtype=int)
+        np.cumsum(
+            np.bincount(
+                form_language * len(concepts) + form_concept,
+                minlength=len(languages) * len(concepts)),
+            out=slice_indptr[1:])
+
+        return cls(
+            digest,
+            form_ids=np.array([f[0] for f in forms], dtype=str),
+            form_language=form_language,
+            form_concept=form_concept,
+            form_segments=np.array([f[3] or '' for f in forms], dtype=str),
+            language_ids=np.array([r[0] for r in languages], dtype=str),
+            language_family=np.array([r[1] or '' for r in languages], dtype=str),
+            concept_ids=np.array([r[0] for r in concepts], dtype=str),
+            concept_glosses=np.array([r[1] for r in concepts], dtype=str),
+            cogset_ids=np.array(list(cogset_ids), dtype=str),
+            cogset_indptr=cogset_indptr,
+            cogset_forms=cogset_forms,
+            xenolog_ids=np.array(list(xenolog_ids), dtype=str),
+            xenolog_indptr=xenolog_indptr,
+            xenolog_forms=xenolog_forms,
+            slice_indptr=slice_indptr,
+        )
+
+    @classmethod
+    def load(cls, cldf, path, export=None):
+        """
+        Load the index persisted at `path`, re-building it if the CLDF data has changed.
+
+        :param export: Path of the SQLite export of the CLDF data (see `seabor.export`). If it is \
+        up-to-date, the index is re-built from the export rather than from the CSV files.
+        """
+        path = pathlib.Path(path)
+        digest = _digest(cldf)
+        if path.exists():
+            with np.load(str(path), allow_pickle=False) as data:
+                if str(data['digest']) == digest:
+                    return cls(digest, **{name: data[name] for name in cls.arrays})
+        if export and sqlite_digest(export) == digest:
+            index = cls.from_sqlite(export)
+        else:
+            index = cls.from_cldf(cldf, digest=digest)
+        index.dump(path)
+        return index
+
+    @classmethod
+    def cached(cls, cldf):
+        """
+        Load the index for a `pycldf.Dataset`, persisted in `.cache/` next to the CLDF directory.
+        """
+        cache = pathlib.Path(str(cldf.directory)).parent / '.cache'
+        return cls.load(cldf, cache / 'cldf-index.npz', export=cache / 'cldf.sqlite3')
+
+    def dump(self, path):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so an interrupted write doesn't leave a broken index.
+        tmp = path.parent / (path.name + '.tmp.npz')
+        np.savez(
+            str(tmp), digest=np.array(self.digest), **{n: getattr(self, n) for n in self.arrays})
+        tmp.replace(path)
+
+    def forms(self, language, concept):
+        """
+        :return: `range` of indices of the forms for a language and concept index.
+        """
+        i = language * len(self.concept_ids) + concept
+        return range(self.slice_indptr[i], self.slice_indptr[i + 1])
+
+    def _clusters(self, ids, indptr, members, prefix):
+        form_cluster = np.full(len(self.form_ids), -1, dtype=int)
+        for i, cid in enumerate(ids):
+            if cid.startswith(prefix):
+                form_cluster[members[indptr[i]:indptr[i + 1]]] = i
+        return form_cluster, np.diff(indptr)
+
+    def cogsets(self, prefix):
+        """
+        Lookup cognate sets of forms, considering only cognate sets with IDs starting with `prefix`.
+
+        Expert and automatically detected cognate sets are distinguished by ID prefix, so `prefix` \
+        is required - e.g. `'auto-full-'`, `'auto-partial-'` or `'expert-'`.
+
+        :return: pair `(form_cogset, sizes)` of arrays, with `form_cogset[i]` the index of the \
+        cognate set of form `i` (or `-1`) and `sizes[j]` the number of forms in cognate set `j`.
+        """
+        return self._clusters(self.cogset_ids, self.cogset_indptr, self.cogset_forms, prefix)
+
+    def xenologs(self, prefix):
+        """
+        Lookup xenolog clusters of forms, like `Index.cogsets` - e.g. with prefix `'auto-'` or \
+        `'expert-'`.
+        """
+        return self._clusters(self.xenolog_ids, self.xenolog_indptr, self.xenolog_forms, prefix)
+
+    def xenolog_members(self, i):
+        """
+        :return: array of indices of the forms in xenolog cluster `i`.
+        """
+        return self.xenolog_forms[self.xenolog_indptr[i]:self.xenolog_indptr[i + 1]]
@@ -0,0 +1,106 @@
+"""
+Permutation tests for statistics of subsets of items - e.g. of the concepts in a concept list.
+
+The null distribution of a statistic of a subset of `size` items is given by the statistic of
+all subsets of the same size. If there are few enough such subsets, they are enumerated, and the
+p-value is exact. Otherwise, random subsets are drawn in batches - as `(batch, size)` matrix of
+item indices - and scored in one go, until the Clopper-Pearson confidence interval of the
+estimated p-value is narrower than `precision` or the maximal number of permutations is reached.
+"""
+import math
+import itertools
+import collections
+
+import numpy as np
+
+__all__ = ['permutation_test', 'clopper_pearson', 'random_subsets', 'masks']
+
+Result = collections.namedtuple('Result', 'pvalue lower upper permutations exact')
+
+# Statistics of a batch of subsets may differ from the statistic of the observed subset in the
+# last digits, depending on how the matrix products are blocked.
+EPSILON = 1e-12
+
+
+def clopper_pearson(hits, n, alpha=0.05):
+    """
+    Compute the (exact) Clopper-Pearson confidence interval for a binomial proportion.
+
+    :return: pair `(lower, upper)`.
+    """
+    from scipy.stats import beta  # scipy.stats takes a while to import.
+
+    lower = beta.ppf(alpha / 2, hits, n - hits + 1) if hits > 0 else 0.0
+    upper = beta.ppf(1 - alpha / 2, hits + 1, n - hits) if hits < n else 1.0
+    return float(lower), float(upper)
+
+
+def random_subsets(rng, nitems, size, n):
+    """
+    Draw random subsets of items, each without replacement.
+
+    :param rng: `numpy.random.Generator` instance.
+    :return: `(n, size)` array of item indices.
+    """
+    # The items with the `size` smallest of `nitems` random keys are a uniformly drawn subset:
+    return np.argpartition(rng.random((n, nitems)), size - 1, axis=1)[:, :size]
+
+
+def masks(indices, nitems):
+    """
+    :param indices: `(n, size)` array of item indices.
+    :return: `(n, nitems)` array of boolean item masks.
+    """
+    res = np.zeros((len(indices), nitems), dtype=bool)
+    np.put_along_axis(res, np.asarray(indices, dtype=int).reshape(len(indices), -1), True, axis=1)
+    return res
+
+
+def permutation_test(
+        statistic,
+        subset,
+        nitems,
+        permutations=10000,
+        precision=0.01,
+        batch=1000,
+        alpha=0.05,
+        seed=None):
+    """
+    Test whether the statistic of a subset of items is higher than expected for random subsets.
+
+    :param statistic: Function mapping a `(n, nitems)` array of boolean item masks to the `(n,)` \
+    array of the statistics of the subsets.
+    :param subset: Indices of the items in the observed subset.
+    :param permutations: Maximal number of random subsets to draw. If there are at most this \
+    many subsets of the same size, all of them are enumerated.
+    :param precision: Random subsets are drawn until the confidence interval of the p-value is \
+    at most this wide.
+    :param batch: Number of subsets scored at once.
+    :param alpha: Significance level, i.e. confidence intervals have coverage `1 - alpha`.
+    :param seed: Random seed (or `numpy.random.SeedSequence`).
+    :return: pair `(Result, observed statistic)`, with the p-value - i.e. the proportion of \
+    subsets with a statistic at least as high as observed - and its confidence bounds.
+    """
+    subset = sorted(set(subset))
+    observed = float(statistic(masks([subset], nitems))[0])
+    size, hits, n = len(subset), 0, 0
+
+    if math.comb(nitems, size) <= permutations:
+        combinations = itertools.combinations(range(nitems), size)
+        while True:
+            indices = list(itertools.islice(combinations, batch))
+            if not indices:
+                break
+            hits += int(np.sum(statistic(masks(indices, nitems)) >= observed - EPSILON))
+            n += len(indices)
+        return Result(hits / n, hits / n, hits / n, n, True), observed
+
+    rng = np.random.default_rng(seed)
+    while n < permutations:
+        indices = random_subsets(rng, nitems, size, min(batch, permutations - n))
+        hits += int(np.sum(statistic(masks(indices, nitems)) >= observed - EPSILON))
+        n += len(indices)
+        lower, upper = clopper_pearson(hits, n, alpha=alpha)
+        if upper - lower <= precision:
+            break
+    return Result(hits / n, lower, upper, n, False), observed
@@ -0,0 +1,196 @@
+"""
+Instrumentation of the stages of the analysis.
+
+Code running a stage of the analysis wraps it in `with stage(name): ...`, and reports the
+number of pairwise alignments it computes via `count('alignments', n)`. While a `Profiler` is
+active, this records wall time, CPU time - including the CPU time of worker processes - peak
+memory and counters per stage; otherwise these calls are no-ops. Stages may be nested, and
+repeated stages - e.g. per language family - are aggregated.
+
+Peak memory of this process is measured per stage on Linux, where the high-water mark of the
+resident set size can be reset. Elsewhere - and for worker processes - only the peak since the
+start of the process can be determined, i.e. the numbers are cumulative.
+"""
+import sys
+import json
+import time
+import cProfile
+import pathlib
+import platform
+import resource
+import contextlib
+import collections
+from importlib import metadata
+
+__all__ = ['Profiler', 'stage', 'count']
+
+_PROFILER = None
+
+
+def _cpu():
+    self, children = resource.getrusage(resource.RUSAGE_SELF), \
+        resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self.ru_utime + self.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _max_rss(who=resource.RUSAGE_SELF):
+    """
+    :return: Peak resident set size in MB since the start of this process - or of the largest \
+    finished worker process.
+    """
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KB elsewhere:
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _reset_hwm():
+    """
+    Reset the high-water mark of the resident set size of this process to the current size.
+
+    :return: `True` if the high-water mark could be reset, i.e. on Linux.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as fp:
+            fp.write('5')
+    except OSError:
+        return False
+    return _hwm() is not None
+
+
+def _hwm():
+    """
+    :return: High-water mark of the resident set size of this process in MB or `None`.
+    """
+    try:
+        with open('/proc/self/status', encoding='ascii') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:  # pragma: no cover
+        pass
+    return None
+
+
+def _versions(*dists):
+    res = {'python': platform.python_version()}
+    for dist in dists:
+        try:
+            res[dist] = metadata.version(dist)
+        except metadata.PackageNotFoundError:  # pragma: no cover
+            res[dist] = None
+    return res
+
+
+class Profiler:
+    """
+    Record timings, memory use and counters per stage.
+
+    :param pstats: Directory to write `cProfile` statistics per top-level stage to, or `None`.
+    """
+    def __init__(self, pstats=None):
+        self.pstats = pathlib.Path(pstats) if pstats else None
+        self.stages = collections.OrderedDict()
+        self._active = []
+        # Peak memory of the active stages, measured so far:
+        self._peaks = []
+        self._profiles = collections.OrderedDict()
+        self.per_stage = _reset_hwm()
+
+    def _peak(self):
+        peak = _hwm() if self.per_stage else _max_rss()
+        self._peaks = [max(p, peak) for p in self._peaks]
+
+    def __enter__(self):
+        global _PROFILER
+        _PROFILER = self
+        return self
+
+    def __exit__(self, *args):
+        global _PROFILER
+        _PROFILER = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = collections.OrderedDict([
+                ('parent', self._active[-1] if self._active else None),
+                ('calls', 0),
+                ('wall_time', 0.0),
+                ('cpu_time', 0.0),
+                ('peak_rss_mb', 0.0),
+                ('peak_rss_workers_mb', 0.0),
+                ('counts', collections.Counter()),
+            ])
+        # cProfile can only profile one stage at a time, so we profile top-level stages only:
+        profile = None
+        if self.pstats and not self._active:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+        if self.per_stage:
+            # The peak so far counts for the enclosing stages, before it is reset for this stage:
+            self._peak()
+            _reset_hwm()
+        self._active.append(name)
+        self._peaks.append(0.0)
+        wall, cpu = time.perf_counter(), _cpu()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            self._peak()
+            self._active.pop()
+            s = self.stages[name]
+            s['calls'] += 1
+            s['wall_time'] += time.perf_counter() - wall
+            s['cpu_time'] += _cpu() - cpu
+            s['peak_rss_mb'] = max(s['peak_rss_mb'], self._peaks.pop())
+            s['peak_rss_workers_mb'] = _max_rss(resource.RUSAGE_CHILDREN)
+
+    def count(self, name, n=1):
+        for active in self._active:
+            self.stages[active]['counts'][name] += n
+
+    def report(self):
+        return collections.OrderedDict([
+            ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('versions', _versions('lingpy', 'lingrex', 'pylexibank', 'numpy')),
+            ('peak_rss', 'per stage' if self.per_stage else 'cumulative'),
+            ('stages', [
+                collections.OrderedDict([('name', name)] + [
+                    (k, dict(v) if k == 'counts' else v) for k, v in s.items()])
+                for name, s in self.stages.items()]),
+        ])
+
+    def dump(self, path):
+        """
+        Write the report as JSON file to `path` - and `cProfile` statistics per stage to the
+        `pstats` directory.
+        """
+        with pathlib.Path(path).open('w', encoding='utf8') as fp:
+            json.dump(self.report(), fp, indent=2)
+        if self.pstats:
+            self.pstats.mkdir(parents=True, exist_ok=True)
+            for name, profile in self._profiles.items():
+                profile.dump_stats(str(self.pstats / '{0}.pstats'.format(name)))
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Mark a stage of the analysis, to be recorded by the active `Profiler` (if any).
+    """
+    if _PROFILER is None:
+        yield
+    else:
+        with _PROFILER.stage(name):
+            yield
+
+
+def count(name, n=1):
+    """
+    Increment a counter - e.g. the number of alignments computed - for all active stages.
+    """
+    if _PROFILER is not None:
+        _PROFILER.count(name, n)
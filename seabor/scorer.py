@@ -0,0 +1,448 @@
+"""
+Parallel, checkpointed computation of LexStat scorers for partial cognate detection.
+
+`lingpy.compare.partial.Partial.get_partial_scorer` computes attested and random sound
+correspondence distributions for each pair of doculects - one after the other, drawing the
+random samples from the global random state. Here, these pairs are distributed across a process
+pool. The main process still advances the global random state for each pair, in the same order
+as lingpy, and passes the state to the worker drawing the sample. So the scorer - and the partial
+cognates of `internal_cognates` - are the same as computed by `lingrex.borrowing.internal_cognates`
+after seeding the random module, no matter how many workers are used.
+"""
+import json
+import random
+import hashlib
+import pathlib
+import collections
+import multiprocessing
+
+from lingpy import util
+from lingpy.settings import rcParams
+from lingpy.compare.partial import Partial as BasePartial
+
+from seabor.cache import wordlist_digest
+from seabor.profiling import stage, count
+
+try:
+    from lingpy.algorithm.cython import calign
+except ImportError:  # pragma: no cover
+    from lingpy.algorithm.cython import _calign as calign
+
+__all__ = ['Partial', 'internal_cognates']
+
+_BSCORER = None
+
+
+def _init_worker(bscorer):
+    global _BSCORER
+    _BSCORER = bscorer
+
+
+def _corrdist(task):
+    """
+    Compute the attested correspondence distribution for one pair of doculects.
+    """
+    (i, tA), (j, tB), nums, weights, pros, kw = task
+    dist, included = collections.defaultdict(float), None
+    for mode, gop, scale in kw['modes']:
+        corrs, included = calign.corrdist(
+            kw['threshold'],
+            nums,
+            weights,
+            pros,
+            gop,
+            scale,
+            kw['factor'],
+            _BSCORER,
+            mode,
+            kw['restricted_chars'])
+        for (a, b), d in corrs.items():
+            if a == '-':
+                a = util.charstring(i + 1)
+            elif b == '-':
+                b = util.charstring(j + 1)
+            dist[a, b] += d / float(len(kw['modes']))
+    return (tA, tB), dist, included
+
+
+def _randist(task):
+    """
+    Compute the random correspondence distribution for one pair of doculects.
+    """
+    (i, tA), (j, tB), nums, weights, pros, included, state, kw = task
+    sample = [(x, y) for x in range(len(nums)) for y in range(len(nums))]
+    if len(sample) > kw['runs']:
+        rng = random.Random()
+        rng.setstate(state)
+        sample = rng.sample(sample, kw['runs'])
+
+    dist = collections.defaultdict(float)
+    for mode, gop, scale in kw['modes']:
+        corrs, included_ = calign.corrdist(
+            10.0,
+            [(nums[s[0]][0], nums[s[1]][1]) for s in sample],
+            [(weights[s[0]][0], weights[s[1]][1]) for s in sample],
+            [(pros[s[0]][0], pros[s[1]][1]) for s in sample],
+            gop,
+            scale,
+            kw['factor'],
+            _BSCORER,
+            mode,
+            kw['restricted_chars'])
+        for a, b in list(corrs.keys()):
+            d = corrs[a, b] * included / included_
+            if a == '-':
+                a = util.charstring(i + 1)
+            elif b == '-':
+                b = util.charstring(j + 1)
+            dist[a, b] += d / len(kw['modes'])
+    return (tA, tB), dist, None
+
+
+def _alignments(task):
+    """
+    Compute the number of pairwise alignments computed for a `_corrdist` or `_randist` task.
+    """
+    nums, kw = task[2], task[-1]
+    n = min(len(nums) ** 2, kw['runs']) if 'runs' in kw else len(nums)
+    return n * len(kw['modes'])
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines file recording the distributions computed for pairs of doculects.
+
+    A truncated last line - e.g. from an interrupted run - is ignored upon reading.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        if self.path and self.path.exists():
+            with self.path.open(encoding='utf8') as fp:
+                for line in fp:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    self.data[item['kind'], tuple(item['pair'])] = (
+                        collections.defaultdict(
+                            float, {(a, b): v for a, b, v in item['dist']}),
+                        item['included'])
+
+    def get(self, kind, pair):
+        return self.data.get((kind, pair))
+
+    def add(self, kind, pair, dist, included):
+        self.data[kind, pair] = (dist, included)
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open('a', encoding='utf8') as fp:
+                fp.write(json.dumps(dict(
+                    kind=kind,
+                    pair=list(pair),
+                    dist=[[a, b, v] for (a, b), v in dist.items()],
+                    included=included)) + '\n')
+
+    def remove(self):
+        if self.path and self.path.exists():
+            self.path.unlink()
+
+
+def _state_digest():
+    """
+    :return: Checksum of the state of the global random number generator.
+    """
+    return hashlib.md5(json.dumps(random.getstate()).encode('utf8')).hexdigest()
+
+
+class Partial(BasePartial):
+    """
+    A `Partial` object computing the scorer in parallel across pairs of doculects.
+
+    :param workers: Number of worker processes.
+    :param checkpoint: Directory to store checkpoint files in, or `None`.
+    :param distances: `seabor.distances.DistanceStore` to look up the distance matrices for \
+    clustering in, or `None`.
+    """
+    def __init__(self, infile, workers=1, checkpoint=None, distances=None, **keywords):
+        BasePartial.__init__(self, infile, **keywords)
+        self.workers = workers
+        self.checkpoint_dir = pathlib.Path(checkpoint) if checkpoint else None
+        self._checkpoint = None
+        if distances:
+            distances.wrap(self)
+
+    def _morpheme_pairs(self, tA, tB):
+        nums, weights, pros = [], [], []
+        for idxA, idxB in self.pairs[tA, tB]:
+            for iA, iB in self._slices[idxA]:
+                for jA, jB in self._slices[idxB]:
+                    nums.append((
+                        self[idxA, self._numbers][iA:iB], self[idxB, self._numbers][jA:jB]))
+                    weights.append((
+                        self[idxA, self._weights][iA:iB], self[idxB, self._weights][jA:jB]))
+                    pros.append((
+                        self[idxA, self._prostrings][iA:iB], self[idxB, self._prostrings][jA:jB]))
+        return nums, weights, pros
+
+    def _map(self, kind, func, tasks):
+        """
+        Compute the distributions for all pairs not yet recorded in the checkpoint.
+        """
+        res = {}
+        todo = []
+        for task in tasks:
+            pair = (task[0][1], task[1][1])
+            done = self._checkpoint.get(kind, pair)
+            if done:
+                res[pair] = done
+            else:
+                todo.append(task)
+
+        with util.pb(desc='{0} CORRESPONDENCE CALCULATION'.format(kind.upper()), total=len(todo)) \
+                as progress:
+            if self.workers > 1 and len(todo) > 1:
+                with multiprocessing.Pool(
+                        self.workers, initializer=_init_worker, initargs=(self.bscorer,)) as pool:
+                    sizes = {(task[0][1], task[1][1]): _alignments(task) for task in todo}
+                    for pair, dist, included in pool.imap_unordered(func, todo):
+                        progress.update(1)
+                        count('alignments', sizes[pair])
+                        self._checkpoint.add(kind, pair, dist, included)
+                        res[pair] = (dist, included)
+            else:
+                _init_worker(self.bscorer)
+                for task in todo:
+                    pair, dist, included = func(task)
+                    progress.update(1)
+                    count('alignments', _alignments(task))
+                    self._checkpoint.add(kind, pair, dist, included)
+                    res[pair] = (dist, included)
+        return res
+
+    def _checkpoint_path(self, **kw):
+        if not self.checkpoint_dir:
+            return None
+        md5 = hashlib.md5()
+        # The random samples depend on the random state when computing the scorer starts:
+        md5.update(json.dumps(
+            [_state_digest(), sorted((k, repr(v)) for k, v in kw.items())]).encode('utf8'))
+        for idx in sorted(self):
+            md5.update(json.dumps(
+                [self[idx, self._col_name], self[idx, self._segments]]).encode('utf8'))
+        return self.checkpoint_dir / '{0}.jsonl'.format(md5.hexdigest())
+
+    def _get_partial_corrdist(self, **keywords):
+        kw = dict(
+            factor=rcParams['align_factor'],
+            modes=rcParams['lexstat_modes'],
+            preprocessing=False,
+            restricted_chars=rcParams['restricted_chars'],
+            threshold=rcParams['lexstat_scoring_threshold'],
+            subset=False)
+        kw.update(keywords)
+        if kw['preprocessing'] or kw['subset']:  # pragma: no cover
+            return BasePartial._get_partial_corrdist(self, **keywords)
+
+        self._checkpoint = Checkpoint(self._checkpoint_path(**keywords))
+        tasks = []
+        for (i, tA), (j, tB) in util.multicombinations2(enumerate(self.cols)):
+            tasks.append(((i, tA), (j, tB)) + tuple(self._morpheme_pairs(tA, tB)) + (kw,))
+        res = self._map('attested', _corrdist, tasks)
+
+        self._included, corrdist = {}, {}
+        for (_, tA), (_, tB) in util.multicombinations2(enumerate(self.cols)):
+            corrdist[tA, tB], self._included[tA, tB] = res[tA, tB]
+        return corrdist
+
+    def _get_partial_randist(self, **keywords):
+        kw = dict(
+            modes=rcParams['lexstat_modes'],
+            factor=rcParams['align_factor'],
+            restricted_chars=rcParams['restricted_chars'],
+            runs=rcParams['lexstat_runs'],
+            method=rcParams['lexstat_scoring_method'])
+        kw.update(keywords)
+        if kw['method'] in ['markov', 'markov-chain', 'mc']:  # pragma: no cover
+            return BasePartial._get_partial_randist(self, **keywords)
+
+        tasks = []
+        for (i, tA), (j, tB) in util.multicombinations2(enumerate(self.cols)):
+            nums, weights, pros = self._morpheme_pairs(tA, tB)
+            state = random.getstate()
+            if len(nums) ** 2 > kw['runs']:
+                # Advance the random state just like drawing the sample in `_randist` does:
+                random.sample(range(len(nums) ** 2), kw['runs'])
+            tasks.append(
+                ((i, tA), (j, tB), nums, weights, pros, self._included[tA, tB], state, kw))
+        res = self._map('random', _randist, tasks)
+        # All pairs are computed, so we don't need the checkpoint anymore.
+        self._checkpoint.remove()
+
+        return {
+            (tA, tB): res[tA, tB][0]
+            for (_, tA), (_, tB) in util.multicombinations2(enumerate(self.cols))}
+
+
+def internal_cognates(
+    wordlist,
+    family="family",
+    runs=10000,
+    threshold=0.50,
+    smooth=1,
+    ratio=(2, 1),
+    vscale=0.5,
+    restricted_chars="_",
+    modes=(("global", -1, 0.5), ("overlap", -1, 0.5)),
+    ref="autocogids",
+    cluster_method="upgma",
+    model="sca",
+    workers=1,
+    seed=1234,
+    checkpoint=None,
+    cache=None,
+    distances=None,
+    columns=None,
+    log=None,
+):
+    """
+    Cluster the data into partial cognate sets, but only inside each family.
+
+    This is a re-implementation of `lingrex.borrowing.internal_cognates` for
+    `partial=True, method="lexstat"`, computing the scorer with `Partial`.
+
+    The random module is seeded with `seed`, and families are analysed in the same order - drawing
+    the same random numbers - as in `lingrex.borrowing.internal_cognates`. Results can be cached
+    per family, passing a `seabor.cache.Cache` as `cache`: Since the results of a family depend on
+    the random state when its analysis starts, they are cached together with the random state
+    after the analysis. Then, only families for which the data - or the random state - has changed
+    are re-analysed.
+
+    Distance matrices for clustering are looked up in - and added to - the
+    `seabor.distances.DistanceStore` passed as `distances`.
+
+    :param columns: Columns of `wordlist` the analysis depends on (default: all columns).
+    """
+    families = sorted({wordlist[k, family] for k in wordlist})
+    params = dict(
+        runs=runs, threshold=threshold, smooth=smooth, ratio=ratio, vscale=vscale,
+        restricted_chars=restricted_chars, modes=modes, ref=ref, cluster_method=cluster_method,
+        model=model, seed=seed)
+
+    random.seed(seed)
+    results = []
+    for fam in families:
+        idxs = [idx for idx, f in wordlist.iter_rows(family) if f == fam]
+        key = cache.key(
+            wordlist_digest(wordlist, columns=columns, idxs=idxs), 'internal_cognates',
+            state=_state_digest(), **params) if cache else None
+        res = cache.get(key) if cache else None
+        if res is None:
+            res = _internal_cognates(
+                wordlist, idxs, workers, checkpoint, distances=distances, **params)
+            res['state'] = random.getstate()
+            if cache:
+                cache.set(key, res)
+        else:
+            version, internal, gauss = res['state']
+            random.setstate((version, tuple(internal), gauss))
+            if log:
+                log.info('re-using partial cognates for unchanged family {0}'.format(fam))
+        results.append(res)
+
+    wordlist.add_entries(ref, _combine(wordlist, results, family), lambda x: x)
+
+
+def _combine(wordlist, results, family):
+    """
+    Number the partial cognate sets of all families consecutively.
+
+    :param results: `list` of results of `_cluster`, one per family.
+    :return: `dict` mapping row IDs to lists of partial cognate IDs.
+    """
+    gcogid = 0
+    G = {}
+    for res in results:
+        for idx, cogids in res['cogids']:
+            G[idx] = [0 if cogid is None else cogid + gcogid for cogid in cogids]
+        gcogid += res['max_cogid'] + 1
+
+    renumber = {}
+    cogid = 1
+    for idx, vals in G.items():
+        f = wordlist[idx, family]
+        new_cogids = []
+        for v in vals:
+            if (f, v) not in renumber:
+                renumber[f, v] = cogid
+                cogid += 1
+            new_cogids.append(renumber[f, v])
+        G[idx] = new_cogids
+    return G
+
+
+def _internal_cognates(wordlist, idxs, workers, checkpoint, distances=None, **kw):
+    """
+    Cluster the data of one family into partial cognate sets.
+
+    :return: `dict` with partial cognate IDs per row - as list of pairs `(idx, cogids)` - and the \
+    maximal cognate ID.
+    """
+    return _cluster(
+        _scored_partial(wordlist, idxs, workers, checkpoint, distances=distances, **kw), **kw)
+
+
+def _scored_partial(wordlist, idxs, workers, checkpoint, distances=None, **kw):
+    """
+    Compute the LexStat scorer for the data of one family, drawing the random samples from the
+    global random state.
+
+    :return: `Partial` instance.
+    """
+    data = {idx: [cell for cell in wordlist[idx]] for idx in idxs}
+    data[0] = [h for h in wordlist.columns]
+    lex = Partial(
+        data,
+        model=kw['model'],
+        workers=workers,
+        checkpoint=checkpoint,
+        distances=distances)
+    with stage('scorer'):
+        lex.get_partial_scorer(
+            runs=kw['runs'],
+            smooth=kw['smooth'],
+            ratio=kw['ratio'],
+            vscale=kw['vscale'],
+            restricted_chars=kw['restricted_chars'],
+            modes=list(kw['modes']),
+        )
+    return lex
+
+
+def _cluster(lex, partial_cluster=None, **kw):
+    """
+    Cluster the data of one family into partial cognate sets, with the scorer computed by
+    `_scored_partial`.
+
+    :param partial_cluster: Function to use instead of `lex.partial_cluster` - e.g. \
+    `seabor.sweep.ThresholdSweep.partial_cluster`.
+    """
+    # Note that clustering with infomap draws random numbers from the global random state.
+    with stage('partial_cluster'):
+        (partial_cluster or lex.partial_cluster)(
+            ref=kw['ref'],
+            method="lexstat",
+            cluster_method=kw['cluster_method'],
+            threshold=kw['threshold'],
+        )
+
+    # prepare global cognate indicies
+    C = {idx: len(lex[idx, kw['ref']]) * [None] for idx in lex}
+    etd = lex.get_etymdict(ref=kw['ref'])
+    for cogid, idxs_ in etd.items():
+        for idx_ in idxs_:
+            if idx_:
+                for idx in idx_:
+                    cogids = lex[idx, kw['ref']]
+                    C[idx][cogids.index(cogid)] = cogid
+    return dict(cogids=[(idx, C[idx]) for idx in lex], max_cogid=max(etd))
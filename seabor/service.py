@@ -0,0 +1,230 @@
+"""
+A local HTTP service answering queries about the CLDF data from memory.
+
+The service loads the `seabor.index.Index` of the CLDF data - and derived lookups such as the
+`seabor.admixture.Admixture` classification - once, and answers requests in milliseconds. Requests
+are handled in threads, so clients can query concurrently. The CLDF files are checked for changes
+at most every `interval` seconds, and when they have changed - e.g. after re-running `makecldf` -
+the data is re-loaded in a background thread; requests are answered from the previous data until
+the new data is ready.
+
+All responses are JSON objects:
+
+- `GET /forms/<form ID>`: The form, its language and concept, and the xenolog clusters it is part
+  of, with the families they span.
+- `GET /xenologs/<cluster ID>`: The forms in a xenolog cluster and the families they span.
+- `GET /admixture/<language ID>[?conceptlist=<Concepticon concept list ID>]`: The proportions of
+  unique, family-internal and borrowed forms of a language - for all concepts or those of a
+  concept list.
+- `GET /status`: The checksum of the loaded data and the time it was loaded.
+"""
+import json
+import time
+import pathlib
+import threading
+import http.server
+import urllib.parse
+
+import numpy as np
+from pycldf import Dataset
+
+from seabor.index import Index
+from seabor.admixture import Admixture
+from seabor.conceptlists import concepticon_glosses, is_conceptlist_id
+
+__all__ = ['Service', 'serve']
+
+
+class NotFound(ValueError):
+    pass
+
+
+def _signature(metadata):
+    """
+    :return: Modification times and sizes of the CLDF metadata and the files it references, to \
+    detect changes cheaply.
+    """
+    metadata = pathlib.Path(metadata)
+    paths = [metadata]
+    try:
+        with metadata.open(encoding='utf8') as fp:
+            paths += [metadata.parent / t['url'] for t in json.load(fp).get('tables', [])]
+    except (OSError, ValueError):  # The metadata is being re-written.
+        pass
+    return tuple(
+        (p.name, p.stat().st_mtime_ns, p.stat().st_size) if p.exists() else (p.name,)
+        for p in paths)
+
+
+class Data:
+    """
+    The lookups for one version of the CLDF data.
+    """
+    def __init__(self, metadata, concepticon=None):
+        self.concepticon = concepticon
+        self.signature = _signature(metadata)
+        self.cldf = Dataset.from_metadata(metadata)
+        self.index = Index.cached(self.cldf)
+        self.admixture = Admixture(self.index)
+        self.loaded = time.time()
+        self.form_index = {fid: i for i, fid in enumerate(self.index.form_ids)}
+        self.form_xenologs = [[] for _ in self.index.form_ids]
+        for i in range(len(self.index.xenolog_ids)):
+            for form in self.index.xenolog_members(i):
+                self.form_xenologs[form].append(i)
+        self.glosses = {str(g): i for i, g in enumerate(self.index.concept_glosses)}
+        self._conceptlists = {}
+
+    def form(self, i):
+        index = self.index
+        return dict(
+            id=str(index.form_ids[i]),
+            language=str(index.language_ids[index.form_language[i]]),
+            family=str(index.language_family[index.form_language[i]]),
+            concept=str(index.concept_ids[index.form_concept[i]]),
+            segments=str(index.form_segments[i]))
+
+    def xenolog(self, i):
+        members = self.index.xenolog_members(i)
+        return dict(
+            id=str(self.index.xenolog_ids[i]),
+            families=sorted(set(
+                str(f) for f in self.index.language_family[self.index.form_language[members]])),
+            forms=[str(self.index.form_ids[m]) for m in members])
+
+    def concepts(self, conceptlist):
+        """
+        :return: `(concepts,)` boolean array, selecting the concepts of a concept list.
+        """
+        if conceptlist not in self._conceptlists:
+            cache = pathlib.Path(str(self.cldf.directory)).parent / '.cache' / 'conceptlists'
+            mask = np.zeros(len(self.index.concept_ids), dtype=bool)
+            glosses = concepticon_glosses(conceptlist, cache, catalog=self.concepticon)
+            mask[[self.glosses[g] for g in glosses if g in self.glosses]] = True
+            self._conceptlists[conceptlist] = mask
+        return self._conceptlists[conceptlist]
+
+
+class Service:
+    """
+    Answers queries about the CLDF data described by the metadata file `metadata`.
+    """
+    def __init__(self, metadata, interval=1.0, concepticon=None, log=None):
+        """
+        :param interval: Minimal number of seconds between checks for changes of the CLDF data.
+        :param concepticon: Path to a clone of the Concepticon data to look up concept lists in.
+        :param log: Logger to report failures to re-load the CLDF data to.
+        """
+        self.metadata = pathlib.Path(metadata)
+        self.interval = interval
+        self.concepticon = concepticon
+        self.log = log
+        self._data = Data(self.metadata, self.concepticon)
+        self._checked = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def data(self):
+        """
+        The current `Data`, re-loaded if the CLDF data has changed.
+        """
+        if time.time() - self._checked >= self.interval and self._lock.acquire(blocking=False):
+            # Only one thread checks for changes at a time, and the data is re-loaded in a
+            # separate thread - releasing the lock when done - so no request has to wait for it.
+            self._checked = time.time()
+            if _signature(self.metadata) != self._data.signature:
+                threading.Thread(target=self._reload, daemon=True).start()
+            else:
+                self._lock.release()
+        return self._data
+
+    def _reload(self):
+        try:
+            self._data = Data(self.metadata, self.concepticon)
+        except Exception as e:  # pragma: no cover
+            # E.g. the CLDF data is only partially written. Since the signature of the data has
+            # changed, re-loading is tried again upon the next check.
+            if self.log:
+                self.log.warning('re-loading the CLDF data failed: {0}'.format(e))
+        finally:
+            self._lock.release()
+
+    def status(self):
+        data = self.data
+        return dict(digest=data.index.digest, loaded=data.loaded, forms=len(data.index.form_ids))
+
+    def form(self, form_id):
+        data = self.data
+        if form_id not in data.form_index:
+            raise NotFound('form {0}'.format(form_id))
+        i = data.form_index[form_id]
+        return dict(data.form(i), xenologs=[data.xenolog(x) for x in data.form_xenologs[i]])
+
+    def xenolog(self, xenolog_id):
+        data = self.data
+        if xenolog_id not in data.index.xenolog_index:
+            raise NotFound('xenolog cluster {0}'.format(xenolog_id))
+        return data.xenolog(data.index.xenolog_index[xenolog_id])
+
+    def admixture(self, language_id, conceptlist=None):
+        data = self.data
+        if language_id not in data.index.language_index:
+            raise NotFound('language {0}'.format(language_id))
+        if conceptlist and not is_conceptlist_id(conceptlist):
+            # Concept list IDs are used as file names, so we must not accept arbitrary paths.
+            raise ValueError('invalid concept list ID: {0}'.format(conceptlist))
+        mask = data.concepts(conceptlist) if conceptlist else \
+            np.ones(len(data.index.concept_ids), dtype=bool)
+        props = data.admixture.matrix(mask[np.newaxis, :])[0][
+            data.index.language_index[language_id]]
+        return dict(
+            language=language_id,
+            conceptlist=conceptlist,
+            concepts=int(mask.sum()),
+            proportions={c: float(p) for c, p in zip(data.admixture.categories, props) if p})
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        path = [urllib.parse.unquote(c) for c in url.path.strip('/').split('/')]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            if path == ['status']:
+                res = self.service.status()
+            elif len(path) == 2 and path[0] == 'forms':
+                res = self.service.form(path[1])
+            elif len(path) == 2 and path[0] == 'xenologs':
+                res = self.service.xenolog(path[1])
+            elif len(path) == 2 and path[0] == 'admixture':
+                res = self.service.admixture(path[1], conceptlist=query.get('conceptlist'))
+            else:
+                raise NotFound(url.path)
+            status = 200
+        except NotFound as e:
+            res, status = dict(error='not found: {0}'.format(e)), 404
+        except Exception as e:  # e.g. an unknown concept list
+            res, status = dict(error=str(e)), 400
+        body = json.dumps(res).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pragma: no cover
+        pass
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    """
+    Create a server for a `Service`, handling each request in a thread.
+
+    :return: `http.server.ThreadingHTTPServer` - call `serve_forever` to start serving.
+    """
+    handler = type('Handler', (Handler,), dict(service=service))
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
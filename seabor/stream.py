@@ -0,0 +1,239 @@
+"""
+Streaming access to wordlists in lingpy's TSV format, and on-disk partitions of a wordlist by
+concept.
+
+`lingpy.Wordlist` holds all columns of all rows in memory. Here, rows are read line by line,
+keeping only the columns that are needed, and can be distributed over one file per concept, so
+that analyses which work concept by concept can be run on the rows of one concept at a time.
+"""
+import json
+import hashlib
+import pathlib
+import collections
+
+from lingpy import Wordlist, util, basictypes
+from lingpy.basic.parser import read_conf
+
+__all__ = ['iter_rows', 'read_wordlist', 'Partitions', 'by_concept']
+
+# lingpy's datatypes for the cells of wordlist columns, e.g. lists of tokens or cognate IDs:
+_, DATATYPES, _, _ = read_conf(util.data_path('conf', 'wordlist.rc'))
+# Datatypes of columns computed by the stages of the analysis:
+STAGE_DATATYPES = {'int': int, 'ints': basictypes.ints, 'strings': basictypes.strings, 'str': str}
+
+
+def _cell(value):
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(v) for v in value)
+    return '' if value is None else str(value)
+
+
+def _datatype(values):
+    """
+    Determine the datatype of a column computed by some stage, as key of `STAGE_DATATYPES`.
+    """
+    if all(isinstance(v, int) for v in values):
+        return 'int'
+    if all(isinstance(v, (list, tuple)) for v in values):
+        return 'ints' if all(isinstance(i, int) for v in values for i in v) else 'strings'
+    return 'str'
+
+
+def _convert(datatype, value):
+    try:
+        return datatype(value)
+    except ValueError:  # Just like lingpy, we keep values which cannot be converted.
+        return value
+
+
+def iter_rows(path, columns=None):
+    """
+    Read a wordlist in lingpy's TSV format row by row.
+
+    :param columns: Names of the columns to read (case-insensitive, default: all columns).
+    :return: Generator of `dict`s mapping lower-case column names to the (unconverted) cell \
+    values, with the row ID under key `id`.
+    """
+    header = None
+    with pathlib.Path(path).open(encoding='utf8') as fp:
+        for line in fp:
+            line = line.rstrip('\r\n')
+            # Skip comments, metadata and empty lines:
+            if not line.strip() or line.startswith(('#', '@')):
+                continue
+            cells = line.split('\t')
+            if header is None:
+                header = [c.lower() for c in cells]
+                keep = [
+                    i for i, c in enumerate(header)
+                    if c == 'id' or columns is None or c in {col.lower() for col in columns}]
+                continue
+            yield {header[i]: cells[i] if i < len(cells) else '' for i in keep}
+
+
+def read_wordlist(path, columns=None, datatypes=None):
+    """
+    Read a wordlist, keeping only the specified columns.
+
+    Cell values are converted just like `lingpy.Wordlist` does when reading a file.
+
+    :param datatypes: `dict` mapping column names to datatypes, overriding lingpy's datatypes.
+    :return: `lingpy.Wordlist` instance.
+    """
+    datatypes = dict(DATATYPES, **(datatypes or {}))
+    data = {}
+    for row in iter_rows(path, columns):
+        cols = [c for c in row if c != 'id']
+        data.setdefault(0, cols)
+        data[int(row['id'])] = [_convert(datatypes.get(c, str), row[c]) for c in cols]
+    return Wordlist(data)
+
+
+class Partitions:
+    """
+    A wordlist partitioned by concept, with one TSV file per concept.
+
+    Partitions are built by streaming the input wordlist, buffering at most `buffer` rows in
+    memory. They are stored in a directory named after a checksum of the input file and the
+    selected columns, and re-used as long as neither changes.
+
+    :ivar concepts: `list` of concepts, sorted like `lingpy.Wordlist.rows`.
+    """
+    def __init__(self, path, columns, directory, buffer=10000):
+        """
+        :param path: Path of the input wordlist.
+        :param columns: Columns to keep - must include `doculect` and `concept`.
+        :param directory: Directory to store partitions in.
+        """
+        self.columns = [c.lower() for c in columns]
+        md5 = hashlib.md5(json.dumps(self.columns).encode('utf8'))
+        with pathlib.Path(path).open('rb') as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+                md5.update(chunk)
+        self.directory = pathlib.Path(directory) / md5.hexdigest()
+        index = self.directory / 'index.json'
+        if not index.exists():
+            self._build(path, buffer)
+        with index.open(encoding='utf8') as fp:
+            self._files = json.load(fp)
+        self.concepts = sorted(self._files)
+        # Datatypes of the columns added by stages of the analysis:
+        self._datatypes = {}
+        if self.directory.joinpath('datatypes.json').exists():
+            with self.directory.joinpath('datatypes.json').open(encoding='utf8') as fp:
+                self._datatypes = json.load(fp)
+
+    def _build(self, path, buffer):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._files, rows, buffered = {}, collections.defaultdict(list), 0
+
+        def flush():
+            for concept, lines in rows.items():
+                with self.directory.joinpath(self._files[concept]).open(
+                        'a', encoding='utf8') as fp:
+                    fp.write(''.join(lines))
+            rows.clear()
+
+        for row in iter_rows(path, self.columns):
+            concept = row['concept']
+            if concept not in self._files:
+                self._files[concept] = '{0}.tsv'.format(len(self._files))
+                self._write_header(concept, self.columns)
+            rows[concept].append('\t'.join([row['id']] + [row[c] for c in self.columns]) + '\n')
+            buffered += 1
+            if buffered >= buffer:
+                flush()
+                buffered = 0
+        flush()
+        # The index is written last, marking the partitions as complete:
+        with self.directory.joinpath('index.json').open('w', encoding='utf8') as fp:
+            json.dump(self._files, fp)
+
+    def _write_header(self, concept, columns):
+        with self.directory.joinpath(self._files[concept]).open('w', encoding='utf8') as fp:
+            fp.write('\t'.join(['ID'] + [c.upper() for c in columns]) + '\n')
+
+    def wordlist(self, concept):
+        """
+        :return: `lingpy.Wordlist` with the rows of one concept.
+        """
+        return read_wordlist(
+            self.directory / self._files[concept],
+            datatypes={k: STAGE_DATATYPES[v] for k, v in self._datatypes.items()})
+
+    def __iter__(self):
+        """
+        Iterate over pairs `(concept, wordlist)`, loading one concept at a time.
+        """
+        for concept in self.concepts:
+            yield concept, self.wordlist(concept)
+
+    def __len__(self):
+        return len(self.concepts)
+
+    def update(self, concept, wordlist):
+        """
+        Write the wordlist of a concept - including columns computed by some stage of the
+        analysis - back to its partition, so that subsequent stages can use the new columns.
+        """
+        for col in wordlist.columns:
+            if col not in self.columns and col not in DATATYPES:
+                self._datatypes[col] = _datatype([wordlist[idx, col] for idx in wordlist])
+        with self.directory.joinpath('datatypes.json').open('w', encoding='utf8') as fp:
+            json.dump(self._datatypes, fp)
+        self._write_header(concept, wordlist.columns)
+        with self.directory.joinpath(self._files[concept]).open('a', encoding='utf8') as fp:
+            for idx in wordlist:
+                fp.write('\t'.join(
+                    [str(idx)] + [_cell(wordlist[idx, c]) for c in wordlist.columns]) + '\n')
+
+    def add_columns(self, wordlist, columns):
+        """
+        Copy columns of the partitioned wordlist - e.g. computed by a stage of the analysis which
+        doesn't work concept by concept - to the partitions, loading one concept at a time.
+        """
+        for concept in self.concepts:
+            wl = self.wordlist(concept)
+            for col in columns:
+                wl.add_entries(
+                    col, {idx: wordlist[idx, col] for idx in wl}, lambda x: x, override=True)
+            self.update(concept, wl)
+
+    def values(self, columns):
+        """
+        Read columns from the partitions, loading one concept at a time.
+
+        :return: `dict` mapping column names to `dict`s mapping row IDs to cell values.
+        """
+        res = {col: {} for col in columns}
+        for concept in self.concepts:
+            wl = self.wordlist(concept)
+            for col in columns:
+                res[col].update((idx, wl[idx, col]) for idx in wl)
+        return res
+
+
+def by_concept(partitions, stage, ref, size=None, **kw):
+    """
+    Run a stage of the analysis which works concept by concept - e.g.
+    `lingrex.cognates.common_morpheme_cognates` or `seabor.borrowing.external_cognates` - on one
+    partition at a time.
+
+    Such stages number clusters consecutively across concepts, with `0` for words not in any
+    cluster. This numbering is reconstructed here, so the results are identical to running the
+    stage on the whole wordlist. Results are written back to the partitions.
+
+    :param ref: Name of the column with cluster IDs computed by the stage.
+    :param size: Function computing the number of cluster IDs a stage uses up for a concept from \
+    the wordlist of the concept before running the stage (default: the maximal cluster ID \
+    assigned for the concept).
+    """
+    offset = 0
+    for concept, wl in partitions:
+        n = size(wl) if size else None
+        stage(wl, ref=ref, **kw)
+        local = [wl[idx, ref] for idx in wl]
+        for idx, cid in zip(wl, local):
+            wl[idx, ref] = offset + cid if cid else 0
+        offset += max(local, default=0) if n is None else n
+        partitions.update(concept, wl)
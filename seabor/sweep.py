@@ -0,0 +1,129 @@
+"""
+Cluster a wordlist into cognate sets for many thresholds, computing distance matrices only once.
+
+`LexStat.cluster` and `Partial.partial_cluster` compute the pairwise distance matrices for all
+concepts before clustering - which is by far the most expensive part. Since these matrices do not
+depend on the threshold, `ThresholdSweep` computes them once and reuses them for all thresholds.
+For hierarchical cluster methods, the partitions for all thresholds are derived by cutting a
+single dendrogram per concept.
+"""
+import itertools
+
+import numpy as np
+
+from seabor.distances import _params
+
+__all__ = ['ThresholdSweep', 'merges']
+
+LINKAGE_METHODS = {
+    'upgma': lambda scores: sum(scores) / len(scores),
+    'single': min,
+    'complete': max,
+}
+
+
+def merges(method, matrix):
+    """
+    Compute the complete sequence of merges of flat linkage clustering.
+
+    This follows `lingpy.algorithm.clustering.flat_cluster` - including the order of iteration,
+    thus the tie-breaking - but doesn't stop at a threshold. Since `flat_cluster` merges clusters
+    until the minimal linkage score exceeds the threshold, its result for any threshold is
+    obtained by applying a prefix of this sequence.
+
+    :return: `list` of triples `(score, idxA, idxB)`, meaning cluster `idxB` is merged into `idxA`.
+    """
+    link = LINKAGE_METHODS[method]
+    clusters = {i: [i] for i in range(len(matrix))}
+
+    def score(i, j):
+        return link([matrix[vA][vB] for vA in clusters[i] for vB in clusters[j]])
+
+    # Linkage scores for ordered pairs of clusters. `argmin` returns the first minimum in
+    # row-major order, i.e. in the same order in which `flat_cluster` iterates over pairs.
+    scores = np.full((len(matrix), len(matrix)), np.inf)
+    for i, j in itertools.permutations(clusters, 2):
+        scores[i, j] = score(i, j)
+
+    res = []
+    while len(clusters) > 1:
+        idxA, idxB = np.unravel_index(np.argmin(scores), scores.shape)
+        idxA, idxB = int(idxA), int(idxB)
+        res.append((float(scores[idxA, idxB]), idxA, idxB))
+        clusters[idxA] += clusters[idxB]
+        del clusters[idxB]
+        scores[idxB, :] = scores[:, idxB] = np.inf
+        for j in clusters:
+            if j != idxA:
+                scores[idxA, j], scores[j, idxA] = score(idxA, j), score(j, idxA)
+    return res
+
+
+class ThresholdSweep:
+    """
+    Wraps a `LexStat` or `Partial` object, to cluster it for many thresholds.
+
+    .. code-block:: python
+
+        sweep = ThresholdSweep(lex, cluster_method='infomap')
+        for i, t in enumerate(thresholds):
+            sweep.cluster(method='sca', threshold=t, ref='cogid_{}'.format(i))
+    """
+    def __init__(self, lex, cluster_method='upgma', distances=None):
+        """
+        :param distances: `seabor.distances.DistanceStore` to look up the distance matrices in - \
+        so they are computed only once across runs, too - or `None`.
+        """
+        self.lex = lex
+        self.cluster_method = cluster_method
+        self._linkages = {}
+        self._matrices = {}
+        if distances:
+            distances.wrap(lex)
+        # We replace the matrix computation of the wrapped object with a memoized version:
+        for name in ['_get_matrices', '_get_partial_matrices']:
+            if hasattr(lex, name):
+                setattr(lex, name, self._memoized(name, getattr(lex, name)))
+
+    def _memoized(self, name, func):
+        def wrapper(**kw):
+            key = (name, repr(sorted(_params(kw).items())))
+            if key not in self._matrices:
+                self._matrices[key] = list(func(**kw))
+            return self._matrices[key]
+        return wrapper
+
+    def flat_cut(self, threshold, matrix):
+        """
+        Cut the dendrogram computed for `matrix` at `threshold`.
+
+        :return: `dict` mapping indices of the matrix to cluster IDs.
+        """
+        key = id(matrix)
+        if key not in self._linkages:
+            # We keep a reference to the matrix, to make sure its id isn't re-used.
+            self._linkages[key] = (matrix, merges(self.cluster_method, matrix))
+        clusters = {i: [i] for i in range(len(matrix))}
+        for score, idxA, idxB in self._linkages[key][1]:
+            if score > threshold:
+                break
+            clusters[idxA] += clusters[idxB]
+            del clusters[idxB]
+        return {i: cid + 1 for cid, members in clusters.items() for i in members}
+
+    def cluster(self, **kw):
+        """
+        Run `LexStat.cluster` with the memoized distance matrices.
+        """
+        if self.cluster_method in LINKAGE_METHODS:
+            kw['external_function'] = lambda matrix, threshold: self.flat_cut(threshold, matrix)
+        return self.lex.cluster(**dict(kw, cluster_method=self.cluster_method))
+
+    def partial_cluster(self, **kw):
+        """
+        Run `Partial.partial_cluster` with the memoized distance matrices.
+        """
+        if self.cluster_method in LINKAGE_METHODS:
+            kw['external_function'] = \
+                lambda threshold, matrix, **_: self.flat_cut(threshold, matrix)
+        return self.lex.partial_cluster(**dict(kw, cluster_method=self.cluster_method))
@@ -0,0 +1,195 @@
+"""
+Optimisation of the thresholds for partial cognate detection and cross-family cognate detection.
+
+The thresholds `(t1, t2)` used by `lexibank_seabor.Dataset.detect` are evaluated against the
+expert cognate and borrowing judgements. Evaluating a pair of thresholds does not require re-running
+the analysis:
+
+- The LexStat scorer of each family does not depend on `t1`, so it is computed once, and partial
+  cognates are re-clustered for each `t1` from memoized distance matrices (see
+  `seabor.sweep.ThresholdSweep` and `seabor.distances`). Note that `internal_cognates` draws the
+  random samples for the scorers and the random numbers used by infomap clustering from one
+  random state. So with infomap, the scorers - computed here for all families before clustering -
+  differ slightly from those of a complete run of `lexibank_seabor.Dataset.detect`.
+- Cross-family cognate detection only aligns words once, the distances for other cognate sets and
+  thresholds `t2` are looked up in the `seabor.distances.DistanceStore`.
+- Scores are computed per concept (see `seabor.evaluate.Evaluation`), so scores for any subset of
+  concepts - e.g. the folds of a cross-validation - are aggregated from the same counts.
+
+The threshold space is searched coarse-to-fine: a grid is evaluated, and then refined around the
+best pair of thresholds with half the step size, for a number of levels.
+"""
+import random
+import itertools
+import collections
+
+import numpy as np
+import lingrex.cognates
+
+from seabor.scorer import _scored_partial, _cluster, _combine
+from seabor.borrowing import external_cognates, own_clusters
+from seabor.sweep import ThresholdSweep
+from seabor.evaluate import Evaluation
+
+__all__ = ['ThresholdEvaluation', 'search', 'folds', 'OBJECTIVES']
+
+OBJECTIVES = {
+    'cognates': lambda f1, f2: f1,
+    'borrowings': lambda f1, f2: f2,
+    'mean': lambda f1, f2: (f1 + f2) / 2,
+}
+
+
+class ThresholdEvaluation:
+    """
+    Evaluate cognate and borrowing detection for pairs of thresholds `(t1, t2)`.
+
+    .. code-block:: python
+
+        ev = ThresholdEvaluation(wl, distances=DistanceStore(path))
+        f1, f2 = ev.fscores(0.5, 0.35)
+    """
+    def __init__(
+            self,
+            wordlist,
+            seed=1234,
+            runs=10000,
+            workers=1,
+            checkpoint=None,
+            distances=None,
+            cluster_method='infomap',
+            family='family'):
+        """
+        :param wordlist: Raw wordlist, with expert judgements in columns `ucogid` and `uborid`.
+        :param distances: `seabor.distances.DistanceStore` to look up distance matrices in.
+        """
+        self.wordlist, self.family, self.distances = wordlist, family, distances
+        self.workers = workers
+        self.params = dict(
+            runs=runs, smooth=1, ratio=(2, 1), vscale=0.5, restricted_chars="_",
+            modes=(("global", -1, 0.5), ("overlap", -1, 0.5)), cluster_method=cluster_method,
+            model="sca", seed=seed)
+        self.sweeps = {}
+        random.seed(seed)
+        for fam in sorted({wordlist[k, family] for k in wordlist}):
+            idxs = [idx for idx, f in wordlist.iter_rows(family) if f == fam]
+            self.sweeps[fam] = ThresholdSweep(
+                _scored_partial(
+                    wordlist, idxs, workers, checkpoint, distances=distances, **self.params),
+                cluster_method=cluster_method)
+        # Each threshold is clustered starting from the same random state, so the results don't
+        # depend on the order in which thresholds are evaluated:
+        self._state = random.getstate()
+        # Non-borrowed words are represented in clusters of their own, as in `cmd_makecldf`:
+        idxs = list(wordlist)
+        wordlist.add_entries(
+            '_userborid',
+            dict(zip(idxs, own_clusters([wordlist[idx, 'uborid'] for idx in idxs]))),
+            lambda x: x)
+        # The concepts, in the order of the groups of the evaluations:
+        self.concepts = list(collections.OrderedDict.fromkeys(
+            wordlist[idx, 'concept'] for idx in idxs))
+        self._cognates, self._evaluations = {}, {}
+
+    def cognates(self, t1):
+        """
+        :return: Name of the column with the (full) cognate sets for threshold `t1`.
+        """
+        t1 = round(t1, 4)
+        if t1 not in self._cognates:
+            i = len(self._cognates)
+            random.setstate(self._state)
+            results = [
+                _cluster(
+                    sweep.lex,
+                    partial_cluster=sweep.partial_cluster,
+                    ref='_autocogids_{0}'.format(i),
+                    threshold=t1,
+                    **self.params)
+                for sweep in self.sweeps.values()]
+            self.wordlist.add_entries(
+                '_autocogids_{0}'.format(i),
+                _combine(self.wordlist, results, self.family),
+                lambda x: x)
+            lingrex.cognates.common_morpheme_cognates(
+                self.wordlist,
+                ref='_autocogid_{0}'.format(i),
+                cognates='_autocogids_{0}'.format(i),
+                morphemes='_automorphemes_{0}'.format(i))
+            self._cognates[t1] = '_autocogid_{0}'.format(i)
+        return self._cognates[t1]
+
+    def evaluate(self, t1, t2):
+        """
+        :return: pair of `seabor.evaluate.Evaluation` instances, for cognate and borrowing \
+        detection, grouped by concept.
+        """
+        key = (round(t1, 4), round(t2, 4))
+        if key not in self._evaluations:
+            cognates = self.cognates(t1)
+            ref = '_autoborid_{0}'.format(len(self._evaluations))
+            external_cognates(
+                self.wordlist,
+                cognates=cognates,
+                ref=ref,
+                threshold=t2,
+                family=self.family,
+                distances=self.distances,
+                workers=self.workers)
+            idxs = list(self.wordlist)
+            for idx, borid in zip(idxs, own_clusters([self.wordlist[idx, ref] for idx in idxs])):
+                self.wordlist[idx, ref] = borid
+            self._evaluations[key] = (
+                Evaluation(self.wordlist, 'ucogid', [cognates], by='concept'),
+                Evaluation(self.wordlist, '_userborid', [ref], by='concept'))
+        return self._evaluations[key]
+
+    def fscores(self, t1, t2, weights=None):
+        """
+        :param weights: `(concepts,)` array of concept weights, e.g. a mask of concepts.
+        :return: pair of F-scores for cognate and borrowing detection.
+        """
+        return tuple(float(ev.scores(weights)[0, 2]) for ev in self.evaluate(t1, t2))
+
+
+def _grid(lower, upper, step):
+    return [round(t, 4) for t in np.arange(lower, upper + step / 2, step)]
+
+
+def search(score, bounds=(0.1, 0.9), step=0.1, levels=3, radius=1):
+    """
+    Maximise a function of two thresholds, coarse-to-fine.
+
+    :param score: Function mapping a pair of thresholds to a score.
+    :param bounds: Pair of lower and upper bound for both thresholds.
+    :param step: Step size of the initial grid.
+    :param levels: Number of grids to search - each refining the previous one around the best \
+    pair of thresholds, with half the step size.
+    :param radius: Number of steps to search in each direction when refining the grid.
+    :return: pair `((t1, t2), score)`. Of pairs with equal scores, the one evaluated first - \
+    i.e. on a coarser grid or with smaller thresholds - is returned.
+    """
+    lower, upper = bounds
+    candidates = list(itertools.product(_grid(lower, upper, step), repeat=2))
+    best = None
+    for _ in range(levels):
+        for t in sorted(set(candidates)):
+            s = score(*t)
+            if best is None or s > best[1]:
+                best = (t, s)
+        step /= 2
+        candidates = list(itertools.product(*[
+            [round(t + k * step, 4) for k in range(-radius, radius + 1)
+             if lower <= round(t + k * step, 4) <= upper]
+            for t in best[0]]))
+    return best
+
+
+def folds(n, k, seed=1234):
+    """
+    Split `n` items - e.g. concepts - randomly into `k` folds.
+
+    :return: `(k, n)` boolean array, with row `i` the mask of the items in fold `i`.
+    """
+    assignment = np.random.default_rng(seed).permutation(n) % k
+    return np.stack([assignment == i for i in range(k)])
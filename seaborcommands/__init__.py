@@ -0,0 +1,20 @@
+"""
+The `seabor.*` commands.
+
+cldfbench imports all command modules upon start-up, so the modules import heavy dependencies -
+lingpy, lingrex, matplotlib, cartopy and `lexibank_seabor` (which pulls in pylexibank and lingpy) -
+only within the functions that need them. Commands which only read the CLDF data use
+`cldf_reader` rather than instantiating `lexibank_seabor.Dataset`.
+"""
+import pathlib
+
+from pycldf import Dataset
+
+DATASET_DIR = pathlib.Path(__file__).parent.parent
+
+
+def cldf_reader():
+    """
+    :return: `pycldf.Dataset` - the CLDF data, like `lexibank_seabor.Dataset().cldf_reader()`.
+    """
+    return Dataset.from_metadata(DATASET_DIR / 'cldf' / 'cldf-metadata.json')
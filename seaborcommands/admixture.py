@@ -1,13 +1,19 @@
 """
 Create admixture plots from the lexical borrowing data.
+
+With --conceptlist, proportions are computed for any number of Concepticon concept lists in one
+go, and listed in one table.
 """
-import itertools
 import collections
 
+import numpy as np
 from cldfbench.cli_util import add_catalog_spec
 from clldutils.clilib import Table, add_format
 
-from lexibank_seabor import Dataset
+from seaborcommands import DATASET_DIR, cldf_reader
+from seabor.index import Index
+from seabor.admixture import Admixture
+from seabor.conceptlists import concepticon_glosses
 
 pcols = collections.OrderedDict([
     ('missing', 'white'),
@@ -26,17 +32,49 @@ def register(parser):
     add_format(parser, default='simple')
     parser.add_argument('--swadesh100', action='store_true', default=False)
     parser.add_argument('--borrowed', action='store_true', default=False)
+    parser.add_argument(
+        '--conceptlist',
+        help="IDs of Concepticon concept lists to compute proportions for",
+        nargs='+',
+        default=None)
     add_catalog_spec(parser, 'concepticon')
 
 
+def _row(lid, language, props, categories):
+    return [lid, language.data['Family'], language.data['SubGroup']] + [
+        float(props[categories.index(p)]) if p in categories else 0.0 for p in pcols]
+
+
 def run(args):
-    ds = Dataset()
-    cldf = ds.cldf_reader()
+    cldf = cldf_reader()
     langs = collections.OrderedDict(
         [(r.id, r) for r in cldf.objects('LanguageTable')])
 
     concepts = collections.OrderedDict(
         [(r['Concepticon_Gloss'], r['ID']) for r in cldf.iter_rows('ParameterTable')])
+    index = Index.cached(cldf)
+    admixture = Admixture(index)
+    columns = ['doculect', 'family', 'subgroup',
+               'Single', 'ST', 'HM', 'TK', 'HM-ST', 'ST-TK', 'HM-TK', 'ALL']
+
+    if args.conceptlist:
+        # All concept lists are looked up at once, as rows of an array of concept masks:
+        masks = np.zeros((len(args.conceptlist), len(index.concept_ids)), dtype=bool)
+        cache = DATASET_DIR / '.cache' / 'conceptlists'
+        for i, conceptlist in enumerate(args.conceptlist):
+            for gloss in concepticon_glosses(conceptlist, cache, catalog=args.concepticon.dir):
+                if gloss in concepts:
+                    masks[i, index.concept_index[concepts[gloss]]] = True
+        props = admixture.matrix(masks)
+        with Table(args, *['conceptlist', 'concepts'] + columns) as table:
+            for conceptlist, mask, rows in zip(args.conceptlist, masks, props):
+                for lid, p in zip(admixture.language_ids, rows):
+                    table.append(
+                        [conceptlist, int(mask.sum())] +
+                        _row(lid, langs[lid], p, admixture.categories))
+            table.sort(key=lambda x: (x[0], x[3], x[6], x[7], x[8]))
+        return
+
     fname = 'admixture'
 
     swadesh = set(
@@ -53,64 +91,12 @@ def run(args):
     else:
         selected_concepts = concepts
 
-    allforms = collections.OrderedDict([
-        (f['ID'], f) for f in
-        sorted(cldf['FormTable'], key=lambda f: (f['Language_ID'], f['Parameter_ID']))])
-
-    forms_by_cogid, forms_by_borid = collections.defaultdict(list), collections.defaultdict(list)
-    cogid_by_formid, borid_by_formid = {}, {}
-    for row in cldf['CognateTable']:
-        if row['Cognateset_ID'].startswith('auto-full-'):
-            forms_by_cogid[row['Cognateset_ID']].append(allforms[row['Form_ID']])
-            cogid_by_formid[row['Form_ID']] = row['Cognateset_ID']
-
-    for row in cldf['BorrowingTable']:
-        if row['Xenolog_Cluster_ID'].startswith('auto-'):
-            forms_by_borid[row['Xenolog_Cluster_ID']].append(allforms[row['Target_Form_ID']])
-            borid_by_formid[row['Target_Form_ID']] = row['Xenolog_Cluster_ID']
-
-    for lid, forms in itertools.groupby(allforms.values(), lambda f: f['Language_ID']):
-        language = langs[lid]
-
-        # forms by concept for this doculect:
-        concepts = {
-            pid: list(ff) for pid, ff in itertools.groupby(forms, lambda f: f['Parameter_ID'])}
-
-        props = collections.defaultdict(float)
-        total = 0
-        for concept, cid in selected_concepts.items():
-            prop = []
-            for form in concepts.get(cid, []):
-                # get the other members of the cognate class and borrowing cluster respectively:
-                borrowing_cluster = forms_by_borid.get(borid_by_formid.get(form['ID']), [])
-                cognate_class = forms_by_cogid.get(cogid_by_formid.get(form['ID']), [])
-
-                if len(borrowing_cluster) > 1:
-                    families = '--'.join(sorted(k for k in set(
-                        langs[f['Language_ID']].data['Family'] for f in borrowing_cluster) if k))  # != this_family]))
-                    prop.append(families)
-                elif len(cognate_class) > 1:
-                    prop.append(language.data['Family'])
-                else:
-                    prop.append('singleton')
-
-            for p in prop:
-                props[p] += 1 / len(prop)
-
-            if prop:
-                total += 1
-            elif cid not in concepts:
-                props['missing'] += 1
-                total += 1
-
-        for k in list(props.keys()):
-            props[k] = props[k] / total
-
-        language.data['props'] = props
-        language.data['total'] = total
-
-    with Table(args, 'doculect', 'family', 'subgroup',
-               'Single', 'ST', 'HM', 'TK', 'HM-ST', 'ST-TK', 'HM-TK', 'ALL') as table:
+    selected = [index.concept_index[cid] for cid in selected_concepts.values()]
+    for lid, (props, total) in admixture.proportions(selected).items():
+        langs[lid].data['props'] = props
+        langs[lid].data['total'] = total
+
+    with Table(args, *columns) as table:
         for lid, language in langs.items():
             row = [lid, language.data['Family'], language.data['SubGroup']]
             for p in pcols:
@@ -118,4 +104,3 @@ def run(args):
             table.append(row)
 
         table.sort(key=lambda x: (x[1], x[4], x[5], x[6]))
-
@@ -0,0 +1,102 @@
+"""
+Benchmark the stages of makecldf and the seabor commands on synthetic data of increasing size.
+
+The synthetic data consists of copies of the concepts (or doculects) of the seabor data, see
+`seabor.benchmark`. Results are written to a JSON file per run in the --output directory, named
+after the current git commit, and can be compared with the results for another commit via
+--compare.
+"""
+import json
+
+from clldutils.clilib import Table, add_format, PathType
+
+from seaborcommands import DATASET_DIR
+from seabor.benchmark import BENCHMARKS, run as run_benchmark, save, compare
+
+
+def register(parser):
+    add_format(parser, default='simple')
+    parser.add_argument(
+        '--benchmarks',
+        help="Benchmarks to run (default: all)",
+        nargs='+',
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS))
+    parser.add_argument(
+        '--scales',
+        help="Sizes of the synthetic data, as multiples of the seabor data",
+        nargs='+',
+        type=int,
+        default=[1, 5, 20])
+    parser.add_argument(
+        '--axis',
+        help="Scale the data by copying concepts or doculects",
+        choices=['concept', 'doculect'],
+        default='concept')
+    parser.add_argument(
+        '--concepts',
+        help="Only use the first N concepts of the wordlist for the makecldf and fullcomparison "
+             "benchmarks (default: all concepts)",
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--runs',
+        help="Number of permutations for the LexStat scorer and the permutation test of "
+             "seabor.distribution",
+        type=int,
+        default=100)
+    parser.add_argument(
+        '--repeat',
+        help="Number of times each benchmark is run",
+        type=int,
+        default=3)
+    parser.add_argument(
+        '--seed',
+        help="Random seed",
+        type=int,
+        default=1234)
+    parser.add_argument(
+        '--workers',
+        help="Number of worker processes used by the stages of makecldf",
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--output',
+        help="Directory to write the results to",
+        type=PathType(type='dir', must_exist=False),
+        default=DATASET_DIR / 'benchmarks')
+    parser.add_argument(
+        '--compare',
+        help="JSON file with results to compare with, e.g. for another commit",
+        type=PathType(type='file'),
+        default=None)
+
+
+def run(args):
+    params = dict(
+        axis=args.axis, concepts=args.concepts, runs=args.runs, repeat=args.repeat,
+        seed=args.seed, workers=args.workers)
+    results = []
+    for name in args.benchmarks:
+        for factor in args.scales:
+            args.log.info('running benchmark {0} at scale {1}'.format(name, factor))
+            results.extend(run_benchmark(name, factor, **params))
+    args.log.info('results written to {0}'.format(save(results, args.output, **params)))
+
+    ratios = {}
+    if args.compare:
+        with args.compare.open(encoding='utf8') as fp:
+            ratios = compare(results, json.load(fp)['results'])
+    with Table(
+            args,
+            *['benchmark', 'stage', 'scale', 'forms', 'wall time', 'cpu time', 'peak MB',
+              'alignments'] + (['ratio'] if args.compare else []),
+            floatfmt='.3f') as tab:
+        for r in results:
+            stage = r['stage'] if r['parent'] is None else '  ' + r['stage']
+            row = [
+                r['benchmark'], stage, r['factor'], r['forms'], r['wall_time'], r['cpu_time'],
+                r['peak_rss_mb'], r['counts'].get('alignments', '')]
+            if args.compare:
+                row.append(ratios.get((r['benchmark'], r['stage'], r['factor']), ''))
+            tab.append(row)
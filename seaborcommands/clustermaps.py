@@ -0,0 +1,181 @@
+"""
+Plot maps for all cross-family xenolog clusters - or a selection of clusters - in one go.
+
+Accepts the same options as `cldfviz.map`, but `--output` is the directory to which the maps are
+written, as `concept-<CONCEPT>-<CLUSTER>.<FORMAT>`.
+"""
+import pathlib
+import argparse
+import multiprocessing
+
+from clldutils.clilib import PathType
+from pycldf.cli_util import get_dataset
+
+from seaborcommands import DATASET_DIR
+from seabor.index import Index
+
+
+def register(parser):
+    from cldfviz.commands import map as cldfviz_map
+
+    cldfviz_map.register(parser)
+    for action in parser._actions:
+        if action.dest == 'output':
+            action.type = PathType(type='dir', must_exist=False)
+            action.default = pathlib.Path('plots')
+            action.help = "Directory to write the maps to."
+        elif action.dest == 'format':
+            action.default = 'jpg'
+        elif action.dest == 'marker_factory':
+            action.help = "A python module providing a subclass of `cldfviz.map.MarkerFactory` " \
+                          "(default: the dataset's plots.py)."
+    parser.add_argument(
+        '--clusters',
+        help="IDs of xenolog clusters to plot (default: all cross-family clusters)",
+        nargs='+',
+        default=None)
+    parser.add_argument(
+        '--concepts',
+        help="Only plot xenolog clusters for the given concept IDs",
+        nargs='+',
+        default=None)
+    parser.add_argument(
+        '--workers',
+        help="Number of worker processes to use",
+        type=int,
+        default=1)
+
+
+def cross_family_clusters(index):
+    """
+    :return: `list` of pairs `(concept ID, cluster ID)` for all automatically detected xenolog \
+    clusters with members from more than one family.
+    """
+    res = []
+    for i, xid in enumerate(index.xenolog_ids):
+        if xid.startswith('auto-'):
+            members = index.xenolog_members(i)
+            if len(set(index.language_family[index.form_language[members]])) > 1:
+                res.append((
+                    str(index.concept_ids[index.form_concept[members[0]]]),
+                    str(xid)[len('auto-'):]))
+    return res
+
+
+def _save(map_, path):
+    """
+    Save a `MapPlot` like `MapPlot.__exit__` does, but without closing the figure.
+    """
+    from PIL import Image
+
+    if map_.args.title:
+        map_.ax.set_title(map_.args.title)
+    if path.suffix == '.jpg':
+        png = path.parent / '{0}.png'.format(path.stem)
+        map_._savefig(png)
+        Image.open(str(png)).convert('RGB').save(str(path), optimize=True, quality=95)
+        png.unlink()
+    else:
+        map_._savefig(path)
+
+
+_STATE = None
+
+
+def _init_worker(args, languages, parameters, colormaps):
+    global _STATE
+    _STATE = (args, languages, parameters, colormaps)
+
+
+def _render(clusters):
+    """
+    Render maps for a list of clusters.
+
+    For matplotlib formats, the base map is created once, and only the markers are replaced for
+    each cluster.
+    """
+    from matplotlib import pyplot as plt
+    from cldfviz.map import MarkerFactory
+    from cldfviz.map.mpl import MapPlot
+    from cldfviz.cli_util import import_subclass
+    from cldfviz.commands import map as cldfviz_map
+
+    args, languages, parameters, colormaps = _STATE
+    # We work on a copy of the options, because `cldfviz` maps read the output path from them.
+    args = argparse.Namespace(**vars(args))
+    ds = get_dataset(args)
+    index = Index.cached(ds)
+    args.marker_factory = import_subclass(args.marker_factory_module, MarkerFactory)(
+        ds, args, *clusters[0])
+    map_cls = cldfviz_map.FORMATS[args.format]
+    outdir = args.output
+
+    base_map, base = None, None
+    if issubclass(map_cls, MapPlot):
+        base_map = map_cls([lg for lg, _ in languages], args).__enter__()
+        base = set(base_map.ax.get_children())
+
+    res = []
+    for pid, cid in clusters:
+        args.marker_factory.set_cluster(index, pid, cid)
+        path = outdir / 'concept-{0}-{1}.{2}'.format(pid, cid, args.format)
+        if base_map:
+            for lang, values in languages:
+                base_map.api_add_language(lang, values, colormaps)
+            if not args.no_legend:
+                base_map.api_add_legend(parameters, colormaps)
+            _save(base_map, path)
+            # Remove the markers of this cluster, to keep the bare base map:
+            for artist in base_map.ax.get_children():
+                if artist not in base:
+                    artist.remove()
+        else:
+            args.output = path
+            with map_cls([lg for lg, _ in languages], args) as map_:
+                for lang, values in languages:
+                    map_.api_add_language(lang, values, colormaps)
+                if not args.no_legend:
+                    map_.api_add_legend(parameters, colormaps)
+        res.append(path)
+    if base_map:
+        plt.close()
+    return res
+
+
+def run(args):
+    from cldfviz.glottolog import Glottolog
+    from cldfviz.cli_util import get_multiparameter
+
+    ds = get_dataset(args)
+    index = Index.cached(ds)
+    clusters = cross_family_clusters(index)
+    if args.clusters:
+        clusters = [(pid, cid) for pid, cid in clusters if cid in args.clusters]
+    if args.concepts:
+        clusters = [(pid, cid) for pid, cid in clusters if pid in args.concepts]
+    if not clusters:
+        args.log.warning('No xenolog clusters selected')
+        return
+    args.log.info('plotting {0} xenolog clusters'.format(len(clusters)))
+
+    data, colormaps = get_multiparameter(
+        args, ds, Glottolog.from_args(args), exclude_lang=lambda lg: lg.lat is None)
+    languages = list(data.iter_languages())
+
+    # We only pass picklable options to the workers:
+    wargs = argparse.Namespace(**{
+        k: v for k, v in vars(args).items() if k not in ['log', 'glottolog', 'marker_factory']})
+    wargs.marker_factory_module = \
+        (args.marker_factory or str(DATASET_DIR / 'plots.py')).split(',')[0]
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    state = (wargs, languages, data.parameters, colormaps)
+    workers = max(1, min(args.workers, len(clusters)))
+    chunks = [clusters[i::workers] for i in range(workers)]
+    if workers == 1:
+        _init_worker(*state)
+        paths = _render(chunks[0])
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=state) as pool:
+            paths = [p for res in pool.map(_render, chunks) for p in res]
+    args.log.info('wrote {0} maps to {1}'.format(len(paths), args.output))
@@ -1,106 +1,182 @@
 """
 Calculate statistics for the likelihood of obtaining differences between Swadesh and other concepts.
+
+The significance of the difference between the concepts of a concept list and the other concepts
+is estimated with a permutation test (see `seabor.permutation`), which stops drawing random
+concept sets as soon as the confidence interval of the p-value is narrower than --precision. Any
+number of concept lists - or all Concepticon concept lists - can be tested in one go.
 """
-import random
 import itertools
 import collections
 
-from pylexibank import progressbar as pb
+import numpy as np
 from clldutils.clilib import Table, add_format
 from cldfbench.cli_util import add_catalog_spec
 
-from lexibank_seabor import Dataset
+from seaborcommands import cldf_reader
+from seabor.index import Index
+from seabor.permutation import permutation_test as _permutation_test
 
 
 def register(parser):
     add_format(parser, default='simple')
-    parser.add_argument('--conceptlist', action='store', default=None)
-    add_catalog_spec(parser, 'concepticon')
-    parser.add_argument('--runs', action="store", type=int, default=1000)
     parser.add_argument(
-        '--seed',
-        type=lambda s: random.seed(int(s)),
+        '--conceptlist',
+        help="IDs of Concepticon concept lists to test",
+        nargs='+',
         default=None)
+    parser.add_argument(
+        '--all-conceptlists',
+        help="Test all Concepticon concept lists sharing at least one concept with the data",
+        action='store_true',
+        default=False)
+    add_catalog_spec(parser, 'concepticon')
+    parser.add_argument(
+        '--runs',
+        help="Maximal number of random concept sets per concept list",
+        action="store",
+        type=int,
+        default=1000)
+    parser.add_argument(
+        '--precision',
+        help="Stop drawing random concept sets once the confidence interval of the p-value is at "
+             "most this wide",
+        type=float,
+        default=0.01)
+    parser.add_argument('--seed', type=int, default=None)
 
 
 class Scorer:
+    """
+    Computes the mean proportion of non-borrowed items per doculect for sets of concepts.
+
+    The per-language/per-concept proportions are computed once, as a language x concept matrix,
+    so that scoring a concept set boils down to masked column sums.
+    """
     def __init__(self, allforms, forms_by_borid, borid_by_formid, concepts):
-        self.forms_by_language = [
-            list(forms) for _, forms in itertools.groupby(allforms, lambda f: f['Language_ID'])]
-        self.f_by_b = forms_by_borid
-        self.b_by_f = borid_by_formid
         self.concepts = concepts
+        self.cindex = {cid: i for i, cid in enumerate(concepts.values())}
+
+        forms_by_language = [
+            list(forms) for _, forms in itertools.groupby(allforms, lambda f: f['Language_ID'])]
+        # Proportion of non-borrowed forms per doculect and concept:
+        self.nonborrowed = np.zeros((len(forms_by_language), len(concepts)))
+        # Whether a doculect has any forms for a concept:
+        self.present = np.zeros((len(forms_by_language), len(concepts)))
+        for i, forms in enumerate(forms_by_language):
+            for pid, ff in itertools.groupby(forms, lambda f: f['Parameter_ID']):
+                ff = list(ff)
+                j = self.cindex[pid]
+                self.nonborrowed[i, j] = sum(
+                    1 for form in ff
+                    if len(forms_by_borid.get(borid_by_formid.get(form['ID']), [])) <= 1
+                ) / len(ff)
+                self.present[i, j] = 1
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Initialize a scorer from a `seabor.index.Index`.
+        """
+        self = cls.__new__(cls)
+        self.concepts = collections.OrderedDict(zip(
+            (str(g) for g in index.concept_glosses), (str(c) for c in index.concept_ids)))
+        self.cindex = {cid: i for i, cid in enumerate(self.concepts.values())}
+
+        form_xenolog, sizes = index.xenologs('auto-')
+        # Forms without xenolog cluster are looked up as members of a cluster of size 0:
+        nonborrowed = np.append(sizes, 0)[form_xenolog] <= 1
+        shape = (len(index.language_ids), len(index.concept_ids))
+        counts, self.nonborrowed = np.zeros(shape), np.zeros(shape)
+        np.add.at(counts, (index.form_language, index.form_concept), 1)
+        np.add.at(self.nonborrowed, (index.form_language, index.form_concept), nonborrowed)
+        self.present = (counts > 0).astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.nonborrowed = np.where(counts > 0, self.nonborrowed / counts, 0.0)
+        # Only doculects with forms are considered:
+        rows = self.present.any(axis=1)
+        self.nonborrowed, self.present = self.nonborrowed[rows], self.present[rows]
+        return self
+
+    def mask(self, subset):
+        """
+        :param subset: Iterable of Concepticon glosses.
+        :return: Boolean concept mask.
+        """
+        res = np.zeros(len(self.cindex), dtype=bool)
+        res[[self.cindex[self.concepts[concept]] for concept in subset]] = True
+        return res
+
+    def scores(self, masks):
+        """
+        :param masks: `(n, concepts)` array of boolean concept masks.
+        :return: `(n,)` array of scores.
+        """
+        masks = np.asarray(masks, dtype=float)
+        num = masks @ self.nonborrowed.T
+        den = masks @ self.present.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            props = np.where(den > 0, num / den, 0.0)
+        return props.mean(axis=1)
 
     def __call__(self, subset):
-        scores = []
-        for forms in self.forms_by_language:
-            # forms by concept for this doculect:
-            concepts_ = {
-                pid: list(ff) for pid, ff in itertools.groupby(forms, lambda f: f['Parameter_ID'])}
-
-            props = collections.defaultdict(float)
-            total = 0
-            for concept in subset:
-                cid = self.concepts[concept]
-                prop = []
-                for form in concepts_.get(cid, []):
-                    borrowing_cluster = self.f_by_b.get(self.b_by_f.get(form['ID']), [])
-                    if len(borrowing_cluster) > 1:
-                        prop.append("1")
-                    else:
-                        prop.append("0")
-
-                for p in prop:
-                    props[p] += 1 / len(prop)
-                if prop:
-                    total += 1
-            for k in list(props.keys()):
-                props[k] = props[k] / total
-            scores += [props["0"]]
-        return sum(scores)/len(scores)
+        return float(self.scores(self.mask(subset)[np.newaxis, :])[0])
 
 
 def run(args):
-    ds = Dataset()
-    cldf = ds.cldf_reader()
-    concepts = collections.OrderedDict(
-        [(r['Concepticon_Gloss'], r['ID']) for r in cldf.iter_rows('ParameterTable')])
+    scorer = Scorer.from_index(Index.cached(cldf_reader()))
+    concepts = scorer.concepts
     all_concepts = set(concepts)
     args.log.info("loaded dataset")
-        
-    allforms = collections.OrderedDict([
-        (f['ID'], f) for f in
-        sorted(cldf['FormTable'], key=lambda f: (f['Language_ID'], f['Parameter_ID']))])
-
-    forms_by_borid = collections.defaultdict(list)
-    borid_by_formid = {}
-
-    for row in cldf['BorrowingTable']:
-        if row['Xenolog_Cluster_ID'].startswith('auto-'):
-            forms_by_borid[row['Xenolog_Cluster_ID']].append(allforms[row['Target_Form_ID']])
-            borid_by_formid[row['Target_Form_ID']] = row['Xenolog_Cluster_ID']
-
-    scorer = Scorer(allforms.values(), forms_by_borid, borid_by_formid, concepts)
-    with Table(args, "Conceptlist", "Proportion of Non-Borrowed Items", "Number of Items") as tab:
-        if not args.conceptlist:
-            tab.append(["All items", scorer(concepts), len(concepts)])
+
+    conceptlists = args.conceptlist or []
+    if args.all_conceptlists:
+        conceptlists = sorted(args.concepticon.api.conceptlists)
+
+    with Table(
+            args,
+            "Conceptlist", "Proportion of Non-Borrowed Items", "Number of Items",
+            "Difference", "Significance", "95% CI", "Permutations") as tab:
+        if not conceptlists:
+            tab.append(["All items", scorer(concepts), len(concepts), '', '', '', ''])
             return
 
-        subset = set(c.concepticon_gloss for c in
-            args.concepticon.api.conceptlists[args.conceptlist].concepts.values()
-            if c.concepticon_gloss in concepts)
-        otherset = all_concepts.difference(subset)
-        sA, sB = (scorer(subset), scorer(otherset))
-
-        tab.append([args.conceptlist, sA, len(subset)])
-        tab.append(["!= "+args.conceptlist, sB, len(otherset)])
-
-    dAB = sA - sB
-    hits = 0
-    for _ in pb(range(args.runs), desc="permutation test"):
-        new_subset = random.sample(list(concepts), len(subset))
-        new_otherset = all_concepts.difference(new_subset)
-        new_diff = scorer(new_subset) - scorer(new_otherset)
-        if new_diff >= dAB:
-            hits += 1
-    print("Significance: {0:.4f} ({1:.4f})".format(hits / args.runs, dAB))
+        for i, conceptlist in enumerate(conceptlists):
+            subset = set(c.concepticon_gloss for c in
+                args.concepticon.api.conceptlists[conceptlist].concepts.values()
+                if c.concepticon_gloss in concepts)
+            otherset = all_concepts.difference(subset)
+            if not subset or not otherset:
+                args.log.info('skipping {0}: no concepts to compare'.format(conceptlist))
+                continue
+            res, dAB = permutation_test(
+                scorer,
+                subset,
+                args.runs,
+                precision=args.precision,
+                seed=None if args.seed is None else [args.seed, i])
+            tab.append([
+                conceptlist, scorer(subset), len(subset), dAB, res.pvalue,
+                '{0:.4f}-{1:.4f}'.format(res.lower, res.upper),
+                '{0}{1}'.format(res.permutations, ' (exact)' if res.exact else '')])
+            tab.append(["!= " + conceptlist, scorer(otherset), len(otherset), '', '', '', ''])
+
+
+def permutation_test(scorer, subset, runs, precision=0.01, seed=None):
+    """
+    Test whether the score of a concept subset is higher than the score of the other concepts,
+    comparing the difference with the differences for (at most) `runs` random subsets of the same
+    size, see `seabor.permutation.permutation_test`.
+
+    :return: pair `(seabor.permutation.Result, difference)`.
+    """
+    def statistic(masks):
+        return scorer.scores(masks) - scorer.scores(~masks)
+
+    return _permutation_test(
+        statistic,
+        [scorer.cindex[scorer.concepts[concept]] for concept in subset],
+        len(scorer.concepts),
+        permutations=runs,
+        precision=precision,
+        seed=seed)
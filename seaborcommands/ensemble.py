@@ -0,0 +1,114 @@
+"""
+Run the automated detection of cognates and borrowings under several random seeds.
+
+Reports the B-cubed scores for each seed - and their spread - as well as the scores of the
+consensus cluster assignment, i.e. the clusters of words grouped together under a majority of
+the seeds. The consensus cluster assignment is written to a TSV file.
+
+Each seed runs the whole detection: the seed determines the LexStat scorer and thus the partial
+cognates, which the other stages build on. Distances between words of different families don't
+depend on the seed, though, and are shared across seeds - and runs - via the distance store of
+`lexibank_seabor.Dataset.detect`.
+"""
+import multiprocessing
+
+import numpy as np
+from csvw.dsv import UnicodeWriter
+from clldutils.clilib import Table, add_format, PathType
+
+
+def register(parser):
+    add_format(parser, default='simple')
+    parser.add_argument(
+        '--seed',
+        help="First random seed",
+        type=int,
+        default=1234)
+    parser.add_argument(
+        '--size',
+        help="Number of random seeds, i.e. consecutive integers starting with --seed",
+        type=int,
+        default=5)
+    parser.add_argument(
+        '--runs',
+        help="Number of permutations to compute the LexStat scorer",
+        type=int,
+        default=10000)
+    parser.add_argument(
+        '--workers',
+        help="Number of worker processes, each running the detection for one seed",
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--output',
+        help="Path of the TSV file to write the consensus cluster assignment to",
+        type=PathType(type='file', must_exist=False),
+        default='consensus.tsv')
+
+
+def _detect(task):
+    """
+    Run the automated detection for one seed.
+
+    :return: `dict` mapping wordlist IDs to pairs `(autocogid, autoborid)`.
+    """
+    from lexibank_seabor import Dataset
+
+    seed, runs = task
+    ds = Dataset()
+    wl = ds.wl()
+    ds.detect(wl, seed=seed, runs=runs)
+    return {idx: (wl[idx, 'autocogid'], wl[idx, 'autoborid']) for idx in wl}
+
+
+def run(args):
+    from lexibank_seabor import Dataset
+    from seabor.evaluate import Evaluation, consensus
+    from seabor.borrowing import own_clusters
+
+    seeds = [args.seed + i for i in range(args.size)]
+    tasks = [(seed, args.runs) for seed in seeds]
+    args.log.info('running the detection for seeds {0}'.format(', '.join(map(str, seeds))))
+    if args.workers > 1:
+        with multiprocessing.Pool(min(args.workers, len(tasks))) as pool:
+            results = pool.map(_detect, tasks)
+    else:
+        results = [_detect(task) for task in tasks]
+    # All detections are done, so the caches can be cleaned up safely:
+    Dataset().evict()
+
+    wl = Dataset().wl()
+    idxs = list(wl)
+    concepts = [wl[idx, 'concept'] for idx in idxs]
+    cogids = consensus([[res[idx][0] for idx in idxs] for res in results], concepts)
+    borids = consensus(
+        [[res[idx][1] for idx in idxs] for res in results], concepts, unassigned=0)
+
+    with UnicodeWriter(args.output, delimiter='\t') as w:
+        w.writerow(['ID', 'DOCULECT', 'FAMILY', 'CONCEPT', 'AUTOCOGID', 'AUTOBORID'])
+        for idx, cogid, borid in zip(idxs, cogids, borids):
+            w.writerow([
+                idx, wl[idx, 'doculect'], wl[idx, 'family'], wl[idx, 'concept'], cogid, borid])
+    args.log.info('consensus cluster assignment written to {0}'.format(args.output))
+
+    # Add the cluster assignments to the wordlist, with words not in a xenolog cluster placed into
+    # clusters of their own, just like in `makecldf`:
+    def add(col, values):
+        wl.add_entries(col, dict(zip(idxs, values)), lambda x: x)
+
+    add('userborid', own_clusters([wl[idx, 'uborid'] for idx in idxs]))
+    for name, res in zip(seeds + ['consensus'], results + [dict(zip(idxs, zip(cogids, borids)))]):
+        add('autocogid_{0}'.format(name), [res[idx][0] for idx in idxs])
+        add('autoborid_{0}'.format(name), own_clusters([res[idx][1] for idx in idxs]))
+
+    names = seeds + ['consensus']
+    scores = np.concatenate([
+        Evaluation(wl, 'ucogid', ['autocogid_{0}'.format(n) for n in names]).scores(),
+        Evaluation(wl, 'userborid', ['autoborid_{0}'.format(n) for n in names]).scores(),
+    ], axis=1)
+    with Table(args, "Seed", "P1", "R1", "F1", "P2", "R2", "F2", floatfmt=".4f") as tab:
+        for name, row in zip(names[:-1], scores[:-1]):
+            tab.append([name] + list(row))
+        for label, func in [('mean', np.mean), ('std', np.std), ('min', np.min), ('max', np.max)]:
+            tab.append([label] + list(func(scores[:-1], axis=0)))
+        tab.append(['consensus'] + list(scores[-1]))
@@ -2,15 +2,11 @@
 Compare the alternative method for borrowing detection by Hantgan et al. 2020.
 """
 import random
-from lingpy import *
-from lingpy.compare.partial import Partial
-from lexibank_seabor import Dataset as sb
-from lingpy.evaluate.acd import bcubes
+import itertools
+import multiprocessing
 from clldutils.clilib import Table, add_format
-from lingrex import cognates, borrowing
-from tabulate import tabulate
-from matplotlib import pyplot as plt
 
+THRESHOLDS = [0.05 * j for j in range(1, 20)]
 
 
 def register(parser):
@@ -25,28 +21,63 @@ def register(parser):
             help="use partial lexstat algorithm for cognate detection",
             action="store_true",
             default=False)
+    parser.add_argument(
+            "--grid",
+            help="compare all combinations of sca/lexstat and full/partial cognate detection "
+                 "in parallel",
+            action="store_true",
+            default=False)
+    parser.add_argument(
+            "--workers",
+            help="number of worker processes to use with --grid or --bootstrap",
+            type=int,
+            default=multiprocessing.cpu_count())
+    parser.add_argument(
+            "--seed",
+            help="random seed",
+            type=int,
+            default=1234)
+    parser.add_argument(
+            "--bootstrap",
+            help="number of bootstrap samples (of concepts) to compute confidence intervals for "
+                 "the F-scores",
+            type=int,
+            default=0)
 
 
-def run(args):
-    random.seed(int(input('Random seed [int]: ') or 1234))
-    if args.lexstat:
-        method = "lexstat"
-    else:
-        method = "sca"
-    try:
-        from igraph import Graph
-        cluster_method = "infomap"
-    except:
-        cluster_method = "upgma"
-        args.log.warning("Using UPGMA as cluster method")
+_DATA = None
+
+
+def _init_worker(data):
+    global _DATA
+    _DATA = data
+
+
+def compare(
+        data, lexstat, partial, cluster_method, seed, samples=0, workers=1, distances=None):
+    """
+    Compute B-cubed scores for cognate and xenolog detection for all thresholds.
+
+    :param data: `dict` with wordlist data, as accepted by `lingpy.LexStat`.
+    :param distances: `seabor.distances.DistanceStore` to look up distance matrices in.
+    :param samples: Number of bootstrap samples to compute confidence intervals for F1 and F2.
+    :return: `list` of rows `[threshold, P1, R1, F1, P2, R2, F2]` - with the confidence \
+    intervals for F1 and F2 appended if `samples` is given.
+    """
+    from lingpy import LexStat
+    from lingpy.compare.partial import Partial
+    import lingrex.cognates
+    from seabor.sweep import ThresholdSweep
+    from seabor.evaluate import Evaluation, bootstrap, format_ci
 
-    table = []
-    if args.partial:
-        lex = Partial(str(sb().raw_dir / "seabor.sqlite3"))
-        args.log.info("loading partial object")
+    random.seed(seed)
+    method = "lexstat" if lexstat else "sca"
+    # lingpy modifies the data passed in, so we pass a copy:
+    data = {k: list(v) for k, v in data.items()}
+    if partial:
+        lex = Partial(data)
     else:
-        lex = LexStat(str(sb().raw_dir / "seabor.sqlite3"))
-        args.log.info("loading lexstat object")
+        lex = LexStat(data)
 
     # renumber borrowings !
     clusterid = max([int(x) for x in lex.get_etymdict("uborid")])+1
@@ -58,30 +89,30 @@ def run(args):
     # add lumper and splitter baseline
 
     if method == "lexstat":
-        if not args.partial:
+        if not partial:
             lex.get_scorer(runs=10000)
         else:
             lex.get_partial_scorer(runs=10000)
 
-    for i, t in enumerate([0.05 * j for j in range(1, 20)]):
-        if args.partial:
-            lex.partial_cluster(
+    # Distance matrices are computed only once, and re-used for all thresholds:
+    sweep = ThresholdSweep(lex, cluster_method=cluster_method, distances=distances)
+    for i, t in enumerate(THRESHOLDS):
+        if partial:
+            sweep.partial_cluster(
                     method=method, threshold=t,
-                    ref="scallids_{0}".format(i),
-                    cluster_method=cluster_method)
-            cognates.common_morpheme_cognates(
+                    ref="scallids_{0}".format(i))
+            lingrex.cognates.common_morpheme_cognates(
                 lex,
                 ref="scallid_{0}".format(i),
                 cognates="scallids_{0}".format(i),
                 morphemes="automorphemes_{0}".format(i))
         else:
-            lex.cluster(method=method, threshold=t,
-                    ref="scallid_{0}".format(i), cluster_method=cluster_method)
+            sweep.cluster(method=method, threshold=t,
+                    ref="scallid_{0}".format(i))
         lex.add_entries("sca_{0}".format(i), "scallid_{0},family".format(i), lambda x, y:
                 str(x[y[0]])+"-"+x[y[1]])
         lex.renumber("sca_{0}".format(i))
         etd = lex.get_etymdict(ref="scallid_{0}".format(i))
-        nulls = {}
         clusterid = max(etd)+1
         for cogid, vals in etd.items():
             idxs = []
@@ -94,26 +125,76 @@ def run(args):
                     lex[idx, 'scallid_{0}'.format(i)] = clusterid
                     clusterid += 1
 
-        p1, r1, f1 = bcubes(lex, "ucogid", "sca_{0}id".format(i), pprint=False)
-        p2, r2, f2 = bcubes(lex, "uborid", "scallid_{0}".format(i), pprint=False)
-        table += [[t, p1, r1, f1, p2, r2, f2]]
-    with Table(
-            args, "Threshold", "P1", "R1", "F1", "P2", "R2", "F2",
-            floatfmt=".4f") as tab:
-        for row in table:
-            tab.append(row)
+    # All thresholds are scored in one go:
+    tests = [
+        ("ucogid", ["sca_{0}id".format(i) for i in range(len(THRESHOLDS))]),
+        ("uborid", ["scallid_{0}".format(i) for i in range(len(THRESHOLDS))])]
+    cognates, xenologs = [Evaluation(lex, gold, cols).scores() for gold, cols in tests]
+    table = [[t] + list(c) + list(x) for t, c, x in zip(THRESHOLDS, cognates, xenologs)]
+    if samples:
+        cognates, xenologs = [
+            bootstrap(Evaluation(lex, gold, cols, by="concept"), samples, seed=seed,
+                      workers=workers)
+            for gold, cols in tests]
+        for row, c, x in zip(table, cognates, xenologs):
+            row += [format_ci(c[2]), format_ci(x[2])]
+    return table
+
+
+def _compare(task):
+    lexstat, partial, cluster_method, seed, samples, distances = task
+    # We are running in a worker process already, so bootstrap samples are computed serially:
+    return lexstat, partial, compare(
+        _DATA, lexstat, partial, cluster_method, seed, samples, distances=distances)
 
-    fig = plt.Figure()
+
+def grid(data, cluster_method, seed, combinations=None, samples=0, workers=1, distances=None):
+    """
+    Run `compare` for combinations of method and cognate detection mode in parallel.
+
+    Each combination is computed in a separate process, seeded just like a separate invocation \
+    of the command would be.
+
+    :param combinations: `list` of `(lexstat, partial)` pairs - defaults to all four combinations.
+    :return: `dict` mapping `(lexstat, partial)` pairs to the tables returned by `compare` - \
+    ordered like `combinations`.
+    """
+    combinations = combinations or list(itertools.product([False, True], [False, True]))
+    tasks = [
+        (lexstat, partial, cluster_method, seed, samples, distances)
+        for lexstat, partial in combinations]
+    with multiprocessing.Pool(
+            min(workers, len(tasks)), initializer=_init_worker, initargs=(data,)) as pool:
+        results = {(lexstat, partial): table for lexstat, partial, table in
+                   pool.imap_unordered(_compare, tasks)}
+    return {combination: results[combination] for combination in combinations}
+
+
+def grid_rows(results):
+    """
+    :param results: `dict` as returned by `grid`.
+    :return: `list` of rows of the combined table, i.e. the rows of the tables returned by \
+    `compare`, prefixed with method and cognate detection mode.
+    """
+    return [
+        ["LexStat" if lexstat else "SCA", "partial" if partial else "full"] + row
+        for (lexstat, partial), table in results.items() for row in table]
+
+
+def plot(table, lexstat, partial):
+    from matplotlib import pyplot as plt
+
+    plt.figure()
     plt.plot(
-            1, table[0][3], 'o', color="Crimson", 
+            1, table[0][3], 'o', color="Crimson",
             label="family-internal cognates")
     plt.plot(
-            1, table[0][-1], 'o', color="CornFlowerBlue",
+            1, table[0][6], 'o', color="CornFlowerBlue",
             label="family-external xenologs")
 
     for i, row in enumerate(table[1:]):
         plt.plot(i+2, row[3], 'o', color="Crimson")
-        plt.plot(i+2, row[-1], 'o', color="CornFlowerBlue")
+        plt.plot(i+2, row[6], 'o', color="CornFlowerBlue")
     plt.xticks(
             list(
                 range(1, 20)
@@ -123,12 +204,60 @@ def run(args):
     plt.xlabel("cognate detection thresholds")
     plt.ylabel("B-cubed F-scores")
     plt.title("Cognate vs. Xenolog Detection ({0}, {1})".format(
-        "LexStat" if args.lexstat else "SCA",
-        "Full Cognates" if not args.partial else "Partial Cognates"))
+        "LexStat" if lexstat else "SCA",
+        "Full Cognates" if not partial else "Partial Cognates"))
     plt.legend(loc=4)
     plt.savefig("plots/full_comparison-{0}-{1}.pdf".format(
-        "lexstat" if args.lexstat else "sca",
-        "full" if not args.partial else "partial"
+        "lexstat" if lexstat else "sca",
+        "full" if not partial else "partial"
         ))
+    plt.close()
+
+
+def run(args):
+    from lexibank_seabor import Dataset as sb
+    from seabor.distances import DistanceStore
 
-    
+    seed = args.seed
+    try:
+        import igraph  # noqa: F401
+        cluster_method = "infomap"
+    except ImportError:
+        cluster_method = "upgma"
+        args.log.warning("Using UPGMA as cluster method")
+
+    # We load the wordlist only once, and pass the data to LexStat and Partial objects:
+    wl = sb().wl()
+    data = {idx: wl[idx] for idx in wl}
+    data[0] = wl.columns
+    args.log.info("loaded wordlist")
+    # Distance matrices are stored across runs, so only the first run computes alignments:
+    distances = DistanceStore(sb().dir / '.cache' / 'distances')
+
+    cis = ["F1 CI", "F2 CI"] if args.bootstrap else []
+    if not args.grid:
+        table = compare(
+            data, args.lexstat, args.partial, cluster_method, seed,
+            samples=args.bootstrap, workers=args.workers, distances=distances)
+        distances.evict()
+        with Table(
+                args, *["Threshold", "P1", "R1", "F1", "P2", "R2", "F2"] + cis,
+                floatfmt=".4f") as tab:
+            for row in table:
+                tab.append(row)
+        plot(table, args.lexstat, args.partial)
+        return
+
+    results = grid(
+        data, cluster_method, seed, samples=args.bootstrap, workers=args.workers,
+        distances=distances)
+    # The pool is joined, so no other process uses the distance store anymore:
+    distances.evict()
+
+    with Table(
+            args, *["Method", "Cognates", "Threshold", "P1", "R1", "F1", "P2", "R2", "F2"] + cis,
+            floatfmt=".4f") as tab:
+        for row in grid_rows(results):
+            tab.append(row)
+    for (lexstat, partial), table in results.items():
+        plot(table, lexstat, partial)
@@ -0,0 +1,58 @@
+"""
+Run makecldf for the seabor dataset, with options to tune the expensive computations.
+
+All options of `lexibank.makecldf` are supported. Once the CLDF data is written, it is also
+exported to SQLite and Parquet in `.cache/` (see `seabor.export`).
+"""
+from seaborcommands import DATASET_DIR, cldf_reader
+from seabor.export import export
+
+
+def register(parser):
+    from pylexibank.commands import makecldf
+
+    makecldf.register(parser)
+    parser.add_argument(
+        '--workers',
+        help="Number of worker processes to use for computing the LexStat scorer and bootstrap "
+             "samples",
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--seed',
+        help="Random seed (default: prompt for a seed when running interactively, else 1234)",
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--thresholds',
+        help="Thresholds for partial cognate detection and cross-family cognate detection, e.g. "
+             "as optimised with seabor.thresholds (default: 0.50 0.35)",
+        nargs=2,
+        type=float,
+        default=None)
+    parser.add_argument(
+        '--bootstrap',
+        help="Number of bootstrap samples (of concepts) to compute confidence intervals for the "
+             "evaluation scores",
+        type=int,
+        default=0)
+    parser.add_argument(
+        '--by-concept',
+        help="Detect cognates and borrowings on the required columns of the wordlist only, "
+             "merging partial cognates and detecting cross-family cognates one concept at a "
+             "time from partitions by concept in .cache/partitions",
+        action='store_true',
+        default=False)
+    parser.add_argument(
+        '--profile',
+        help="Write cProfile statistics for each stage of the analysis to profile/ (timings and "
+             "memory use per stage are always written to makecldf-profile.json)",
+        action='store_true',
+        default=False)
+
+
+def run(args):
+    from pylexibank.commands import makecldf
+
+    makecldf.run(args)
+    export(cldf_reader(), DATASET_DIR / '.cache', log=args.log)
@@ -0,0 +1,38 @@
+"""
+Serve queries about the CLDF data over HTTP, from memory - see `seabor.service`.
+
+E.g. `curl http://127.0.0.1:8765/admixture/Changsha?conceptlist=Swadesh-1955-100`
+"""
+from cldfbench.cli_util import add_catalog_spec, IGNORE_MISSING
+
+from seaborcommands import DATASET_DIR
+from seabor.service import Service, serve
+
+
+def register(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument(
+        '--interval',
+        help="Check for changes of the CLDF data at most every INTERVAL seconds",
+        type=float,
+        default=1.0)
+    # Concept lists are looked up in the cache, this catalog or online - in this order:
+    add_catalog_spec(parser, 'concepticon', default=IGNORE_MISSING)
+
+
+def run(args):
+    service = Service(
+        DATASET_DIR / 'cldf' / 'cldf-metadata.json',
+        interval=args.interval,
+        concepticon=args.concepticon.dir if args.concepticon else None,
+        log=args.log)
+    server = serve(service, host=args.host, port=args.port)
+    args.log.info('serving {0} forms on http://{1}:{2}'.format(
+        service.status()['forms'], *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:  # pragma: no cover
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,104 @@
+"""
+Optimise the thresholds for partial cognate detection and cross-family cognate detection.
+
+Pairs of thresholds are searched coarse-to-fine (see `seabor.thresholds`), maximising the B-cubed
+F-scores against the expert judgements. The search is cross-validated over concepts: for each
+fold, thresholds are optimised on the other folds and scored on the held-out concepts. Finally,
+the thresholds are optimised on all concepts - these can be passed to
+`cldfbench seabor.makecldf --thresholds`.
+"""
+import numpy as np
+from clldutils.clilib import Table, add_format
+
+# The keys of `seabor.thresholds.OBJECTIVES` - which is only imported in `run`, since it imports
+# lingpy:
+OBJECTIVE_NAMES = ['cognates', 'borrowings', 'mean']
+
+
+def register(parser):
+    add_format(parser, default='simple')
+    parser.add_argument(
+        '--objective',
+        help="Score to maximise: the F-score of cognate detection, of borrowing detection or the "
+             "mean of both",
+        choices=OBJECTIVE_NAMES,
+        default='mean')
+    parser.add_argument(
+        '--folds',
+        help="Number of folds of concepts for cross-validation",
+        type=int,
+        default=5)
+    parser.add_argument(
+        '--bounds',
+        help="Lower and upper bound for the thresholds",
+        nargs=2,
+        type=float,
+        default=[0.1, 0.9])
+    parser.add_argument(
+        '--step',
+        help="Step size of the initial grid of thresholds",
+        type=float,
+        default=0.1)
+    parser.add_argument(
+        '--levels',
+        help="Number of grids to search, halving the step size for each refinement",
+        type=int,
+        default=3)
+    parser.add_argument(
+        '--runs',
+        help="Number of permutations to compute the LexStat scorer",
+        type=int,
+        default=10000)
+    parser.add_argument(
+        '--workers',
+        help="Number of worker processes to compute the LexStat scorer and to detect cross-family "
+             "cognates",
+        type=int,
+        default=1)
+    parser.add_argument('--seed', type=int, default=1234)
+
+
+def run(args):
+    from lexibank_seabor import Dataset, THRESHOLDS
+    from seabor.distances import DistanceStore
+    from seabor.thresholds import ThresholdEvaluation, OBJECTIVES, search, folds
+
+    ds = Dataset()
+    distances = DistanceStore(ds.dir / '.cache' / 'distances')
+    ev = ThresholdEvaluation(
+        ds.wl(),
+        seed=args.seed,
+        runs=args.runs,
+        workers=args.workers,
+        checkpoint=ds.dir / '.cache' / 'scorer',
+        distances=distances)
+    objective = OBJECTIVES[args.objective]
+
+    def optimise(weights):
+        return search(
+            lambda t1, t2: objective(*ev.fscores(t1, t2, weights=weights)),
+            bounds=tuple(args.bounds),
+            step=args.step,
+            levels=args.levels)
+
+    rows, scores = [], []
+    for i, fold in enumerate(folds(len(ev.concepts), args.folds, seed=args.seed)):
+        (t1, t2), _ = optimise(~fold)
+        test = ev.fscores(t1, t2, weights=fold)
+        scores.append(objective(*test))
+        rows.append(['fold {0}'.format(i + 1), t1, t2] + list(ev.fscores(t1, t2, weights=~fold)) +
+                    list(test))
+        args.log.info('fold {0}: thresholds {1:.4f} {2:.4f}'.format(i + 1, t1, t2))
+
+    (t1, t2), _ = optimise(None)
+    with Table(
+            args,
+            'thresholds', 't1', 't2', 'F1 train', 'F2 train', 'F1 test', 'F2 test',
+            floatfmt='.4f') as tab:
+        for row in rows:
+            tab.append(row)
+        tab.append(['optimised', t1, t2] + list(ev.fscores(t1, t2)) + ['', ''])
+        tab.append(['makecldf'] + list(THRESHOLDS) + list(ev.fscores(*THRESHOLDS)) + ['', ''])
+    print('\nCross-validated {0} F-score: {1:.4f} (+/- {2:.4f})'.format(
+        args.objective, np.mean(scores), np.std(scores)))
+    distances.evict()
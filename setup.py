@@ -4,8 +4,10 @@ from setuptools import setup
 setup(
     name='lexibank_seabor',
     py_modules=['lexibank_seabor'],
+    packages=['seabor', 'seaborcommands'],
     include_package_data=True,
     zip_safe=False,
+    python_requires='>=3.8',
     entry_points={
         'lexibank.dataset': [
             'seabor=lexibank_seabor:Dataset',
@@ -15,18 +17,22 @@ setup(
         ]
     },
     install_requires=[
-        'pylexibank>=3.2.0',
+        'pylexibank>=3.2.0,<4',
         'lingrex>=1.1.0',
         'cldfviz>=0.5.0',
         'collabutils',
         'cartopy',
         'matplotlib',
         'python-igraph',
+        'numpy',
         'scipy',
     ],
     extras_require={
         'test': [
             'pytest-cldf',
         ],
+        'parquet': [
+            'pyarrow',
+        ],
     },
 )
@@ -1,3 +1,902 @@
+import collections
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def wordlist_data():
+    """
+    Factory for the data of the wordlist, restricted to its first `concepts` concepts, to be passed
+    to `lingpy.Wordlist`. Each call returns a new copy, since lingpy modifies the data passed in.
+    """
+    from lexibank_seabor import Dataset
+
+    wl = Dataset().wl()
+
+    def data(concepts):
+        selected = set(wl.rows[:concepts])
+        res = {idx: list(wl[idx]) for idx in wl if wl[idx, 'concept'] in selected}
+        res[0] = list(wl.columns)
+        return res
+    return data
+
 
 def test_valid(cldf_dataset, cldf_logger):
     assert cldf_dataset.validate(log=cldf_logger)
+
+
+def test_distribution_scorer(cldf_dataset):
+    from seaborcommands.distribution import Scorer
+
+    concepts = collections.OrderedDict(
+        [(r['Concepticon_Gloss'], r['ID']) for r in cldf_dataset.iter_rows('ParameterTable')])
+    allforms = collections.OrderedDict([
+        (f['ID'], f) for f in
+        sorted(cldf_dataset['FormTable'], key=lambda f: (f['Language_ID'], f['Parameter_ID']))])
+    forms_by_borid, borid_by_formid = collections.defaultdict(list), {}
+    for row in cldf_dataset['BorrowingTable']:
+        if row['Xenolog_Cluster_ID'].startswith('auto-'):
+            forms_by_borid[row['Xenolog_Cluster_ID']].append(allforms[row['Target_Form_ID']])
+            borid_by_formid[row['Target_Form_ID']] = row['Xenolog_Cluster_ID']
+
+    scorer = Scorer(allforms.values(), forms_by_borid, borid_by_formid, concepts)
+    assert round(scorer(concepts), 2) == 0.73
+    subset = list(concepts)[:50]
+    mask = scorer.mask(subset)
+    assert scorer.scores([mask, ~mask])[0] == scorer(subset)
+
+
+def test_permutation_test():
+    import numpy as np
+    from seabor.permutation import permutation_test
+
+    weights = np.arange(12, dtype=float)
+
+    def statistic(masks):
+        return masks @ weights
+
+    exact, observed = permutation_test(statistic, [7, 9, 11], 12)
+    assert exact.exact and observed == 27
+    assert exact.pvalue == sum(
+        1 for i in range(12) for j in range(i + 1, 12) for k in range(j + 1, 12)
+        if i + j + k >= 27) / 220
+
+    res, _ = permutation_test(statistic, [7, 9, 11], 12, permutations=100, precision=0, seed=1)
+    assert not res.exact and res.permutations == 100
+    res, _ = permutation_test(statistic, [7, 9, 11], 12, permutations=100000, seed=1)
+    assert res.lower <= exact.pvalue <= res.upper and res.upper - res.lower <= 0.01
+    assert res.permutations < 100000
+
+
+def test_index(cldf_dataset, tmp_path):
+    from seabor.index import Index
+    from seaborcommands.distribution import Scorer
+
+    index = Index.load(cldf_dataset, tmp_path / 'index.npz')
+    assert (tmp_path / 'index.npz').exists()
+    assert index.digest == Index.load(cldf_dataset, tmp_path / 'index.npz').digest
+
+    lidx, cidx = index.language_index['Changsha'], index.concept_index['all']
+    forms = [str(index.form_ids[i]) for i in index.forms(lidx, cidx)]
+    assert forms and all(fid.startswith('Changsha-all-') for fid in forms)
+    form_xenolog, sizes = index.xenologs('auto-')
+    assert all(str(index.xenolog_ids[i]).startswith('auto-') for i in form_xenolog if i >= 0)
+    # Expert and automatic clusters are looked up separately:
+    form_expert, _ = index.xenologs('expert-')
+    assert all(str(index.xenolog_ids[i]).startswith('expert-') for i in form_expert if i >= 0)
+    assert round(Scorer.from_index(index)(index.concept_glosses), 2) == 0.73
+
+
+def test_export(cldf_dataset, tmp_path):
+    import numpy as np
+    from seabor.index import Index
+    from seabor.export import connect, query
+
+    db = connect(cldf_dataset, tmp_path / 'cldf.sqlite3')
+    xenologs = query(db, 'borrowings', ['Xenolog_Cluster_ID'], Xenolog_Cluster_ID='auto-')
+    assert xenologs and len(xenologs) == sum(
+        1 for r in cldf_dataset['BorrowingTable'] if r['Xenolog_Cluster_ID'].startswith('auto-'))
+    assert not query(db, 'cognates', Cognateset_ID='auto*')
+    assert query(db, 'languages', Family='Sino-Tibetan')[0]['Latitude'] > 0
+
+    index = Index.load(cldf_dataset, tmp_path / 'index.npz', export=tmp_path / 'cldf.sqlite3')
+    expected = Index.from_cldf(cldf_dataset)
+    assert index.digest == expected.digest
+    assert all(np.array_equal(getattr(index, n), getattr(expected, n)) for n in Index.arrays)
+
+
+def test_concepticon_glosses(tmp_path):
+    from seabor.conceptlists import concepticon_glosses
+
+    tmp_path.joinpath('Swadesh-1955-100.txt').write_text('I\nYOU', encoding='utf8')
+    assert concepticon_glosses('Swadesh-1955-100', tmp_path) == ['I', 'YOU']
+
+    # Concept lists are read from the catalog passed in, and added to the cache:
+    catalog = tmp_path / 'concepticon'
+    catalog.joinpath('concepticondata', 'conceptlists').mkdir(parents=True)
+    catalog.joinpath('concepticondata', 'conceptlists', 'Test-2000-2.tsv').write_text(
+        'ID\tCONCEPTICON_GLOSS\nTest-2000-2-1\tALL\nTest-2000-2-2\tNAME', encoding='utf8')
+    assert concepticon_glosses('Test-2000-2', tmp_path / 'cache', catalog=catalog) == \
+        ['ALL', 'NAME']
+    assert tmp_path.joinpath('cache', 'Test-2000-2.txt').exists()
+
+    # Concept lists without Concepticon glosses are cached, too:
+    catalog.joinpath('concepticondata', 'conceptlists', 'Test-2000-3.tsv').write_text(
+        'ID\tCONCEPTICON_GLOSS\nTest-2000-3-1\t', encoding='utf8')
+    for _ in range(2):
+        assert concepticon_glosses('Test-2000-3', tmp_path / 'cache', catalog=catalog) == []
+
+    with pytest.raises(ValueError):
+        concepticon_glosses('Unknown-2000-2', tmp_path / 'cache', catalog=catalog)
+
+    with pytest.raises(ValueError):
+        concepticon_glosses('../concepticon/Test-2000-2', tmp_path / 'cache', catalog=catalog)
+
+
+def test_cross_family_clusters(cldf_dataset):
+    from seabor.index import Index
+    from seaborcommands.clustermaps import cross_family_clusters
+
+    clusters = cross_family_clusters(Index.from_cldf(cldf_dataset))
+    assert ('name', '146') in clusters and ('flower', '88') in clusters
+
+
+def test_admixture(cldf_dataset):
+    import numpy as np
+    from seabor.index import Index
+    from seabor.admixture import Admixture
+
+    index = Index.from_cldf(cldf_dataset)
+    admixture = Admixture(index)
+    selections = [list(range(50)), list(range(50, len(index.concept_ids)))]
+    masks = np.zeros((2, len(index.concept_ids)), dtype=bool)
+    for mask, selection in zip(masks, selections):
+        mask[selection] = True
+    matrix = admixture.matrix(masks)
+    assert np.allclose(matrix.sum(axis=2), 1)
+    for props, selection in zip(matrix, selections):
+        res = admixture.proportions(selection)
+        for lid, row in zip(admixture.language_ids, props):
+            assert res[lid][1] == len(selection)
+            assert np.allclose(
+                [res[lid][0][c] for c in admixture.categories], row)
+    assert 'Hmong-Mien--Sino-Tibetan' in admixture.categories
+    # An empty selection has no proportions - rather than NaN:
+    assert not admixture.matrix(np.zeros((1, len(index.concept_ids)), dtype=bool)).any()
+    assert not any(props for props, _ in admixture.proportions([]).values())
+
+
+def test_map_icons(cldf_dataset, tmp_path):
+    import re
+    import json
+    import argparse
+    from plots import Map, quantize
+
+    assert quantize([0.5, 0.26, 0.24], steps=4) == [2, 1, 1]
+    assert sum(quantize([1 / 3, 1 / 3, 1 / 3, 0.01])) == 36
+
+    args = argparse.Namespace(output=tmp_path / 'map.html', format='html', markersize=10)
+    map_ = Map(cldf_dataset, args, 'name', '146')
+    keys = [map_(None, language).icon for language in map_.languages.values()]
+    # Markers of the same family share one icon:
+    assert len(set(keys)) < len(keys)
+    # Icons are inlined once each, with the legend:
+    fig = argparse.Namespace(legend='')
+    map_.legend(fig, None, None)
+    icons = json.loads(re.search(r'var ICONS = (.+);', fig.legend).group(1))
+    assert set(icons) == set(keys)
+    assert all(url.startswith('data:image/svg+xml') for url in icons.values())
+    assert not list(tmp_path.iterdir())
+
+    # Without a legend, markers carry their icons:
+    args.no_legend = True
+    assert all(
+        map_(None, language).icon.startswith('data:') for language in map_.languages.values())
+
+
+def test_service(tmp_path):
+    import json
+    import time
+    import shutil
+    import threading
+    import urllib.error
+    import urllib.request
+    import concurrent.futures
+    from lexibank_seabor import Dataset
+    from seabor.service import Service, serve
+
+    shutil.copytree(str(Dataset().cldf_dir), str(tmp_path / 'cldf'))
+    tmp_path.joinpath('.cache', 'conceptlists').mkdir(parents=True)
+    tmp_path.joinpath('.cache', 'conceptlists', 'Test-2000-2.txt').write_text(
+        'ALL\nNAME', encoding='utf8')
+    tmp_path.joinpath('.cache', 'conceptlists', 'Test-2000-1.txt').write_text(
+        'NO SUCH CONCEPT', encoding='utf8')
+    server = serve(Service(tmp_path / 'cldf' / 'cldf-metadata.json', interval=0), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get(path):
+        try:
+            with urllib.request.urlopen('http://{0}:{1}/{2}'.format(
+                    *server.server_address[:2], path)) as res:
+                return json.loads(res.read().decode('utf8'))
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        form = get('forms/Changsha-aubergine-1')
+        assert form['language'] == 'Changsha' and form['family'] == 'Sino-Tibetan'
+        assert any(x['id'].startswith('auto-') for x in form['xenologs'])
+        xenolog = get('xenologs/{0}'.format(form['xenologs'][0]['id']))
+        assert 'Changsha-aubergine-1' in xenolog['forms']
+        adm = get('admixture/Changsha?conceptlist=Test-2000-2')
+        assert adm['concepts'] == 2 and abs(sum(adm['proportions'].values()) - 1) < 1e-9
+        # None of the concepts is in the data:
+        assert get('admixture/Changsha?conceptlist=Test-2000-1') == dict(
+            language='Changsha', conceptlist='Test-2000-1', concepts=0, proportions={})
+        assert get('forms/xyz') == 404
+        # Concept list IDs must not be paths:
+        for conceptlist in ['../Test-2000-2', '..%2F..%2Fcldf%2Fforms', 'Test-2000-2/../x']:
+            assert get('admixture/Changsha?conceptlist={0}'.format(conceptlist)) == 400
+        assert sorted(p.name for p in tmp_path.joinpath('.cache', 'conceptlists').iterdir()) == \
+            ['Test-2000-1.txt', 'Test-2000-2.txt']
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            assert all(r['concepts'] == 250 for r in pool.map(get, ['admixture/Changsha'] * 32))
+
+        # Hot reload, when the CLDF data changes:
+        digest = get('status')['digest']
+        languages = tmp_path / 'cldf' / 'languages.csv'
+        languages.write_text(
+            languages.read_text(encoding='utf8').replace(
+                ',Sino-Tibetan,beidasinitic,长沙,', ',Tai-Kadai,beidasinitic,长沙,'),
+            encoding='utf8')
+        for _ in range(600):
+            if get('status')['digest'] != digest:
+                break
+            time.sleep(0.1)
+        assert get('forms/Changsha-aubergine-1')['family'] == 'Tai-Kadai'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_external_cognates(tmp_path, wordlist_data):
+    import lingrex.borrowing
+    from lingpy import Wordlist
+    from seabor.cache import Cache
+    from seabor.borrowing import external_cognates
+    from seabor.distances import DistanceStore
+    from seabor.profiling import Profiler, stage
+
+    data = wordlist_data(10)
+    wl = Wordlist(data)
+
+    lingrex.borrowing.external_cognates(wl, cognates='cogid', ref='expected', threshold=0.35)
+    cache = Cache(tmp_path)
+    for ref in ['computed', 'cached']:
+        external_cognates(wl, cognates='cogid', ref=ref, threshold=0.35, cache=cache)
+        assert all(wl[idx, ref] == wl[idx, 'expected'] for idx in wl)
+    external_cognates(wl, cognates='cogid', ref='parallel', threshold=0.35, workers=2)
+    assert all(wl[idx, 'parallel'] == wl[idx, 'expected'] for idx in wl)
+
+    # Distances computed by worker processes are stored by the main process:
+    store = DistanceStore(tmp_path / 'distances')
+    for i in range(2):
+        with Profiler() as profiler:
+            with stage('external_cognates'):
+                external_cognates(
+                    wl, cognates='cogid', ref='stored{0}'.format(i), threshold=0.35, workers=2,
+                    distances=store)
+        assert all(wl[idx, 'stored{0}'.format(i)] == wl[idx, 'expected'] for idx in wl)
+        assert (profiler.report()['stages'][0]['counts']['alignments'] > 0) == (i == 0)
+
+
+def test_cache(tmp_path, wordlist_data):
+    import os
+    from lingpy import Wordlist
+    from seabor.cache import Cache, wordlist_digest
+
+    data = wordlist_data(3)
+    wl = Wordlist({k: list(v) for k, v in data.items()})
+    digest = wordlist_digest(wl)
+    assert wordlist_digest(Wordlist({k: list(v) for k, v in data.items()})) == digest
+
+    cache = Cache(tmp_path)
+    key = cache.key(digest, 'stage', threshold=0.5)
+    assert not cache.load(wl, key)
+    wl.add_entries('result', 'concept', lambda x: x.upper())
+    cache.dump(wl, key, 'result')
+    wl = Wordlist({k: list(v) for k, v in data.items()})
+    assert cache.load(wl, key)
+    assert all(wl[idx, 'result'] == wl[idx, 'concept'].upper() for idx in wl)
+
+    # Changing the data or the parameters yields another key:
+    data[sorted(data)[1]][wl.header['tokens']] = ['a']
+    changed = wordlist_digest(Wordlist({k: list(v) for k, v in data.items()}))
+    assert changed != digest
+    assert cache.get(cache.key(changed, 'stage', threshold=0.5)) is None
+    assert cache.get(cache.key(digest, 'stage', threshold=0.4)) is None
+
+    # The least recently used entries are evicted:
+    cache = Cache(tmp_path / 'lru')
+    for i, k in enumerate('abc'):
+        cache.set(k, {'x': k * 100})
+        os.utime(str(cache._fname(k)), (i + 1, i + 1))
+    assert cache.get('a')
+    cache.maxsize = sum(cache._fname(k).stat().st_size for k in 'ac')
+    cache.evict()
+    assert cache.get('a') and cache.get('c') and cache.get('b') is None
+
+
+def test_detect_cache(tmp_path, monkeypatch, wordlist_data):
+    import lingrex.cognates
+    from lingpy import Wordlist
+    from lexibank_seabor import Dataset
+    import seabor.cache
+    import seabor.scorer
+    import seabor.borrowing
+
+    calls = collections.Counter()
+
+    def counted(module, name):
+        func = getattr(module, name)
+
+        def wrapper(*args, **kw):
+            calls[name] += 1
+            return func(*args, **kw)
+        monkeypatch.setattr(module, name, wrapper)
+
+    counted(seabor.scorer, 'internal_cognates')
+    counted(lingrex.cognates, 'common_morpheme_cognates')
+    counted(seabor.borrowing, 'external_cognates')
+    # Caches must only be cleaned up by the callers of detect, once all detections are done:
+    monkeypatch.setattr(
+        seabor.cache.Cache, 'evict', lambda self: pytest.fail('detect evicted a cache'))
+
+    ds = Dataset()
+    data = wordlist_data(3)
+    ds.dir = tmp_path
+
+    def detect(**kw):
+        calls.clear()
+        wl = Wordlist({k: list(v) for k, v in data.items()})
+        ds.detect(wl, runs=10, **kw)
+        return [wl[idx, 'autoborid'] for idx in sorted(wl)], dict(calls)
+
+    borids, stages = detect()
+    assert stages == {
+        'internal_cognates': 1, 'common_morpheme_cognates': 1, 'external_cognates': 1}
+    # Unchanged data and parameters: All stages are loaded from the cache.
+    assert detect() == (borids, {})
+    # Changing the parameters of the first stage invalidates the downstream stages, too:
+    assert set(detect(thresholds=(0.45, 0.35))[1]) == set(stages)
+    # Changing the parameters of the last stage only re-runs the last stage:
+    assert set(detect(thresholds=(0.45, 0.3))[1]) == {'external_cognates'}
+
+
+def test_scorer_workers(tmp_path, wordlist_data):
+    import random
+    import argparse
+    import lingrex.borrowing
+    from lingpy import Wordlist
+    from seabor.cache import Cache
+    from seabor.scorer import _scored_partial, internal_cognates
+
+    data = wordlist_data(10)
+    params = dict(
+        runs=50, threshold=0.5, smooth=1, ratio=(2, 1), vscale=0.5, restricted_chars='_',
+        modes=(('global', -1, 0.5), ('overlap', -1, 0.5)), ref='autocogids',
+        cluster_method='infomap', model='sca')
+
+    # The scorer - and hence the cognate sets - do not depend on the number of workers:
+    wl = Wordlist({k: list(v) for k, v in data.items()})
+    idxs = [idx for idx, f in wl.iter_rows('family') if f == 'Sino-Tibetan']
+    scorers = []
+    for workers in [1, 2]:
+        random.seed(1234)
+        scorers.append(_scored_partial(wl, idxs, workers, None, **params).cscorer)
+    assert scorers[0].chars2int == scorers[1].chars2int
+    assert scorers[0].matrix == scorers[1].matrix
+
+    # ... and they are the same as computed by lingrex, drawing from the same random state:
+    wl = Wordlist({k: list(v) for k, v in data.items()})
+    random.seed(1234)
+    lingrex.borrowing.internal_cognates(wl, partial=True, method='lexstat', **dict(
+        params, modes=list(params['modes'])))
+    expected = [wl[idx, 'autocogids'] for idx in sorted(wl)]
+    for workers in [1, 2]:
+        wl = Wordlist({k: list(v) for k, v in data.items()})
+        internal_cognates(wl, workers=workers, seed=1234, **params)
+        assert [wl[idx, 'autocogids'] for idx in sorted(wl)] == expected
+
+    # Families loaded from the cache leave the random state as if they were analysed:
+    cache = Cache(tmp_path)
+    for _ in range(2):
+        wl = Wordlist({k: list(v) for k, v in data.items()})
+        internal_cognates(wl, seed=1234, cache=cache, **params)
+        assert [wl[idx, 'autocogids'] for idx in sorted(wl)] == expected
+    # Changing the data of the last family only re-analyses this family:
+    family, value = data[0].index('family'), data[0].index('value')
+    last = max(row[family] for k, row in data.items() if k)
+    changed = {k: list(v) for k, v in data.items()}
+    for k, row in changed.items():
+        if k and row[family] == last:
+            row[value] += 'x'
+    messages = []
+    wl = Wordlist(changed)
+    internal_cognates(
+        wl, seed=1234, cache=cache, log=argparse.Namespace(info=messages.append), **params)
+    assert len(messages) == len({row[family] for k, row in data.items() if k}) - 1
+    assert [wl[idx, 'autocogids'] for idx in sorted(wl) if wl[idx, 'family'] != last] == \
+        [c for idx, c in zip(sorted(wl), expected) if wl[idx, 'family'] != last]
+
+
+def test_thresholds(tmp_path, wordlist_data):
+    import lingrex.cognates
+    from lingpy import Wordlist
+    from seabor.scorer import internal_cognates
+    from seabor.borrowing import external_cognates, own_clusters
+    from seabor.distances import DistanceStore
+    from seabor.evaluate import Evaluation
+    from seabor.thresholds import ThresholdEvaluation, search, folds
+
+    assert search(lambda t1, t2: -abs(t1 - 0.3) - abs(t2 - 0.675)) == ((0.3, 0.675), 0.0)
+    masks = folds(10, 3)
+    assert masks.shape == (3, 10) and (masks.sum(axis=0) == 1).all()
+
+    data = wordlist_data(10)
+    distances = DistanceStore(tmp_path)
+
+    wl = Wordlist({k: list(v) for k, v in data.items()})
+    internal_cognates(
+        wl, runs=10, threshold=0.4, cluster_method='upgma', ref='autocogids', distances=distances)
+    lingrex.cognates.common_morpheme_cognates(
+        wl, ref='autocogid', cognates='autocogids', morphemes='automorphemes')
+    external_cognates(wl, cognates='autocogid', ref='autoborid', threshold=0.3)
+    idxs = list(wl)
+    wl.add_entries('gold', dict(zip(idxs, own_clusters([wl[i, 'uborid'] for i in idxs]))), str)
+    wl.add_entries('test', dict(zip(idxs, own_clusters([wl[i, 'autoborid'] for i in idxs]))), str)
+    expected = [
+        float(Evaluation(wl, gold, [test], by='concept').scores()[0, 2])
+        for gold, test in [('ucogid', 'autocogid'), ('gold', 'test')]]
+
+    ev = ThresholdEvaluation(
+        Wordlist({k: list(v) for k, v in data.items()}),
+        runs=10,
+        cluster_method='upgma',
+        distances=distances)
+    assert list(ev.fscores(0.4, 0.3)) == expected
+    assert ev.fscores(0.6, 0.3)[1] != expected[1]
+
+
+def test_threshold_sweep(wordlist_data):
+    from lingpy import LexStat
+    from lingpy.compare.partial import Partial
+    from seabor.sweep import ThresholdSweep
+
+    data = wordlist_data(5)
+    thresholds = [0.1, 0.3, 0.45, 0.6, 0.8]
+
+    # The memoized sweep yields the same cognate sets as clustering from scratch, for each
+    # threshold:
+    for cls, method in [(LexStat, 'cluster'), (Partial, 'partial_cluster')]:
+        for cluster_method in ['upgma', 'single', 'complete']:
+            sweep = ThresholdSweep(
+                cls({k: list(v) for k, v in data.items()}), cluster_method=cluster_method)
+            for i, t in enumerate(thresholds):
+                lex = cls({k: list(v) for k, v in data.items()})
+                getattr(lex, method)(
+                    method='sca', threshold=t, ref='expected', cluster_method=cluster_method)
+                getattr(sweep, method)(method='sca', threshold=t, ref='sweep_{0}'.format(i))
+                assert all(
+                    sweep.lex[idx, 'sweep_{0}'.format(i)] == lex[idx, 'expected'] for idx in lex)
+
+
+def test_grid(tmp_path, wordlist_data):
+    import argparse
+    from seabor.distances import DistanceStore
+    from seaborcommands import fullcomparison
+
+    parser = argparse.ArgumentParser()
+    fullcomparison.register(parser)
+    args = parser.parse_args(['--grid', '--workers', '2', '--bootstrap', '5'])
+    assert args.grid and args.workers == 2 and args.bootstrap == 5
+    assert not (args.lexstat or args.partial)
+
+    data = wordlist_data(3)
+    distances = DistanceStore(tmp_path / 'distances')
+
+    # A small grid - SCA only, to skip the expensive LexStat scorers:
+    combinations = [(False, True), (False, False)]
+    results = fullcomparison.grid(
+        data, 'upgma', 1234, combinations=combinations, workers=2, distances=distances)
+    assert list(results) == combinations
+    # Each combination yields the same table as a separate, serial run:
+    for lexstat, partial in combinations:
+        assert results[lexstat, partial] == fullcomparison.compare(
+            data, lexstat, partial, 'upgma', 1234)
+
+    rows = fullcomparison.grid_rows(results)
+    n = len(fullcomparison.THRESHOLDS)
+    assert len(rows) == 2 * n
+    assert [row[:2] for row in rows] == [['SCA', 'partial']] * n + [['SCA', 'full']] * n
+    assert [row[2:] for row in rows[n:]] == results[False, False]
+
+
+def test_distances(tmp_path, wordlist_data):
+    import lingrex.borrowing
+    from lingpy import Wordlist, LexStat
+    from seabor.borrowing import external_cognates
+    from seabor.distances import DistanceStore
+    from seabor.profiling import Profiler, stage
+
+    data = wordlist_data(5)
+    # lingpy modifies the data passed in, so we pass copies:
+    wl = Wordlist({k: list(v) for k, v in data.items()})
+
+    store, counts = DistanceStore(tmp_path), []
+    for i, threshold in enumerate([0.35, 0.35, 0.5]):
+        expected, computed = 'expected{0}'.format(i), 'computed{0}'.format(i)
+        lingrex.borrowing.external_cognates(
+            wl, cognates='cogid', ref=expected, threshold=threshold)
+        with Profiler() as profiler:
+            with stage('external_cognates'):
+                external_cognates(
+                    wl, cognates='cogid', ref=computed, threshold=threshold, distances=store)
+        assert all(wl[idx, computed] == wl[idx, expected] for idx in wl)
+        counts.append(profiler.report()['stages'][0]['counts'])
+    # Only the first run computes alignments:
+    assert counts[0]['alignments'] > 0 and counts[1] == counts[2] == {'alignments': 0}
+
+    lex = LexStat({k: list(v) for k, v in data.items()})
+    lex.cluster(method='sca', threshold=0.45, ref='scaid')
+    expected = [lex[idx, 'scaid'] for idx in lex]
+    counts = []
+    for _ in range(2):
+        lex = LexStat({k: list(v) for k, v in data.items()})
+        store.wrap(lex)
+        with Profiler() as profiler:
+            with stage('cluster'):
+                lex.cluster(method='sca', threshold=0.45, ref='scaid')
+        assert [lex[idx, 'scaid'] for idx in lex] == expected
+        counts.append(profiler.report()['stages'][0]['counts'])
+    # Computing the distance matrices aligns all pairs of words of a concept - once:
+    n = [len(lex.get_list(row=c, flat=True)) for c in lex.rows]
+    assert counts == [{'alignments': sum(i * (i - 1) // 2 for i in n)}, {}]
+
+
+def test_own_clusters():
+    from seabor.borrowing import own_clusters
+
+    assert own_clusters(['0', '3', '0', '1']) == [4, 3, 5, 1]
+    assert own_clusters([]) == []
+
+
+def test_bcubes(wordlist_data):
+    from lingpy import Wordlist
+    from lingpy.evaluate.acd import bcubes
+    from seabor.evaluate import Evaluation
+
+    data = wordlist_data(20)
+    wl = Wordlist(data)
+    wl.add_entries('lumpid', 'concept', lambda x: x)
+
+    tests = ['cogid', 'uborid', 'lumpid']
+    ev = Evaluation(wl, 'ucogid', tests)
+    for test, scores in zip(tests, ev.scores()):
+        assert all(abs(x - y) < 1e-12 for x, y in zip(
+            scores, bcubes(wl, 'ucogid', test, pprint=False)))
+
+    ev = Evaluation(wl, 'ucogid', tests, by='concept')
+    assert len(ev.groups) == 20 and ev.breakdown().shape == (3, 20, 3)
+    assert ev.breakdown()[2, :, 1].min() == 1
+
+
+def test_bootstrap():
+    from lexibank_seabor import Dataset
+    from seabor.evaluate import Evaluation, bootstrap
+
+    ev = Evaluation(Dataset().wl(), 'ucogid', ['cogid', 'ucogid'], by='concept')
+    cis = bootstrap(ev, 1200, seed=1)
+    assert cis.shape == (2, 3, 2)
+    assert (cis[0, :, 0] <= ev.scores()[0]).all() and (ev.scores()[0] <= cis[0, :, 1]).all()
+    assert (cis[1] == 1).all()
+    assert (bootstrap(ev, 1200, seed=1, workers=2) == cis).all()
+
+
+def test_consensus():
+    from seabor.evaluate import consensus
+
+    partitions = [[1, 1, 2, 3, 0], [1, 1, 1, 4, 0], [5, 5, 6, 6, 6]]
+    assert consensus(partitions, ['a'] * 5) == [1, 1, 2, 3, 4]
+    assert consensus(partitions, ['a'] * 5, unassigned=0) == [1, 1, 0, 0, 0]
+    assert consensus(partitions, ['a', 'b', 'a', 'b', 'b']) == [1, 2, 3, 4, 5]
+
+
+def test_partitions(tmp_path):
+    import lingrex.cognates
+    from lexibank_seabor import Dataset
+    from seabor.stream import Partitions, by_concept
+
+    ds = Dataset()
+    wl = ds.wl(['doculect', 'concept', 'cogids'])
+    assert wl.columns == ['cogids', 'concept', 'doculect'] and wl[9, 'cogids'] == [5, 6]
+    lingrex.cognates.common_morpheme_cognates(wl, cognates='cogids', ref='autocogid')
+
+    partitions = Partitions(
+        ds.raw_dir / ds._wlname, ['doculect', 'concept', 'cogids'], tmp_path, buffer=100)
+    assert partitions.concepts == wl.rows
+    by_concept(
+        partitions,
+        lingrex.cognates.common_morpheme_cognates,
+        'autocogid',
+        size=lambda w: len({cogid for idx in w for cogid in w[idx, 'cogids']}),
+        cognates='cogids')
+    for concept, w in partitions:
+        assert all(w[idx, 'autocogid'] == wl[idx, 'autocogid'] for idx in w)
+        assert all(w[idx, 'automorphemes'] == wl[idx, 'automorphemes'] for idx in w)
+
+
+def test_detect_by_concept(tmp_path, monkeypatch, wordlist_data):
+    import gc
+    import weakref
+    import lingrex.cognates
+    from lingpy import Wordlist
+    from lexibank_seabor import Dataset
+    import seabor.stream
+    import seabor.borrowing
+
+    loaded = []
+
+    def wordlist(self, concept):
+        res = wordlist.orig(self, concept)
+        loaded.append(weakref.ref(res))
+        return res
+    wordlist.orig = seabor.stream.Partitions.wordlist
+    monkeypatch.setattr(seabor.stream.Partitions, 'wordlist', wordlist)
+
+    def one_partition(module, name):
+        func = getattr(module, name)
+
+        def wrapper(wl, **kw):
+            # The stage runs on one concept, with no other partition held in memory:
+            gc.collect()
+            assert len([ref for ref in loaded if ref() is not None]) == 1
+            assert len(wl.rows) == 1
+            return func(wl, **kw)
+        monkeypatch.setattr(module, name, wrapper)
+
+    ds = Dataset()
+    data = wordlist_data(5)
+    Wordlist({k: list(v) for k, v in data.items()}).output(
+        'tsv', filename=str(tmp_path / 'wordlist'), ignore='all', prettify=False)
+    partitions = seabor.stream.Partitions(
+        tmp_path / 'wordlist.tsv', ['doculect', 'concept', 'family', 'tokens'],
+        tmp_path / 'partitions')
+
+    cols = ['autocogid', 'automorphemes', 'autoborid']
+    results = []
+    for name, kw in [('memory', {}), ('by_concept', dict(partitions=partitions))]:
+        if kw:
+            one_partition(lingrex.cognates, 'common_morpheme_cognates')
+            one_partition(seabor.borrowing, 'external_cognates')
+        # Stages must not be loaded from the cache of the first run:
+        ds.dir = tmp_path / name
+        # With partitions, only the required columns are read:
+        wl = seabor.stream.read_wordlist(
+            tmp_path / 'wordlist.tsv', ds._detect_columns if kw else None)
+        ds.detect(wl, runs=10, **kw)
+        results.append([[wl[idx, col] for col in cols] for idx in sorted(wl)])
+    assert len(loaded) >= 2 * 5
+    assert results[0] == results[1]
+
+
+def test_detect_columns_memory():
+    import sys
+    import json
+    import subprocess
+    from lexibank_seabor import Dataset
+
+    # Peak memory is measured in a fresh process for each run, reading the raw wordlist - with
+    # all columns and with the columns read for `detect` only:
+    script = """
+import sys, json
+import lingpy, seabor.stream
+from lexibank_seabor import Dataset
+from seabor.profiling import Profiler, stage
+
+with Profiler() as profiler:
+    with stage('read'):
+        wl = Dataset().wl(json.loads(sys.argv[1]))
+print(profiler.stages['read']['peak_rss_mb'])
+"""
+    peaks = [
+        float(subprocess.check_output(
+            [sys.executable, '-c', script, json.dumps(columns)],
+            cwd=str(Dataset.dir)).decode('utf8'))
+        for columns in [None, Dataset._detect_columns]]
+    assert peaks[0] - peaks[1] > 20
+
+
+def test_profiler(tmp_path):
+    import json
+    from seabor.profiling import Profiler, stage, count
+
+    with stage('outside'):
+        count('alignments', 5)
+    with Profiler(pstats=tmp_path / 'profile') as profiler:
+        for _ in range(2):
+            with stage('detect'):
+                with stage('scorer'):
+                    count('alignments', 3)
+                count('alignments')
+    profiler.dump(tmp_path / 'profile.json')
+    report = json.loads(tmp_path.joinpath('profile.json').read_text(encoding='utf8'))
+    stages = {s['name']: s for s in report['stages']}
+    assert set(stages) == {'detect', 'scorer'}
+    assert stages['detect']['calls'] == 2 and stages['detect']['counts'] == {'alignments': 8}
+    assert stages['scorer']['parent'] == 'detect' and stages['scorer']['counts']['alignments'] == 6
+    assert tmp_path.joinpath('profile', 'detect.pstats').exists()
+
+    # Peak memory is measured per stage:
+    with Profiler() as profiler:
+        with stage('outer'):
+            with stage('large'):
+                data = b'x' * (100 * 1024 * 1024)
+                del data
+            with stage('small'):
+                pass
+    report = profiler.report()
+    stages = {s['name']: s for s in report['stages']}
+    assert stages['outer']['peak_rss_mb'] >= stages['large']['peak_rss_mb']
+    if report['peak_rss'] == 'per stage':
+        assert stages['large']['peak_rss_mb'] - stages['small']['peak_rss_mb'] > 50
+
+
+def test_benchmark(cldf_dataset):
+    from lexibank_seabor import Dataset
+    from seabor.index import Index
+    from seabor.admixture import proportions
+    from seabor.benchmark import scale_index, scale_wordlist, run
+    from seaborcommands.distribution import Scorer
+
+    index = Index.cached(cldf_dataset)
+    for axis in ['concept', 'doculect']:
+        scaled = scale_index(index, 3, axis=axis)
+        assert len(scaled.form_ids) == 3 * len(index.form_ids)
+        assert abs(Scorer.from_index(scaled)(Scorer.from_index(scaled).concepts) -
+                   Scorer.from_index(index)(Scorer.from_index(index).concepts)) < 1e-12
+        lid = str(index.language_ids[0])
+        assert proportions(scaled, range(len(scaled.concept_ids)))[lid][0] == \
+            proportions(index, range(len(index.concept_ids)))[lid][0]
+
+    data = scale_wordlist(Dataset().wl(), 2, concepts=2)
+    wl = Dataset().wl()
+    assert len(data) == 2 * len(wl.get_list(row=wl.rows[0], flat=True)) + \
+        2 * len(wl.get_list(row=wl.rows[1], flat=True)) + 1
+
+    results = run('admixture', 2, repeat=2)
+    assert results[0]['stage'] == 'proportions' and results[0]['forms'] == 2 * len(index.form_ids)
+
+
+def test_import_time():
+    import sys
+    import json
+    import subprocess
+
+    # cldfbench imports all command modules upon start-up - on top of cldfbench and pycldf, which
+    # it imports anyway. So the command modules must not import heavy dependencies:
+    code = """
+import sys, json, time, pkgutil, importlib
+import cldfbench.cli_util, clldutils.clilib, pycldf
+start = time.time()
+import seaborcommands
+for m in pkgutil.iter_modules(seaborcommands.__path__):
+    importlib.import_module('seaborcommands.' + m.name)
+print(json.dumps([time.time() - start, sorted(sys.modules)]))
+"""
+    seconds, modules = json.loads(subprocess.check_output([sys.executable, '-c', code]))
+    heavy = {
+        'lexibank_seabor', 'pylexibank', 'lingpy', 'lingrex', 'collabutils', 'igraph', 'networkx',
+        'scipy.stats', 'matplotlib', 'cartopy', 'cldfviz'}
+    assert not heavy.intersection(modules)
+    assert seconds < 0.5
+
+
+def test_write_wordlist(tmp_path, wordlist_data):
+    import argparse
+    import logging
+    from clldutils.misc import slug
+    from lingpy import Wordlist
+    import attr
+    from pylexibank import Lexeme
+    from lexibank_seabor import Dataset
+
+    class BIPA:
+        # Segments are analysed with CLTS when adding forms, which only affects the transcription
+        # report, so we stub the CLTS catalog by treating every segment as a known sound.
+        def __getitem__(self, segment):
+            return argparse.Namespace(source=segment)
+
+        def translate(self, segment, model):
+            return segment
+
+    clts = argparse.Namespace(api=argparse.Namespace(bipa=BIPA(), soundclass=lambda name: name))
+    if not attr.has(Lexeme):
+        pytest.skip('pylexibank>=4 does not support the attrs-based classes of the dataset')
+
+    ds = Dataset()
+    data = wordlist_data(3)
+    wl = Wordlist(data)
+    for col, source in [('autocogid', 'cogid'), ('autocogids', 'cogids'), ('autoborid', 'borid')]:
+        wl.add_entries(col, source, lambda x: x)
+    # Concepticon IDs would be validated against the Concepticon catalog:
+    c2cid = collections.defaultdict(str)
+
+    def per_row(writer):
+        # The writer as it was before forms, cognates and borrowings were added in batches:
+        concepts = set()
+        header = [k for k, _ in sorted(wl.header.items(), key=lambda i: i[1])]
+        for index in wl:
+            row = dict(zip(header, wl[index]))
+            if row['concept'] not in concepts:
+                writer.add_concept(
+                    ID=slug(row['concept']),
+                    Concepticon_Gloss=row['concept'].upper(),
+                    Concepticon_ID=c2cid[row['concept'].upper()],
+                    Name=row['concept_in_source'])
+                concepts.add(row['concept'])
+            lex = writer.add_form_with_segments(
+                ID='{}-{}'.format(row['dataset'], row['lexibank_id']),
+                Language_ID=row['doculect'],
+                Parameter_ID=slug(row['concept']),
+                Value=row['value'],
+                Form=row['form'],
+                Segments=row['tokens'],
+                ID_In_Source=row["lexibank_id"],
+                Source=row["dataset"],
+                Prosodic_String=row["structure"]
+            )
+            if row['ucogid'] and row['ucogid'] not in ('0', 0):
+                writer.add_cognate(
+                    lexeme=lex,
+                    Cognateset_ID='expert-{}'.format(row['ucogid']),
+                    Cognate_Detection_Method='expert')
+            if row['autocogid'] and row['autocogid'] not in ('0', 0):
+                writer.add_cognate(
+                    lexeme=lex,
+                    Cognateset_ID='auto-full-{}'.format(row['autocogid']),
+                    Cognate_Detection_Method='lingrex.cognates.common_morpheme_cognates')
+            if row['autocogids'] and row['autocogids'] not in ('0', 0):
+                for cogid in row['autocogids']:
+                    writer.add_cognate(
+                        lexeme=lex,
+                        Cognateset_ID='auto-partial-{}'.format(cogid),
+                        Cognate_Detection_Method='lingrex.borrowing.internal_cognates')
+            if row['uborid'] and row['uborid'] not in ('0', 0):
+                writer.objects['BorrowingTable'].append(dict(
+                    ID='expert-' + lex['ID'],
+                    Target_Form_ID=lex['ID'],
+                    Xenolog_Cluster_ID='expert-{}'.format(row['uborid']),
+                    Comment=row['source'],
+                ))
+            if row['autoborid'] and row['autoborid'] not in ('0', 0):
+                writer.objects['BorrowingTable'].append(dict(
+                    ID='auto-' + lex['ID'],
+                    Target_Form_ID=lex['ID'],
+                    Xenolog_Cluster_ID='auto-{}'.format(row['autoborid']),
+                ))
+
+    args = argparse.Namespace(log=logging.getLogger(__name__), clts=clts, dev=True)
+    for name, write in [
+        ('per_row', per_row),
+        ('batched', lambda writer: ds._write_wordlist(writer, wl, c2cid)),
+    ]:
+        spec = ds.cldf_specs()
+        spec.dir = tmp_path / name
+        with ds.cldf_writer(args, cldf_spec=spec) as writer:
+            writer.cldf.add_component('BorrowingTable', 'Xenolog_Cluster_ID')
+            write(writer)
+
+    for fname in ['forms.csv', 'parameters.csv', 'cognates.csv', 'borrowings.csv']:
+        assert tmp_path.joinpath('per_row', fname).read_bytes() == \
+            tmp_path.joinpath('batched', fname).read_bytes()